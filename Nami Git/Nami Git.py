@@ -1,565 +1,953 @@
-from telegram import Update
-from telegram.ext import Application, CommandHandler, CallbackContext, MessageHandler, filters, CallbackQueryHandler
-from telegram import ChatPermissions, Update
-from telegram import ChatMember
-from telegram import InputFile
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from fastapi import FastAPI
-import wikipediaapi
-import requests
-import yt_dlp
-import os
-import random
-import datetime
-import asyncio
-import re
-import time
-import aiohttp
-
-# Initialize the Wikipedia API with a user agent
-wiki = wikipediaapi.Wikipedia(
-    language='en',
-    user_agent='Nami/1.0 (glitchyboiiuwu@gmail.com)'
-)
-
-# Add dictionary
-async def define_word(update: Update, context: CallbackContext) -> None:
-    """Fetch and send the definition of a word using DictionaryAPI."""
-    if context.args:
-        word = " ".join(context.args)  # Combine all arguments into a single word
-        url = f"https://api.dictionaryapi.dev/api/v2/entries/en/{word}"
-        response = requests.get(url)
-
-        if response.status_code == 200:
-            data = response.json()
-            definitions = data[0].get("meanings", [])
-            if definitions:
-                reply = f"Definitions for *{word.capitalize()}*:\n\n"
-                for meaning in definitions:
-                    pos = meaning.get("partOfSpeech", "N/A")
-                    reply += f"_{pos}_:\n"  # Part of speech (e.g., noun, verb)
-                    for definition in meaning.get("definitions", []):
-                        reply += f"- {definition.get('definition')}\n"
-                await update.message.reply_text(reply, parse_mode="Markdown")
-            else:
-                await update.message.reply_text(f"Sorry, no definitions found for '{word}'.")
-        else:
-            await update.message.reply_text(f"Error: Unable to retrieve definition for '{word}'.")
-    else:
-        await update.message.reply_text("Please specify a word. Usage: /define <word>")
-
-# Define your custom commands
-async def start(update: Update, context: CallbackContext) -> None:
-    """Send a welcome message when the user starts the bot."""
-    await update.message.reply_text('Hello! I am your friendly bot. How can I assist you today?')
-
-async def help_command(update: Update, context: CallbackContext) -> None:
-    """Send a help message with bot commands."""
-    await update.message.reply_text('I can help you with the following commands:\n'
-                                    '/start - Welcome message\n'
-                                    '/help - List of commands\n'
-                                    '/Series -Get series recommendations\n'
-                                    '/Anime - Get anime recommendations\n'
-                                    '/download_video - Downloads a video link\n'
-                                    '/Search - Search a YouTube video without a link\n'
-                                    '/Music - Downloads music\n'
-                                    '/Wiki - Search Wikipedia\n'
-                                    '/define <word> - Get the definition of a word\n'
-                                    '/TMute - Mute a user for a specified time\n'
-                                    '/Unmute - Immediately unmutes a muted user\n'
-                                    '/Quote - Get a random quote\n'
-                                    '/Cat - Send a cat picture\n'
-                                    '/Flipcoin - Flip a coin to get either heads or tails')
-
-# AniList GraphQL API URL
-ANILIST_API_URL = "https://graphql.anilist.co"
-
-def fetch_trending_anime():
-    """Fetch trending anime from AniList."""
-    query = """
-    query {
-        Page(perPage: 10) {
-            media(type: ANIME, sort: TRENDING_DESC) {
-                title {
-                    romaji
-                    english
-                }
-                description
-                siteUrl
-                coverImage {
-                    large
-                }
-            }
-        }
-    }
-    """
-    response = requests.post(ANILIST_API_URL, json={"query": query})
-    if response.status_code == 200:
-        data = response.json()
-        anime_list = data['data']['Page']['media']
-        return random.choice(anime_list)  # Return a random anime from the list
-    else:
-        return None
-
-async def recommend_anime(query: Update, context: CallbackContext) -> None:
-    """Send a random anime recommendation."""
-    anime = fetch_trending_anime()
-    if anime:
-        title = anime["title"]["english"] or anime["title"]["romaji"]
-        description = anime["description"].replace("<br>", "").replace("</br>", "")[:500]  # Clean description
-        site_url = anime["siteUrl"]
-        cover_image = anime["coverImage"]["large"]
-
-        # Send anime details to the user via callback query
-        await query.message.reply_photo(
-            photo=cover_image,
-            caption=f"**{title}**\n\n{description}\n\n[More Info]({site_url})",
-            parse_mode="Markdown"
-        )
-    else:
-        await query.message.reply_text("Couldn't fetch recommendations at the moment. Try again later.")
-
-def fetch_random_series():
-    """Fetch a random TV series from TVMaze."""
-    try:
-        # Fetch all series data from TVMaze (example uses top-rated shows)
-        response = requests.get("https://api.tvmaze.com/shows")
-        if response.status_code == 200:
-            series_list = response.json()
-            return random.choice(series_list)  # Pick a random series
-        else:
-            return None
-    except Exception as e:
-        print(f"Error fetching series: {e}")
-        return None
-
-# Series Recommendations
-async def recommend_series(query: Update, context: CallbackContext) -> None:
-    """Send a random TV series recommendation."""
-    series = fetch_random_series()
-    if series:
-        title = series["name"]
-        summary = series["summary"].replace("<p>", "").replace("</p>", "")[:500]  # Clean HTML tags
-        url = series["officialSite"] or series["url"]  # Use the official site if available
-        image = series["image"]["medium"] if series.get("image") else None
-
-        # Send series details to the user via callback query
-        if image:
-            await query.message.reply_photo(
-                photo=image,
-                caption=f"**{title}**\n\n{summary}\n\n[More Info]({url})",
-                parse_mode="Markdown"
-            )
-        else:
-            await query.message.reply_text(
-                f"**{title}**\n\n{summary}\n\n[More Info]({url})",
-                parse_mode="Markdown"
-            )
-    else:
-        await query.message.reply_text("Couldn't fetch series recommendations at the moment. Try again later.")
-
-# Mute function
-# Dictionary to store mute timestamps
-muted_users = {}
-
-async def mute_user(update: Update, context: CallbackContext) -> None:
-    """Mute a user for a specific amount of time."""
-    if not update.message.reply_to_message:
-        await update.message.reply_text("Please reply to a message to mute a user.")
-        return
-    
-    # Get the user being replied to
-    user_to_mute = update.message.reply_to_message.from_user.id
-
-    # Parse the time duration (in minutes or hours)
-    if not context.args:
-        await update.message.reply_text("Please specify a time duration (e.g., 10m or 1h).")
-        return
-    
-    time_input = context.args[0].lower()
-    if time_input.endswith("m"):  # Handle minutes
-        duration = int(time_input[:-1]) * 60  # Convert minutes to seconds
-    elif time_input.endswith("h"):  # Handle hours
-        duration = int(time_input[:-1]) * 3600  # Convert hours to seconds
-    else:
-        await update.message.reply_text("Invalid time format. Use minutes (m) or hours (h).")
-        return
-    
-    # Mute the user
-    await update.message.chat.restrict_member(user_to_mute, permissions=ChatPermissions(can_send_messages=False))
-    await update.message.reply_text(f"{update.message.reply_to_message.from_user.username} has been muted for {time_input}.")
-    
-    # Schedule the unmute task
-    async def unmute_task():
-        """Unmute the user after the specified duration."""
-        await asyncio.sleep(duration)
-        await update.message.chat.restrict_member(user_to_mute, permissions=ChatPermissions(can_send_messages=True))
-        await update.message.reply_text(f"{update.message.reply_to_message.from_user.username} has been unmuted.")
-        # Remove the user from the muted_users dictionary
-        muted_users.pop(user_to_mute, None)
-
-    # Store the task so it can be tracked
-    mute_task = asyncio.create_task(unmute_task())
-    muted_users[user_to_mute] = mute_task
-
-async def unmute_user(update: Update, context: CallbackContext) -> None:
-    """Unmute a user manually."""
-    if not update.message.reply_to_message:
-        await update.message.reply_text("Please reply to a message to unmute a user.")
-        return
-
-    # Get the user being replied to
-    user_to_unmute = update.message.reply_to_message.from_user.id
-
-    # Cancel the mute task if it exists
-    if user_to_unmute in muted_users:
-        muted_users[user_to_unmute].cancel()
-        del muted_users[user_to_unmute]
-
-    # Unmute the user immediately
-    await update.message.chat.restrict_member(user_to_unmute, permissions=ChatPermissions(can_send_messages=True))
-    await update.message.reply_text(f"{update.message.reply_to_message.from_user.username} has been unmuted.")
-
-async def quote(update: Update, context: CallbackContext) -> None:
-    """Send a random quote."""
-    quotes = [
-    "The only way to do great work is to love what you do. – Steve Jobs",
-    "Success is not final, failure is not fatal: It is the courage to continue that counts. – Winston Churchill",
-    "It always seems impossible until it's done. – Nelson Mandela",
-    "Don’t watch the clock; do what it does. Keep going. – Sam Levenson",
-    "In the end, we only regret the chances we didn’t take. – Lewis Carroll",
-    "You don't have to be rich to be happy, but you do have to be happy to be rich. – Unknown",
-    "Life is what happens when you're busy making other plans. – John Lennon",
-    "The purpose of life is not to be happy. It is to be useful, to be honorable, to be compassionate, to have it make some difference that you have lived and lived well. – Ralph Waldo Emerson",
-    "Don’t count the days, make the days count. – Muhammad Ali",
-    "I'm not arguing, I'm just explaining why I'm right. – Unknown",
-    "A day without laughter is a day wasted. – Charlie Chaplin",
-    "I used to think I was indecisive, but now I’m not so sure. – Unknown",
-    "Behind every great man is a woman rolling her eyes. – Jim Carrey",
-    "I am not lazy, I am on energy-saving mode. – Unknown",
-    "The only journey is the one within. – Rainer Maria Rilke",
-    "What we think, we become. – Buddha",
-    "To live is the rarest thing in the world. Most people exist, that is all. – Oscar Wilde",
-    "The mind is everything. What you think you become. – Buddha",
-    "We do not remember days, we remember moments. – Cesare Pavese",
-    "Love is not about how many days, months, or years you’ve been together. Love is about how much you love each other every day. – Unknown",
-    "Love is a friendship set to music. – Joseph Campbell",
-    "The best thing to hold onto in life is each other. – Audrey Hepburn",
-    "To love and be loved is to feel the sun from both sides. – David Viscott",
-    "In the end, we will remember not the words of our enemies, but the silence of our friends. – Martin Luther King Jr.",
-]
-
-    selected_quote = random.choice(quotes)
-    await update.message.reply_text(selected_quote)
-
-# A dictionary to track user states
-user_states = {}
-
-async def reply_to_message(update: Update, context: CallbackContext) -> None:
-    """Respond to specific messages in the group."""
-    user_id = update.message.from_user.id
-    text = update.message.text.lower()  # Convert message to lowercase for easier matching
-
-    # Check if the message is replying to the bot
-    if update.message.reply_to_message and update.message.reply_to_message.from_user.id == context.bot.id:
-        # Greet the user for the first time
-        if user_id not in user_states and text in ("hey", "hi"):
-            user_states[user_id] = "greeted"
-            await update.message.reply_text("Hey, how are you? 😊")
-        elif user_states.get(user_id) == "greeted":
-            if text in ("i'm good", "im good", "i am good"):
-                user_states[user_id] = "good_response"
-                await update.message.reply_text("Glad to hear that! 😊 What can I help you with today?")
-            else:
-                # Reset state if the response doesn't match expected flow
-                user_states.pop(user_id, None)
-        else:
-            # General fallback for any unhandled state
-            await update.message.reply_text("I'm here to chat! What's on your mind?")
-
-#Random cat picture
-async def send_cat_picture(update: Update, context: CallbackContext) -> None:
-    """Send a random cat picture when the user uses the /cat command."""
-    try:
-        # Fetch a random cat image from The Cat API
-        response = requests.get('https://api.thecatapi.com/v1/images/search')
-        response.raise_for_status()  # Raise an error for bad responses (4xx/5xx)
-
-        # Parse the response to get the image URL
-        data = response.json()
-        cat_image_url = data[0]['url']
-
-        # Send the random cat picture
-        await update.message.reply_photo(cat_image_url)
-    except Exception as e:
-        # Handle any errors gracefully
-        await update.message.reply_text('Sorry, I couldn\'t fetch a cat picture at the moment. 😿')
-
-#Wiki search
-async def wiki_search(update: Update, context: CallbackContext) -> None:
-    """Search Wikipedia and send a summary to the user."""
-    if not context.args:
-        await update.message.reply_text("Usage: /wiki <search term>")
-        return
-
-    # Join all arguments to form a single string (including multi-word search terms)
-    search_term = ' '.join(context.args)
-    
-    # Handle cases where the search term contains multiple words
-    page = wiki.page(search_term.strip())  # Remove any extra whitespace at the start or end
-
-    if page.exists():
-        summary = page.summary[0:1000]  # Fetch first 1000 characters
-        await update.message.reply_text(
-            f"<b>{page.title}</b>\n\n{summary}\n\nRead more: {page.fullurl}",
-            parse_mode='HTML'  # Changed to HTML to avoid Markdown errors
-        )
-    else:
-        await update.message.reply_text(f"No results found for '{search_term}'.")
-
-# /Start massage
-async def start(update: Update, context: CallbackContext) -> None:
-    """Send a welcome message and a video when the user starts the bot."""
-    
-    # Get the username of the user
-    user_name = update.message.from_user.username
-    first_name = update.message.from_user.first_name
-
-    # Specify the path of your video
-    video_path = "Nami Git/Wanted poster of nami_converted.mp4"
-    
-    # Create inline buttons for different functionalities
-    keyboard = [
-        [
-            InlineKeyboardButton("Want Help?", callback_data='help'),
-        ],
-        [
-            InlineKeyboardButton("Anime Recommendations", callback_data='anime_recommendations'),
-            InlineKeyboardButton("Series Recommendations", callback_data='series_recommendations')
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    # Send the video with a caption
-    with open(video_path, 'rb') as video_file:
-        await update.message.reply_video(
-            video=video_file,
-            caption=(f"Hey {first_name}, I'm Nami a member of the Straw Hat Pirates! I come with alot of functions which u can see if u click the 'Want Help?' button \n\n"
-            "If you ever encounter any problems, contact [Support](https://t.me/BellmereNamiSupport)."),
-            parse_mode="Markdown",  # Ensure Markdown is parsed for clickable link
-            reply_markup=reply_markup  # Attach the inline buttons
-        )
-
-# This function will be called when the "Want Help?" button is clicked
-# Callback query handler for button clicks
-async def button(update: Update, context: CallbackContext) -> None:
-    """Handles button click events and sends a list of commands."""
-    query = update.callback_query
-    await query.answer()  # Answer the callback query to remove the "loading" state
-    
-    if query.data == 'help':
-        await help_command(query, context)  # Pass the query object to help_command
-    elif query.data == 'anime':
-        await recommend_anime(query, context)
-    elif query.data == 'series':
-        await recommend_series(query, context)
-
-# Help command function
-async def help_command(query, context: CallbackContext) -> None:
-    """Send a help message with bot commands."""
-    # Instead of using `update.message`, use `query.message` since it's a callback query
-    await query.message.reply_text(
-        'I can help you with the following commands:\n'
-        '/start - Welcome message\n'
-        '/help - List of commands\n'
-        '/Series - Get series recommendations\n'
-        '/Anime - Get anime recommendations\n'
-        '/download_video - Downloads a video link\n'
-        '/Search - Search a YouTube video without a link\n'
-        '/Music - Downloads music\n'
-        '/Wiki - Search Wikipedia\n'
-        '/define <word> - Get the definition of a word\n'
-        '/TMute - Mute a user for a specified time\n'
-        '/Unmute - Immediately unmutes a muted user\n'
-        '/Quote - Get a random quote\n'
-        '/Cat - Send a cat picture\n'
-        '/Flipcoin - Flip a coin to get either heads or tails'
-    )
-
-#Aime recommendations button handler update
-async def button(update: Update, context: CallbackContext) -> None:
-    """Handles button click events and sends relevant information."""
-    query = update.callback_query
-    await query.answer()  # Answer the callback query to remove the "loading" state
-
-    if query.data == 'anime_recommendations':
-        await recommend_anime(query, context)  # Trigger anime recommendations when the button is pressed
-    # Add other cases for other buttons like 'series_recommendations', etc.
-
-#Series recommendations button handler update
-async def button(update: Update, context: CallbackContext) -> None:
-    """Handles button click events and sends relevant information."""
-    query = update.callback_query
-    await query.answer()  # Answer the callback query to remove the "loading" state
-    if query.data == 'help':
-        await help_command(query, context)  # This should call help_command when "Want Help?" is clicked
-    elif query.data == 'anime_recommendations':
-        await recommend_anime(query, context)  # Trigger anime recommendations
-    elif query.data == 'series_recommendations':
-        await recommend_series(query, context)  # Trigger series recommendations when the button is pressed
-    # Add other cases for other buttons like 'help', etc.
-
-#Any video Download
-async def download_video(update: Update, context: CallbackContext) -> None:
-    """Download a YouTube video and send it to the user."""
-    if not context.args:
-        await update.message.reply_text("Please provide a YouTube URL.\nUsage: /download_video <YouTube URL>")
-        return
-
-    video_url = ' '.join(context.args)
-
-    try:
-        # Use yt-dlp to download the video
-        ydl_opts = {
-            'outtmpl': 'downloads/%(title)s.%(ext)s',  # Save the video in the 'downloads' folder
-            'format': 'best',  # Best quality video
-        }
-
-        # Download the video
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(video_url, download=True)
-            video_file = ydl.prepare_filename(info_dict)
-
-        # Send the video to the user
-        with open(video_file, 'rb') as video:
-            await update.message.reply_video(video)
-
-        # Clean up the downloaded file
-        os.remove(video_file)
-
-    except Exception as e:
-        await update.message.reply_text(f"Error downloading video: {str(e)}")
-
-# Function to search and download music
-async def search_and_download_music(update: Update, context: CallbackContext):
-    try:
-        # Get the query from the user's message
-        query = " ".join(context.args)
-        if not query:
-            await update.message.reply_text("Please provide a search term. Example: /search Kendrick Lamar Humble")
-            return
-
-        await update.message.reply_text(f"Searching for: {query}...")
-
-        # yt-dlp options
-        output_folder = "downloads"  # Folder to save downloads
-        os.makedirs(output_folder, exist_ok=True)
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'quiet': True,
-            'postprocessors': [
-                {
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }
-            ],
-            'outtmpl': os.path.join(output_folder, '%(title)s.%(ext)s'),
-        }
-
-        # Perform YouTube search
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_result = ydl.extract_info(f"ytsearch:{query}", download=True)
-            video_info = search_result['entries'][0]  # Get the first result
-            file_path = os.path.join(output_folder, f"{video_info['title']}.mp3")
-
-        # Send the downloaded file
-        if os.path.exists(file_path):
-            await update.message.reply_audio(audio=open(file_path, 'rb'), title=video_info['title'])
-            os.remove(file_path)  # Clean up after sending
-        else:
-            await update.message.reply_text("Download failed. Please try again.")
-
-    except Exception as e:
-        await update.message.reply_text(f"An error occurred: {e}")
-        raise
-
-# Function to search and download video
-async def search_and_download_video(update: Update, context: CallbackContext):
-    try:
-        # Extract the search query from the user's message
-        query = " ".join(context.args)
-        if not query:
-            await update.message.reply_text("Please provide a search term. Example: /search Kendrick Lamar Humble")
-            return
-
-        await update.message.reply_text(f"Searching for: {query}...")
-
-        # Output folder for the video
-        output_folder = "downloads"
-        os.makedirs(output_folder, exist_ok=True)
-
-        # yt-dlp options for downloading video
-        ydl_opts = {
-            'format': 'bestvideo+bestaudio/best',  # Get the best video and audio
-            'quiet': True,
-            'merge_output_format': 'mp4',         # Ensure output is in MP4 format
-            'outtmpl': os.path.join(output_folder, '%(title)s.%(ext)s'),
-        }
-
-        # Perform YouTube search and download
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_result = ydl.extract_info(f"ytsearch:{query}", download=True)
-            video_info = search_result['entries'][0]  # First search result
-            file_path = os.path.join(output_folder, f"{video_info['title']}.mp4")
-
-        # Send the downloaded video
-        if os.path.exists(file_path):
-            await update.message.reply_video(video=open(file_path, 'rb'), caption=f"🎥 {video_info['title']}")
-            os.remove(file_path)  # Clean up after sending
-        else:
-            await update.message.reply_text("Download failed. Please try again.")
-
-    except Exception as e:
-        await update.message.reply_text(f"An error occurred: {e}")
-        raise
-
-# Define the function for the 'flip a coin' command
-async def flip_coin(update: Update, context: CallbackContext):
-    # Simulate a coin flip using random.choice
-    result = random.choice(['Heads', 'Tails'])
-    user_name = update.message.from_user.first_name
-    await update.message.reply_text(f"{user_name}, you flipped a coin and got: {result}! 🎉")
-
-def main() -> None:
-    """Start the bot and register commands."""
-    # Replace with your bot's token
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
-
-    # Set up the Application object (new in v20.x)
-    application = Application.builder().token(BOT_TOKEN).read_timeout(60).connect_timeout(30).build()
-
-    # Register commands
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("cat", send_cat_picture))
-    application.add_handler(CommandHandler("wiki", wiki_search)) # Add the /wiki command
-    application.add_handler(CommandHandler("download_video", download_video))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, reply_to_message)) #replies to specific massages
-    application.add_handler(CommandHandler("quote", quote))
-    application.add_handler(CommandHandler("define", define_word)) #dictionary
-    application.add_handler(CommandHandler("tmute", mute_user))
-    application.add_handler(CommandHandler("unmute", unmute_user))
-    application.add_handler(CommandHandler("anime", recommend_anime))
-    application.add_handler(CommandHandler("series", recommend_series))
-    application.add_handler(CommandHandler("music", search_and_download_music))
-    application.add_handler(CommandHandler("search", search_and_download_video))
-    application.add_handler(CommandHandler('flipcoin', flip_coin))  # '/flipcoin' command to flip a coin
-    application.add_handler(CallbackQueryHandler(button))  # This handles button clicks
-   
-    # Start the Bot
-    application.run_polling()
-
-if __name__ == '__main__':
-    main()
+import startup
+from telegram import Update
+from telegram.ext import Application, CommandHandler, CallbackContext, MessageHandler, filters, CallbackQueryHandler
+from telegram import ChatPermissions, Update
+from telegram import ChatMember
+from telegram import InputFile
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+startup.timer.mark("import telegram")
+import os
+import random
+import datetime
+import asyncio
+import re
+import signal
+import time
+from http_client import client as http
+from update_processor import BackgroundJobs, ChatOrderedUpdateProcessor, is_long_running, long_running, is_unordered, unordered
+from downloads import manager as downloads, choose_format, DownloadCancelled, QueueFull, TooLarge, UPLOAD_LIMIT
+from file_id_cache import FileIdCache
+from media_store import MediaStore
+from transcode import transcoder, needs_transcode, NATIVE_AUDIO_FORMAT
+from static_media import StaticMediaCache
+from catalog import catalog
+from recommendations import recommendations
+from dictionary import dictionary, DictionaryError
+from wiki import wikipedia, normalize_title
+from search import search_index, normalize_query
+from singleflight import flights
+from mute_scheduler import Mute, MuteScheduler, SQLiteMutes, SharedMutes
+from state_backend import state, Lease
+from send_scheduler import SendScheduler, MODERATION, PROGRESS
+from work_split import WorkSplit
+from conversations import ConversationStore, REPLY_TO_BOT
+import metrics
+startup.timer.mark("import subsystems")
+
+CAT_API_URL = os.getenv("CAT_API_URL", "https://api.thecatapi.com/v1/images/search")
+
+# Telegram file_ids of downloaded media, so repeated requests are resent instead of re-downloaded
+media_cache = FileIdCache()
+# Downloaded files, kept on disk under a quota so a lost file_id does not mean downloading again
+media_store = MediaStore()
+# Telegram file_ids of static assets like the /start video, re-uploaded only when the file changes
+static_media = StaticMediaCache()
+
+# Add dictionary
+async def define_word(update: Update, context: CallbackContext) -> None:
+    """Fetch and send the definition of a word using DictionaryAPI."""
+    if context.args:
+        word = " ".join(context.args)  # Combine all arguments into a single word
+        # Cached definitions (and cached misses) are answered without a network call
+        try:
+            # Identical lookups running at the same time share one request
+            definitions, _ = await flights.do(("define", dictionary.normalize(word)), lambda: dictionary.lookup(word))
+        except DictionaryError as e:
+            print(f"Error fetching definition: {e}")
+            definitions = None
+
+        if definitions is not None:
+            if definitions:
+                reply = f"Definitions for *{word.capitalize()}*:\n\n"
+                for pos, meanings in definitions:
+                    reply += f"_{pos}_:\n"  # Part of speech (e.g., noun, verb)
+                    for definition in meanings:
+                        reply += f"- {definition}\n"
+                await update.message.reply_text(reply, parse_mode="Markdown")
+            else:
+                await update.message.reply_text(f"Sorry, no definitions found for '{word}'.")
+        else:
+            await update.message.reply_text(f"Error: Unable to retrieve definition for '{word}'.")
+    else:
+        await update.message.reply_text("Please specify a word. Usage: /define <word>")
+
+# Define your custom commands
+async def start(update: Update, context: CallbackContext) -> None:
+    """Send a welcome message when the user starts the bot."""
+    await update.message.reply_text('Hello! I am your friendly bot. How can I assist you today?')
+
+async def help_command(update: Update, context: CallbackContext) -> None:
+    """Send a help message with bot commands."""
+    await update.message.reply_text('I can help you with the following commands:\n'
+                                    '/start - Welcome message\n'
+                                    '/help - List of commands\n'
+                                    '/Series -Get series recommendations\n'
+                                    '/Anime - Get anime recommendations\n'
+                                    '/download_video - Downloads a video link\n'
+                                    '/Search - Search a YouTube video without a link\n'
+                                    '/Music - Downloads music\n'
+                                    '/Cancel - Cancel your downloads\n'
+                                    '/Wiki - Search Wikipedia\n'
+                                    '/define <word> - Get the definition of a word\n'
+                                    '/TMute - Mute a user for a specified time\n'
+                                    '/Unmute - Immediately unmutes a muted user\n'
+                                    '/Quote - Get a random quote\n'
+                                    '/Cat - Send a cat picture\n'
+                                    '/Flipcoin - Flip a coin to get either heads or tails')
+
+# How long a recommendation may wait for the very first catalog refresh after startup
+CATALOG_STARTUP_WAIT = 10
+
+async def recommend_anime(query: Update, context: CallbackContext) -> None:
+    """Send a random anime recommendation."""
+    # Recommendations are pre-rendered from the catalog, their cover uploaded when a storage chat is set
+    sent = await recommendations.send("anime", query.message)
+    if not sent and await catalog.wait_ready(CATALOG_STARTUP_WAIT):
+        sent = await recommendations.send("anime", query.message)
+    if not sent:
+        await query.message.reply_text("Couldn't fetch recommendations at the moment. Try again later.")
+
+# Series Recommendations
+async def recommend_series(query: Update, context: CallbackContext) -> None:
+    """Send a random TV series recommendation."""
+    # Recommendations are pre-rendered from the catalog, their cover uploaded when a storage chat is set
+    sent = await recommendations.send("series", query.message)
+    if not sent and await catalog.wait_ready(CATALOG_STARTUP_WAIT):
+        sent = await recommendations.send("series", query.message)
+    if not sent:
+        await query.message.reply_text("Couldn't fetch series recommendations at the moment. Try again later.")
+
+# Mute function
+# Pending unmutes of all chats, kept in one persisted timer heap keyed by (chat, user)
+# Pending unmutes live in the shared state when several workers run, else in the local cache database
+mute_scheduler = MuteScheduler(SharedMutes(state) if state.shared else SQLiteMutes())
+
+async def mute_user(update: Update, context: CallbackContext) -> None:
+    """Mute a user for a specific amount of time."""
+    if not update.message.reply_to_message:
+        await update.message.reply_text("Please reply to a message to mute a user.")
+        return
+    
+    # Get the user being replied to
+    user_to_mute = update.message.reply_to_message.from_user.id
+
+    # Parse the time duration (in minutes or hours)
+    if not context.args:
+        await update.message.reply_text("Please specify a time duration (e.g., 10m or 1h).")
+        return
+    
+    time_input = context.args[0].lower()
+    if time_input.endswith("m"):  # Handle minutes
+        duration = int(time_input[:-1]) * 60  # Convert minutes to seconds
+    elif time_input.endswith("h"):  # Handle hours
+        duration = int(time_input[:-1]) * 3600  # Convert hours to seconds
+    else:
+        await update.message.reply_text("Invalid time format. Use minutes (m) or hours (h).")
+        return
+    
+    # Mute the user (moderation goes ahead of other messages waiting for the flood limits)
+    await update.message.chat.restrict_member(user_to_mute, permissions=ChatPermissions(can_send_messages=False))
+    await context.bot.send_message(
+        update.message.chat.id,
+        f"{update.message.reply_to_message.from_user.username} has been muted for {time_input}.",
+        reply_to_message_id=update.message.message_id,
+        rate_limit_args=MODERATION,
+    )
+    
+    # Schedule the unmute (persisted, so it also happens after a restart)
+    await mute_scheduler.schedule(
+        update.message.chat.id,
+        user_to_mute,
+        until=time.time() + duration,
+        username=update.message.reply_to_message.from_user.username,
+        message_id=update.message.message_id,
+    )
+
+async def unmute_when_due(bot, mute: Mute) -> None:
+    """Unmute the user once the mute duration is over."""
+    await bot.restrict_chat_member(mute.chat_id, mute.user_id, permissions=ChatPermissions(can_send_messages=True))
+    await bot.send_message(
+        mute.chat_id,
+        f"{mute.username} has been unmuted.",
+        reply_to_message_id=mute.message_id,
+        allow_sending_without_reply=True,
+        rate_limit_args=MODERATION,
+    )
+
+async def unmute_user(update: Update, context: CallbackContext) -> None:
+    """Unmute a user manually."""
+    if not update.message.reply_to_message:
+        await update.message.reply_text("Please reply to a message to unmute a user.")
+        return
+
+    # Get the user being replied to
+    user_to_unmute = update.message.reply_to_message.from_user.id
+
+    # Cancel the scheduled unmute if there is one
+    await mute_scheduler.cancel(update.message.chat.id, user_to_unmute)
+
+    # Unmute the user immediately
+    await update.message.chat.restrict_member(user_to_unmute, permissions=ChatPermissions(can_send_messages=True))
+    await context.bot.send_message(
+        update.message.chat.id,
+        f"{update.message.reply_to_message.from_user.username} has been unmuted.",
+        reply_to_message_id=update.message.message_id,
+        rate_limit_args=MODERATION,
+    )
+
+async def quote(update: Update, context: CallbackContext) -> None:
+    """Send a random quote."""
+    quotes = [
+    "The only way to do great work is to love what you do. – Steve Jobs",
+    "Success is not final, failure is not fatal: It is the courage to continue that counts. – Winston Churchill",
+    "It always seems impossible until it's done. – Nelson Mandela",
+    "Don’t watch the clock; do what it does. Keep going. – Sam Levenson",
+    "In the end, we only regret the chances we didn’t take. – Lewis Carroll",
+    "You don't have to be rich to be happy, but you do have to be happy to be rich. – Unknown",
+    "Life is what happens when you're busy making other plans. – John Lennon",
+    "The purpose of life is not to be happy. It is to be useful, to be honorable, to be compassionate, to have it make some difference that you have lived and lived well. – Ralph Waldo Emerson",
+    "Don’t count the days, make the days count. – Muhammad Ali",
+    "I'm not arguing, I'm just explaining why I'm right. – Unknown",
+    "A day without laughter is a day wasted. – Charlie Chaplin",
+    "I used to think I was indecisive, but now I’m not so sure. – Unknown",
+    "Behind every great man is a woman rolling her eyes. – Jim Carrey",
+    "I am not lazy, I am on energy-saving mode. – Unknown",
+    "The only journey is the one within. – Rainer Maria Rilke",
+    "What we think, we become. – Buddha",
+    "To live is the rarest thing in the world. Most people exist, that is all. – Oscar Wilde",
+    "The mind is everything. What you think you become. – Buddha",
+    "We do not remember days, we remember moments. – Cesare Pavese",
+    "Love is not about how many days, months, or years you’ve been together. Love is about how much you love each other every day. – Unknown",
+    "Love is a friendship set to music. – Joseph Campbell",
+    "The best thing to hold onto in life is each other. – Audrey Hepburn",
+    "To love and be loved is to feel the sun from both sides. – David Viscott",
+    "In the end, we will remember not the words of our enemies, but the silence of our friends. – Martin Luther King Jr.",
+]
+
+    selected_quote = random.choice(quotes)
+    await update.message.reply_text(selected_quote)
+
+# Where each user's conversation with the bot stands, by chat and user
+conversations = ConversationStore(state)
+
+async def reply_to_message(update: Update, context: CallbackContext) -> None:
+    """Respond to specific messages in the group (only replies to the bot get here, see build_application)."""
+    chat_id = update.message.chat_id
+    user_id = update.message.from_user.id
+    text = update.message.text.lower()  # Convert message to lowercase for easier matching
+
+    user_state = await conversations.get(chat_id, user_id)
+    # Greet the user for the first time
+    if user_state is None and text in ("hey", "hi"):
+        await conversations.set(chat_id, user_id, "greeted")
+        await update.message.reply_text("Hey, how are you? 😊")
+    elif user_state == "greeted":
+        if text in ("i'm good", "im good", "i am good"):
+            await conversations.set(chat_id, user_id, "good_response")
+            await update.message.reply_text("Glad to hear that! 😊 What can I help you with today?")
+        else:
+            # Reset state if the response doesn't match expected flow
+            await conversations.delete(chat_id, user_id)
+    else:
+        # General fallback for any unhandled state
+        await update.message.reply_text("I'm here to chat! What's on your mind?")
+
+#Random cat picture
+async def fetch_cat_picture_url() -> str:
+    """Fetch the URL of a random cat image from The Cat API."""
+    response = await http.get(CAT_API_URL)
+    response.raise_for_status()  # Raise an error for bad responses (4xx/5xx)
+
+    # Parse the response to get the image URL
+    data = response.json()
+    return data[0]['url']
+
+async def send_cat_picture(update: Update, context: CallbackContext) -> None:
+    """Send a random cat picture when the user uses the /cat command."""
+    try:
+        # Fetch a random cat image from The Cat API
+        # (/cat requests arriving at the same time share one request and picture)
+        cat_image_url, _ = await flights.do(("cat",), fetch_cat_picture_url)
+
+        # Send the random cat picture
+        await update.message.reply_photo(cat_image_url)
+    except Exception as e:
+        # Handle any errors gracefully
+        await update.message.reply_text('Sorry, I couldn\'t fetch a cat picture at the moment. 😿')
+
+#Wiki search
+async def wiki_search(update: Update, context: CallbackContext) -> None:
+    """Search Wikipedia and send a summary to the user."""
+    if not context.args:
+        await update.message.reply_text("Usage: /wiki <search term>")
+        return
+
+    # Join all arguments to form a single string (including multi-word search terms)
+    search_term = ' '.join(context.args)
+    
+    # One request to the summary API, cached by title (case variants and redirects share an entry)
+    try:
+        page, _ = await flights.do(("wiki", normalize_title(search_term)), lambda: wikipedia.summary(search_term))
+    except Exception as e:
+        print(f"Error fetching Wikipedia summary: {e}")
+        await update.message.reply_text("Couldn't reach Wikipedia at the moment. Try again later.")
+        return
+
+    if page is not None:
+        summary = page.extract[0:1000]  # Fetch first 1000 characters
+        await update.message.reply_text(
+            f"<b>{page.title}</b>\n\n{summary}\n\nRead more: {page.url}",
+            parse_mode='HTML'  # Changed to HTML to avoid Markdown errors
+        )
+    else:
+        await update.message.reply_text(f"No results found for '{search_term}'.")
+
+# /Start massage
+async def start(update: Update, context: CallbackContext) -> None:
+    """Send a welcome message and a video when the user starts the bot."""
+    
+    # Get the username of the user
+    user_name = update.message.from_user.username
+    first_name = update.message.from_user.first_name
+
+    # Specify the path of your video
+    video_path = "Nami Git/Wanted poster of nami_converted.mp4"
+    
+    # Create inline buttons for different functionalities
+    keyboard = [
+        [
+            InlineKeyboardButton("Want Help?", callback_data='help'),
+        ],
+        [
+            InlineKeyboardButton("Anime Recommendations", callback_data='anime_recommendations'),
+            InlineKeyboardButton("Series Recommendations", callback_data='series_recommendations')
+        ]
+    ]
+
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    # Send the video with a caption (uploaded once, then resent by file_id)
+    await static_media.send(video_path, lambda video: update.message.reply_video(
+        video=video,
+        caption=(f"Hey {first_name}, I'm Nami a member of the Straw Hat Pirates! I come with alot of functions which u can see if u click the 'Want Help?' button \n\n"
+        "If you ever encounter any problems, contact [Support](https://t.me/BellmereNamiSupport)."),
+        parse_mode="Markdown",  # Ensure Markdown is parsed for clickable link
+        reply_markup=reply_markup  # Attach the inline buttons
+    ))
+
+# This function will be called when the "Want Help?" button is clicked
+# Callback query handler for button clicks
+async def button(update: Update, context: CallbackContext) -> None:
+    """Handles button click events and sends a list of commands."""
+    query = update.callback_query
+    await query.answer()  # Answer the callback query to remove the "loading" state
+    
+    if query.data == 'help':
+        await help_command(query, context)  # Pass the query object to help_command
+    elif query.data == 'anime':
+        await recommend_anime(query, context)
+    elif query.data == 'series':
+        await recommend_series(query, context)
+
+# Help command function
+async def help_command(query, context: CallbackContext) -> None:
+    """Send a help message with bot commands."""
+    # Instead of using `update.message`, use `query.message` since it's a callback query
+    await query.message.reply_text(
+        'I can help you with the following commands:\n'
+        '/start - Welcome message\n'
+        '/help - List of commands\n'
+        '/Series - Get series recommendations\n'
+        '/Anime - Get anime recommendations\n'
+        '/download_video - Downloads a video link\n'
+        '/Search - Search a YouTube video without a link\n'
+        '/Music - Downloads music\n'
+        '/Cancel - Cancel your downloads\n'
+        '/Wiki - Search Wikipedia\n'
+        '/define <word> - Get the definition of a word\n'
+        '/TMute - Mute a user for a specified time\n'
+        '/Unmute - Immediately unmutes a muted user\n'
+        '/Quote - Get a random quote\n'
+        '/Cat - Send a cat picture\n'
+        '/Flipcoin - Flip a coin to get either heads or tails'
+    )
+
+#Aime recommendations button handler update
+async def button(update: Update, context: CallbackContext) -> None:
+    """Handles button click events and sends relevant information."""
+    query = update.callback_query
+    await query.answer()  # Answer the callback query to remove the "loading" state
+
+    if query.data == 'anime_recommendations':
+        await recommend_anime(query, context)  # Trigger anime recommendations when the button is pressed
+    # Add other cases for other buttons like 'series_recommendations', etc.
+
+#Series recommendations button handler update
+async def button(update: Update, context: CallbackContext) -> None:
+    """Handles button click events and sends relevant information."""
+    query = update.callback_query
+    await query.answer()  # Answer the callback query to remove the "loading" state
+    if query.data == 'help':
+        await help_command(query, context)  # This should call help_command when "Want Help?" is clicked
+    elif query.data == 'anime_recommendations':
+        await recommend_anime(query, context)  # Trigger anime recommendations
+    elif query.data == 'series_recommendations':
+        await recommend_series(query, context)  # Trigger series recommendations when the button is pressed
+    # Add other cases for other buttons like 'help', etc.
+
+async def edit_status(status_message, text: str, **kwargs) -> None:
+    """Edit a download status message; progress waits behind every other message of the bot."""
+    await status_message.get_bot().edit_message_text(
+        text, chat_id=status_message.chat_id, message_id=status_message.message_id, rate_limit_args=PROGRESS, **kwargs
+    )
+
+def download_progress_reporter(status_message, header=None):
+    """Return a callback that edits the queue/progress reply in place as the job moves along."""
+    last_text = [None]
+
+    async def report(job) -> None:
+        text = job.describe() if header is None else f"{header}\n{job.describe()}"
+        if text == last_text[0] or job.future.done():
+            return
+        last_text[0] = text
+        cancel_button = InlineKeyboardMarkup([[InlineKeyboardButton("Cancel", callback_data=f"cancel_download:{job.id}")]])
+        await edit_status(status_message, text, reply_markup=cancel_button)
+
+    return report
+
+async def wait_for_download(job, handler: str) -> dict:
+    """Wait for a download job and record how long it queued, downloaded and transcoded."""
+    result = await job.result()
+    metrics.stage_latency.observe(job.started_at - job.queued_at, handler=handler, stage="queue")
+    metrics.stage_latency.observe(result['download_seconds'], handler=handler, stage="download")
+    if result['postprocess_seconds']:
+        metrics.stage_latency.observe(result['postprocess_seconds'], handler=handler, stage="transcode")
+    return result
+
+@unordered
+async def cancel_download_button(update: Update, context: CallbackContext) -> None:
+    """Cancel the download whose progress message the button belongs to."""
+    query = update.callback_query
+    job_id = int(query.data.split(":", 1)[1])
+    if downloads.cancel(job_id, user_id=query.from_user.id):
+        await query.answer("Cancelling download...")
+    else:
+        await query.answer("This download is not yours or has already finished.")
+
+@unordered
+async def cancel_downloads(update: Update, context: CallbackContext) -> None:
+    """Cancel all queued and running downloads of the user."""
+    jobs = downloads.jobs_of(update.effective_user.id)
+    for job in jobs:
+        downloads.cancel(job.id)
+    if jobs:
+        await update.message.reply_text(f"Cancelled {len(jobs)} download(s).")
+    else:
+        await update.message.reply_text("You have no downloads in progress.")
+
+async def send_cached_media(message, key: str, fmt: str, **kwargs) -> bool:
+    """Resend media uploaded earlier by its Telegram file_id, in reply to message. Returns False on a cache miss."""
+    file_id = media_cache.get(key, fmt)
+    if file_id is None and state.shared:
+        # Uploaded by another worker
+        file_id = await state.get(f"file_id:{fmt}:{key}")
+    if file_id is None:
+        return False
+    try:
+        if fmt == "audio":
+            await message.reply_audio(audio=file_id, **kwargs)
+        else:
+            await message.reply_video(video=file_id, **kwargs)
+    except BadRequest:
+        # Telegram no longer knows the file, upload it again
+        media_cache.delete(key, fmt)
+        if state.shared:
+            await state.delete(f"file_id:{fmt}:{key}")
+        return False
+    return True
+
+async def remember_upload(key: str, fmt: str, message) -> None:
+    """Store the file_id of media the bot just uploaded."""
+    media = message.audio or message.video or message.document
+    if media is not None:
+        media_cache.put(key, fmt, media.file_id, media.file_size)
+        if state.shared:
+            await state.set(f"file_id:{fmt}:{key}", media.file_id, ttl=media_cache.ttl)
+
+async def cache_stats(update: Update, context: CallbackContext) -> None:
+    """Report how well the media file_id cache is doing."""
+    stats = media_cache.stats()
+    await update.message.reply_text(
+        f"Media cache: {stats['entries']} files, {stats['hits']} hits, "
+        f"{stats['misses']} misses ({stats['hit_ratio']:.0%} hit ratio)."
+    )
+
+async def probe_media(url: str) -> dict:
+    """Resolve a URL to a video; identical probes running at the same time share one."""
+    video_info, _ = await flights.do(("probe", url), lambda: downloads.probe(url))
+    return video_info
+
+async def search_videos(query: str, handler: str) -> list:
+    """The top search results, cached by query; identical searches running at the same time share one."""
+    with metrics.stage(handler, "search"):
+        videos, _ = await flights.do(("search", normalize_query(query)), lambda: search_index.search(query))
+    return videos
+
+def format_duration(seconds) -> str:
+    if not seconds:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+async def offer_search_results(status, query: str, kind: str, videos: list) -> None:
+    """Turn the status message into a picker, so nothing is downloaded until the user chooses."""
+    keyboard = [
+        [InlineKeyboardButton(f"{video['title'] or video['id']} ({format_duration(video['duration'])})"[:64],
+                              callback_data=f"pick:{kind}:{video['id']}")]
+        for video in videos
+    ]
+    await status.edit_text(f"Results for: {query}\nPick one:", reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def send_media_once(message, video_info: dict, fmt: str, download_and_send, **kwargs) -> bool:
+    """Run download_and_send, unless the same media is already being fetched for another chat.
+
+    In that case wait for it and resend the file_id it uploaded. Returns False if nothing was sent.
+    """
+    async def download_once() -> bool:
+        # Workers sharing the state backend fetch each media only once too
+        lease = Lease(state, f"download:{fmt}:{video_info['key']}")
+        try:
+            if not await lease.acquire(wait=False):
+                # Another worker is fetching it, wait for it and resend its upload
+                await lease.acquire()
+                if await send_cached_media(message, video_info['key'], fmt, **kwargs):
+                    return True
+            return await download_and_send()
+        finally:
+            await lease.release()
+
+    # Cancelling or hitting one's own download cap only fails the requester who ran the download,
+    # the others waiting on it download for themselves
+    sent, shared = await flights.do((fmt, video_info['key']), download_once, retry_on=(DownloadCancelled, QueueFull))
+    if shared and sent:
+        sent = await send_cached_media(message, video_info['key'], fmt, **kwargs)
+    return sent
+
+async def pick_format(video_info: dict, ydl_opts: dict, handler: str, merge: bool = False):
+    """Choose the best format under the upload limit before downloading anything.
+
+    Returns the yt-dlp options to use, a line describing the choice and the extraction
+    to download from, or raises TooLarge. Videos resolved by probe_media already come
+    with their formats; search results are extracted here.
+    """
+    info = video_info
+    if not info.get('formats'):
+        with metrics.stage(handler, "probe"):
+            info = await downloads.probe_formats(video_info['url'])
+    chosen = choose_format(info, UPLOAD_LIMIT, merge=merge)
+    if chosen is None:
+        # No format reports its size, the file is checked once downloaded instead
+        return ydl_opts, None, info.get('info')
+    quality = f"{chosen['height']}p" if chosen.get('height') else f"format {chosen['format']}"
+    header = f"🎞 {quality}, about {chosen['size'] / 2**20:.1f} MB"
+    return dict(ydl_opts, format=chosen['format']), header, info.get('info')
+
+async def fetch_media(user_id: int, video_info: dict, fmt: str, ydl_opts: dict, status, handler: str,
+                      convert=None, fit_size: bool = False, merge: bool = False) -> str:
+    """Path of the media in the store, downloading it first unless it is still on disk.
+
+    With ``fit_size`` the format is picked to fit under the upload limit (see pick_format).
+    ``convert(path)`` may turn the download into another file before it is stored.
+    """
+    path = media_store.get(video_info['key'], fmt)
+    if path is not None:
+        return path
+    header = None
+    # The video's extraction, when it was already done, so the worker does not repeat it
+    extraction = video_info.get('info')
+    if fit_size:
+        ydl_opts, header, extraction = await pick_format(video_info, ydl_opts, handler, merge=merge)
+        if header is not None:
+            await edit_status(status, header)
+    # Each job downloads into its own directory, so same-titled videos never collide
+    with media_store.temp_dir() as temp_dir:
+        ydl_opts = dict(ydl_opts, outtmpl=os.path.join(temp_dir, 'media.%(ext)s'))
+        job = downloads.submit(user_id, video_info['url'], ydl_opts,
+                               on_update=download_progress_reporter(status, header), info=extraction)
+        filepath = (await wait_for_download(job, handler))['filepath']
+        if convert is not None:
+            filepath = await convert(filepath)
+        # Size estimates can be off, Telegram would reject the upload anyway
+        size = os.path.getsize(filepath)
+        if size > UPLOAD_LIMIT:
+            raise TooLarge(f"The file is {size / 2**20:.0f} MB, too big to send on Telegram "
+                           f"(the limit is {UPLOAD_LIMIT / 2**20:.0f} MB).")
+        return media_store.put(video_info['key'], fmt, filepath)
+
+async def prepare_audio(video_info: dict, filepath: str, status) -> str:
+    """Send M4A/MP3 downloads as they are, transcode anything else to MP3 in the transcode pool."""
+    if not needs_transcode(filepath):
+        print(f"Audio {video_info['key']}: sending {os.path.splitext(filepath)[1]} as downloaded (fast path)")
+        metrics.audio_delivery.inc(path="native")
+        return filepath
+    print(f"Audio {video_info['key']}: transcoding {os.path.splitext(filepath)[1]} to .mp3")
+    metrics.audio_delivery.inc(path="transcode")
+    await edit_status(status, "⚙️ Converting (ffmpeg)...")
+    with metrics.stage("search_and_download_music", "transcode"):
+        return await transcoder.to_mp3(filepath)
+
+#Any video Download
+@long_running
+async def download_video(update: Update, context: CallbackContext) -> None:
+    """Download a YouTube video and send it to the user."""
+    if not context.args:
+        await update.message.reply_text("Please provide a YouTube URL.\nUsage: /download_video <YouTube URL>")
+        return
+
+    video_url = ' '.join(context.args)
+    status = await update.message.reply_text("Preparing your download...")
+
+    try:
+        # Resolve the video first, it may have been uploaded before
+        with metrics.stage("download_video", "search"):
+            video_info = await probe_media(video_url)
+        if await send_cached_media(update.message, video_info['key'], 'mp4'):
+            await status.delete()
+            return
+
+        async def download_and_send() -> bool:
+            # Use yt-dlp to download the video
+            ydl_opts = {
+                'format': 'best',  # Best quality video, narrowed below to a format under the upload limit
+            }
+
+            # Download the video in the worker pool, unless it is still in the media store
+            video_file = await fetch_media(update.effective_user.id, video_info, 'mp4', ydl_opts, status, "download_video",
+                                           fit_size=True)
+
+            # Send the video to the user
+            with media_store.open(video_file) as video, metrics.stage("download_video", "upload"):
+                message = await update.message.reply_video(video)
+            await remember_upload(video_info['key'], 'mp4', message)
+            return True
+
+        # Requests for the same video running at the same time share one download and upload
+        if await send_media_once(update.message, video_info, 'mp4', download_and_send):
+            await status.delete()
+        else:
+            await update.message.reply_text("Error downloading video: please try again.")
+
+    except (DownloadCancelled, QueueFull, TooLarge) as e:
+        await status.edit_text(str(e))
+    except Exception as e:
+        await update.message.reply_text(f"Error downloading video: {str(e)}")
+
+async def send_music(message, user_id: int, video_info: dict, status) -> None:
+    """Send a song in reply to message, from the caches when possible, else download it."""
+    if await send_cached_media(message, video_info['key'], 'audio', title=video_info['title']):
+        await status.delete()
+        return
+
+    async def download_and_send() -> bool:
+        # yt-dlp options: prefer an audio stream Telegram plays as it is, so most songs skip ffmpeg
+        ydl_opts = {
+            'format': NATIVE_AUDIO_FORMAT,
+            'quiet': True,
+        }
+
+        # Download the song in the worker pool, unless it is still in the media store
+        file_path = await fetch_media(user_id, video_info, 'audio', ydl_opts, status, "search_and_download_music",
+                                      convert=lambda path: prepare_audio(video_info, path, status))
+
+        # Send the downloaded file
+        with media_store.open(file_path) as audio, metrics.stage("search_and_download_music", "upload"):
+            sent = await message.reply_audio(audio=audio, title=video_info['title'])
+        await remember_upload(video_info['key'], 'audio', sent)
+        return True
+
+    # Requests for the same song running at the same time share one download and upload
+    if await send_media_once(message, video_info, 'audio', download_and_send, title=video_info['title']):
+        await status.delete()
+    else:
+        await message.reply_text("Download failed. Please try again.")
+
+async def send_searched_video(message, user_id: int, video_info: dict, status) -> None:
+    """Send a video in reply to message, from the caches when possible, else download it."""
+    caption = f"🎥 {video_info['title']}"
+    if await send_cached_media(message, video_info['key'], 'mp4', caption=caption):
+        await status.delete()
+        return
+
+    async def download_and_send() -> bool:
+        # yt-dlp options for downloading video
+        ydl_opts = {
+            'format': 'bestvideo+bestaudio/best',  # Best video and audio that fit under the upload limit
+            'quiet': True,
+            'merge_output_format': 'mp4',         # Ensure output is in MP4 format
+        }
+
+        # Download the video in the worker pool, unless it is still in the media store
+        file_path = await fetch_media(user_id, video_info, 'mp4', ydl_opts, status, "search_and_download_video",
+                                      fit_size=True, merge=True)
+
+        # Send the downloaded video
+        with media_store.open(file_path) as video, metrics.stage("search_and_download_video", "upload"):
+            sent = await message.reply_video(video=video, caption=caption)
+        await remember_upload(video_info['key'], 'mp4', sent)
+        return True
+
+    # Requests for the same video running at the same time share one download and upload
+    if await send_media_once(message, video_info, 'mp4', download_and_send, caption=caption):
+        await status.delete()
+    else:
+        await message.reply_text("Download failed. Please try again.")
+
+SEARCH_SENDERS = {"music": send_music, "video": send_searched_video}
+
+async def search_and_offer(update: Update, context: CallbackContext, kind: str, handler: str) -> None:
+    """Search, then offer the results to pick from (or send the only one right away)."""
+    message = update.message
+    try:
+        query = " ".join(context.args)
+        if not query:
+            await message.reply_text("Please provide a search term. Example: /search Kendrick Lamar Humble")
+            return
+
+        status = await message.reply_text(f"Searching for: {query}...")
+        videos = await search_videos(query, handler)
+        if not videos:
+            await status.edit_text(f"No results found for: {query}")
+        elif len(videos) == 1:
+            await SEARCH_SENDERS[kind](message, update.effective_user.id, videos[0], status)
+        else:
+            await offer_search_results(status, query, kind, videos)
+
+    except (DownloadCancelled, QueueFull, TooLarge) as e:
+        await message.reply_text(str(e))
+    except Exception as e:
+        await message.reply_text(f"An error occurred: {e}")
+        raise
+
+# Function to search and download music
+@long_running
+async def search_and_download_music(update: Update, context: CallbackContext):
+    await search_and_offer(update, context, "music", "search_and_download_music")
+
+# Function to search and download video
+@long_running
+async def search_and_download_video(update: Update, context: CallbackContext):
+    await search_and_offer(update, context, "video", "search_and_download_video")
+
+@long_running
+async def pick_search_result(update: Update, context: CallbackContext) -> None:
+    """Download the search result picked on the keyboard (callback data pick:<music|video>:<video id>)."""
+    query = update.callback_query
+    _, kind, video_id = query.data.split(":", 2)
+    await query.answer()
+    status = query.message
+    # Answer the /music or /search message the picker replied to
+    message = status.reply_to_message or status
+    try:
+        video_info = search_index.video(video_id)
+        if video_info is None:
+            # The search was evicted, or ran on another worker
+            video_info = await probe_media(f"https://www.youtube.com/watch?v={video_id}")
+        await status.edit_text(f"Selected: {video_info['title']}")
+        await SEARCH_SENDERS[kind](message, query.from_user.id, video_info, status)
+
+    except (DownloadCancelled, QueueFull, TooLarge) as e:
+        await message.reply_text(str(e))
+    except Exception as e:
+        await message.reply_text(f"An error occurred: {e}")
+        raise
+
+# Define the function for the 'flip a coin' command
+async def flip_coin(update: Update, context: CallbackContext):
+    # Simulate a coin flip using random.choice
+    result = random.choice(['Heads', 'Tails'])
+    user_name = update.message.from_user.first_name
+    await update.message.reply_text(f"{user_name}, you flipped a coin and got: {result}! 🎉")
+
+def register_metrics() -> None:
+    """Expose queue depths and cache hit ratios, read whenever the metrics are scraped."""
+    metrics.download_queue_depth.set_function(lambda: downloads.queue_depth)
+    metrics.downloads_active.set_function(lambda: downloads.active)
+    for name, cache in (("media_file_ids", media_cache), ("media_files", media_store), ("search", search_index),
+                        ("dictionary", dictionary), ("wikipedia", wikipedia), ("conversations", conversations)):
+        metrics.cache_hit_ratio.set_function(lambda cache=cache: cache.stats()['hit_ratio'], cache=name)
+        metrics.cache_entries.set_function(lambda cache=cache: cache.stats()['entries'], cache=name)
+    # Share of identical requests that were answered by another in-flight call
+    metrics.cache_hit_ratio.set_function(lambda: flights.shared / max(flights.calls + flights.shared, 1), cache="singleflight")
+
+async def on_startup(application: Application) -> None:
+    """Start the background tasks once the bot is initialized."""
+    await metrics.server.start()
+    catalog.start()
+    # Cover file_ids are kept with the media ones
+    recommendations.start(application.bot, media_cache)
+    # Restores pending unmutes and runs the overdue ones right away
+    mute_scheduler.start(lambda mute: unmute_when_due(application.bot, mute))
+    # Heavy subsystems load once the bot is polling instead of delaying it
+    startup.timer.start(application, [
+        ("http client", http.warm),
+        ("media store", media_store.warm),
+        ("yt-dlp", downloads.warm),
+    ])
+
+async def on_shutdown(application: Application) -> None:
+    """Release shared resources when the bot stops."""
+    await startup.timer.stop()
+    await metrics.server.stop()
+    await mute_scheduler.stop()
+    mute_scheduler.close()
+    await recommendations.stop()
+    await catalog.stop()
+    await http.close()
+    await downloads.close()
+    await state.close()
+    print(f"Media cache stats: {media_cache.stats()}")
+    print(f"Media store stats: {media_store.stats()}")
+    media_cache.close()
+    static_media.close()
+    print(f"Dictionary cache stats: {dictionary.stats()}")
+    dictionary.close()
+
+def build_application() -> Application:
+    """Set up the bot and register commands."""
+    startup.timer.mark("module setup")
+    # Replace with your bot's token
+    BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+    # Set up the Application object (new in v20.x)
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .read_timeout(60)
+        .connect_timeout(30)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+
+    # All outgoing messages wait for Telegram's flood limits here, moderation first
+    send_scheduler = SendScheduler()
+    builder = builder.rate_limiter(send_scheduler)
+    metrics.send_queue_depth.set_function(lambda: send_scheduler.queue_depth)
+
+    # Talk to another Bot API server (a self-hosted one, or the fake one of benchmark.py)
+    BOT_API_URL = os.getenv("BOT_API_URL")
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+
+    # Update processing mode: "sequential" handles one update at a time, "concurrent"
+    # runs different chats in parallel while keeping updates of one chat in order
+    update_processor = None
+    if os.getenv("UPDATE_CONCURRENCY_MODE", "concurrent") == "concurrent":
+        update_processor = ChatOrderedUpdateProcessor(
+            max_concurrent_updates=int(os.getenv("MAX_CONCURRENT_UPDATES", "32")),
+        )
+        builder = builder.concurrent_updates(update_processor)
+    application = builder.build()
+
+    # Register commands
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("cat", send_cat_picture))
+    application.add_handler(CommandHandler("wiki", wiki_search)) # Add the /wiki command
+    application.add_handler(CommandHandler("download_video", download_video))
+    # Replies to the bot only; the cheap REPLY check first turns away most group messages before the handler runs
+    application.add_handler(MessageHandler(filters.REPLY & REPLY_TO_BOT & filters.TEXT & ~filters.COMMAND,
+                                           reply_to_message)) #replies to specific massages
+    application.add_handler(CommandHandler("quote", quote))
+    application.add_handler(CommandHandler("define", define_word)) #dictionary
+    application.add_handler(CommandHandler("tmute", mute_user))
+    application.add_handler(CommandHandler("unmute", unmute_user))
+    application.add_handler(CommandHandler("anime", recommend_anime))
+    application.add_handler(CommandHandler("series", recommend_series))
+    application.add_handler(CommandHandler("music", search_and_download_music))
+    application.add_handler(CommandHandler("search", search_and_download_video))
+    application.add_handler(CommandHandler('flipcoin', flip_coin))  # '/flipcoin' command to flip a coin
+    application.add_handler(CommandHandler("cancel", cancel_downloads))  # Cancel your downloads
+    application.add_handler(CommandHandler("cachestats", cache_stats))  # Media cache hit/miss stats
+    application.add_handler(CallbackQueryHandler(cancel_download_button, pattern="^cancel_download:"))
+    application.add_handler(CallbackQueryHandler(pick_search_result, pattern="^pick:(music|video):"))  # Search result picker
+    application.add_handler(CallbackQueryHandler(button))  # This handles button clicks
+
+    # Record latency and errors of every handler
+    for handler in application.handlers[0]:
+        handler.callback = metrics.instrument(handler.callback)
+    register_metrics()
+
+    # Long-running commands and buttons run in the background, so they do not hold up their chat
+    background_jobs = BackgroundJobs()
+    for handler in application.handlers[0]:
+        if is_long_running(handler.callback):
+            handler.callback = background_jobs.wrap(handler.callback)
+
+    # Cancelling must not wait for the updates queued before it in the chat
+    if update_processor is not None:
+        for handler in application.handlers[0]:
+            if isinstance(handler, CommandHandler) and is_unordered(handler.callback):
+                update_processor.add_unordered_commands(handler.commands)
+            elif isinstance(handler, CallbackQueryHandler) and is_unordered(handler.callback):
+                update_processor.add_unordered_callbacks([handler.pattern])
+
+    startup.timer.mark("build application")
+    return application
+
+async def run_worker(application: Application) -> None:
+    """Run as one of several workers sharing STATE_BACKEND_URL (see work_split.py)."""
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    split = WorkSplit(state, application)
+    split.start(poll=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await split.stop()
+        await application.stop()
+        await application.shutdown()
+        await on_shutdown(application)
+
+def main() -> None:
+    """Start the bot, either long polling or serving the webhook."""
+    # BOT_MODE=webhook serves updates pushed by Telegram (see webhook.py), anything else long polls
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        import uvicorn
+        # Heroku sets WEB_CONCURRENCY by default, but workers only share conversations
+        # and per-chat order through a shared state backend
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        if workers > 1 and not state.shared:
+            print(f"WEB_CONCURRENCY={workers} needs a shared STATE_BACKEND_URL, serving the webhook with one worker")
+            workers = 1
+        uvicorn.run(
+            "webhook:app",
+            app_dir=os.path.dirname(os.path.abspath(__file__)),
+            host="0.0.0.0",
+            port=int(os.getenv("PORT", "8000")),
+            workers=workers,
+        )
+        return
+
+    # Start the Bot
+    application = build_application()
+    if state.shared:
+        # Several workers: they split the updates between them through the state backend
+        asyncio.run(run_worker(application))
+    else:
+        application.run_polling()
+
+if __name__ == '__main__':
+    import importlib.machinery
+    # The download and probe pools (downloads.py) spawn fresh interpreters, which run the
+    # main script again unless it is named like a package's __main__. Their tasks all live
+    # in downloads.py, so this spares each of them importing telegram and opening the caches.
+    __spec__ = importlib.machinery.ModuleSpec("__main__", None)
+    main()
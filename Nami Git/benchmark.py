@@ -0,0 +1,378 @@
+"""Offline load test: drive the real handlers with synthetic updates against local stubs.
+
+A fake Bot API server and stub AniList, TVMaze, dictionaryapi, thecatapi and
+Wikipedia endpoints run on one local aiohttp server, so no network access or
+bot token is needed. Example:
+
+    python benchmark.py --updates 2000 --rate 200 --upstream-latency-ms 50
+
+Load starts once the startup warm-ups are over. Prints p50/p99 latency per
+scenario and the overall updates per second.
+"""
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOT_TOKEN = "123456:BENCHMARK"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Nami", "username": "nami_benchmark_bot"}
+WORDS = ["hello", "pirate", "ocean", "treasure", "navigator", "map", "storm", "island", "zzxqv", "orange"]
+WIKI_TITLES = ["One Piece", "one piece", "Monkey D. Luffy", "luffy", "Eiichiro Oda", "Grand Line", "Nami"]
+DEFAULT_MIX = "start=1,define=3,wiki=2,anime=2,series=2,cat=2,button=2,mute=1,chatter=10"
+
+
+class StubServer:
+    """Fake Bot API plus stub upstream APIs, each answering after an injectable latency."""
+
+    def __init__(self, upstream_latency: float, bot_latency: float) -> None:
+        self.upstream_latency = upstream_latency
+        self.bot_latency = bot_latency
+        self.calls = Counter()
+        self._ids = itertools.count(1)
+        self._runner = None
+        self.url = ""
+
+    @staticmethod
+    async def _delay(latency: float) -> None:
+        if latency > 0:
+            await asyncio.sleep(random.uniform(0.8, 1.2) * latency)
+
+    # Fake Bot API
+
+    def _file(self, value, **extra) -> dict:
+        # A plain string is a file_id or URL being resent, anything else is a fresh upload
+        if isinstance(value, str) and not value.startswith("attach://"):
+            file_id = value
+        else:
+            file_id = f"file-{next(self._ids)}"
+        return dict(file_id=file_id, file_unique_id=file_id, **extra)
+
+    def _message(self, params: dict, **content) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+            "from": BOT_USER,
+            **content,
+        }
+
+    async def bot_api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        await self._delay(self.bot_latency)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(params, text=params.get("text", ""))
+        elif method == "sendPhoto":
+            result = self._message(params, photo=[self._file(params.get("photo"), width=320, height=480)])
+        elif method == "sendVideo":
+            result = self._message(params, video=self._file(params.get("video"), width=640, height=360, duration=10))
+        elif method == "sendAudio":
+            result = self._message(params, audio=self._file(params.get("audio"), duration=180))
+        else:
+            # answerCallbackQuery, restrictChatMember, deleteMessage, setWebhook, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    # Stub upstreams
+
+    async def anilist(self, request: web.Request) -> web.Response:
+        variables = (await request.json()).get("variables", {})
+        await self._delay(self.upstream_latency)
+        page, per_page = variables.get("page", 1), variables.get("perPage", 10)
+        media = [
+            {
+                "title": {"romaji": f"Anime {page}-{i}", "english": None if i % 3 else f"Anime {page}-{i}"},
+                "description": f"A trending anime.<br>Number {i} on page {page}.",
+                "siteUrl": f"{self.url}/anime/{page}/{i}",
+                "coverImage": {"large": f"{self.url}/covers/anime/{page}/{i}.jpg"},
+            }
+            for i in range(per_page)
+        ]
+        return web.json_response({"data": {"Page": {"media": media}}})
+
+    async def tvmaze(self, request: web.Request) -> web.Response:
+        page = int(request.query.get("page", 0))
+        await self._delay(self.upstream_latency)
+        if page > 2:
+            return web.json_response({}, status=404)
+        shows = [
+            {
+                "name": f"Show {page}-{i}",
+                "summary": f"<p>A TV show, number {i} on page {page}.</p>",
+                "officialSite": None,
+                "url": f"{self.url}/shows/{page}/{i}",
+                "image": {"medium": f"{self.url}/covers/shows/{page}/{i}.jpg"} if i % 4 else None,
+            }
+            for i in range(250)
+        ]
+        return web.json_response(shows, headers={"ETag": f'"shows-{page}"'})
+
+    async def dictionary(self, request: web.Request) -> web.Response:
+        word = request.match_info["word"]
+        await self._delay(self.upstream_latency)
+        if word.startswith("zz"):
+            return web.json_response({"title": "No Definitions Found"}, status=404)
+        meanings = [{"partOfSpeech": "noun", "definitions": [{"definition": f"The meaning of {word}."}]}]
+        return web.json_response([{"word": word, "meanings": meanings}])
+
+    async def cat(self, request: web.Request) -> web.Response:
+        await self._delay(self.upstream_latency)
+        return web.json_response([{"url": f"{self.url}/cats/{next(self._ids)}.jpg"}])
+
+    async def wiki(self, request: web.Request) -> web.Response:
+        title = request.match_info["title"].replace("_", " ")
+        await self._delay(self.upstream_latency)
+        canonical = {"luffy": "Monkey D. Luffy", "one piece": "One Piece"}.get(title.lower(), title)
+        return web.json_response({
+            "title": canonical,
+            "extract": f"{canonical} is a stub article used by the benchmark.",
+            "content_urls": {"desktop": {"page": f"{self.url}/wiki/{canonical.replace(' ', '_')}"}},
+        })
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.bot_api)
+        app.router.add_post("/anilist", self.anilist)
+        app.router.add_get("/tvmaze/shows", self.tvmaze)
+        app.router.add_get("/dictionary/{word}", self.dictionary)
+        app.router.add_get("/cat", self.cat)
+        app.router.add_get("/wiki/page/summary/{title}", self.wiki)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+
+class UpdateFactory:
+    """Builds synthetic Telegram updates for each scenario."""
+
+    def __init__(self, chats: int) -> None:
+        self.chats = chats
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _chat(self, chat_id: int) -> dict:
+        return {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}"}
+
+    def _command(self, text: str) -> dict:
+        chat_id = -1000 - random.randrange(self.chats)
+        user_id = random.randrange(1, 10000)
+        command = text.split()[0]
+        return {
+            "update_id": next(self._ids),
+            "message": {
+                "message_id": next(self._ids),
+                "date": int(time.time()),
+                "chat": self._chat(chat_id),
+                "from": self._user(user_id),
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            },
+        }
+
+    def _text(self, text: str) -> dict:
+        update = self._command(text)
+        del update["message"]["entities"]
+        return update
+
+    def _callback(self, data: str) -> dict:
+        chat_id = -1000 - random.randrange(self.chats)
+        return {
+            "update_id": next(self._ids),
+            "callback_query": {
+                "id": str(next(self._ids)),
+                "from": self._user(random.randrange(1, 10000)),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._ids),
+                    "date": int(time.time()),
+                    "chat": self._chat(chat_id),
+                    "from": BOT_USER,
+                    "text": "Menu",
+                },
+            },
+        }
+
+    def build(self, scenario: str) -> dict:
+        if scenario == "start":
+            return self._command("/start")
+        if scenario == "define":
+            return self._command(f"/define {random.choice(WORDS)}")
+        if scenario == "wiki":
+            return self._command(f"/wiki {random.choice(WIKI_TITLES)}")
+        if scenario == "anime":
+            return self._command("/anime")
+        if scenario == "series":
+            return self._command("/series")
+        if scenario == "cat":
+            return self._command("/cat")
+        if scenario == "button":
+            return self._callback(random.choice(["help", "anime_recommendations", "series_recommendations"]))
+        if scenario == "chatter":
+            # Group messages not meant for the bot, which most updates are
+            return self._text(random.choice(["hi", "lol", "anyone here?", "good morning"]))
+        if scenario == "mute":
+            update = self._command("/tmute 10m")
+            message = update["message"]
+            message["reply_to_message"] = {
+                "message_id": next(self._ids),
+                "date": int(time.time()),
+                "chat": message["chat"],
+                "from": self._user(random.randrange(10000, 20000)),
+                "text": "spam",
+            }
+            return update
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def load_bot_module():
+    """Import "Nami Git.py", which cannot be imported by name because of the space."""
+    spec = importlib.util.spec_from_file_location("nami_git", os.path.join(HERE, "Nami Git.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def run(args: argparse.Namespace) -> None:
+    stubs = StubServer(args.upstream_latency_ms / 1000, args.bot_latency_ms / 1000)
+    await stubs.start()
+
+    # Point the bot at the stubs before its modules read their configuration
+    workdir = tempfile.mkdtemp(prefix="nami-benchmark-")
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "BOT_API_URL": stubs.url,
+        "ANILIST_API_URL": f"{stubs.url}/anilist",
+        "TVMAZE_API_URL": f"{stubs.url}/tvmaze",
+        "DICTIONARY_API_URL": f"{stubs.url}/dictionary",
+        "CAT_API_URL": f"{stubs.url}/cat",
+        "WIKI_API_URL": f"{stubs.url}/wiki",
+        "CACHE_DB_PATH": os.path.join(workdir, "cache.sqlite3"),
+        "MEDIA_STORE_DIR": os.path.join(workdir, "downloads"),
+    })
+    if not args.flood_limits:
+        # Measure the handlers, not the send scheduler waiting for Telegram's flood limits
+        os.environ.update({"SEND_GLOBAL_RATE": "100000", "SEND_CHAT_RATE": "100000", "SEND_GROUP_RATE": "100000"})
+    # The /start video path is relative to the repository root
+    os.chdir(os.path.dirname(HERE))
+    sys.path.insert(0, HERE)
+    bot = load_bot_module()
+
+    from telegram import Update
+
+    application = bot.build_application()
+    scenario_of = {}
+    errors = Counter()
+
+    async def count_error(update, context) -> None:
+        errors[scenario_of.get(getattr(update, "update_id", None), "unknown")] += 1
+
+    application.add_error_handler(count_error)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    await bot.catalog.wait_ready(30)
+    # Load starts once the warm-ups are over, so it is not measured against the worker processes starting
+    await bot.startup.timer.wait()
+
+    factory = UpdateFactory(args.chats)
+    weights = parse_mix(args.mix)
+    scenarios = random.choices(list(weights), weights=list(weights.values()), k=args.updates)
+    latencies = defaultdict(list)
+
+    async def drive(update: Update, scenario: str) -> None:
+        start = time.perf_counter()
+        # The same path Application takes for every update it fetches
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies[scenario].append(time.perf_counter() - start)
+
+    tasks = []
+    started = time.perf_counter()
+    for i, scenario in enumerate(scenarios):
+        delay = started + i / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        update = Update.de_json(factory.build(scenario), application.bot)
+        scenario_of[update.update_id] = scenario
+        tasks.append(asyncio.create_task(drive(update, scenario)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await stubs.stop()
+
+    print(f"STARTUP_WARMUP={bot.startup.STARTUP_WARMUP}, load started after the warm-ups finished")
+    print(f"{'scenario':<10}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    all_latencies = []
+    for scenario in sorted(latencies):
+        values = latencies[scenario]
+        all_latencies += values
+        print(f"{scenario:<10}{len(values):>8}{errors[scenario]:>8}"
+              f"{percentile(values, 0.5) * 1000:>10.1f}{percentile(values, 0.99) * 1000:>10.1f}")
+    print(f"{'all':<10}{len(all_latencies):>8}{sum(errors.values()):>8}"
+          f"{percentile(all_latencies, 0.5) * 1000:>10.1f}{percentile(all_latencies, 0.99) * 1000:>10.1f}")
+    print(f"\n{len(all_latencies)} updates in {elapsed:.2f}s: {len(all_latencies) / elapsed:.1f} updates/s "
+          f"(offered {args.rate:g}/s)")
+    print("Bot API calls: " + json.dumps(dict(stubs.calls.most_common())))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000, help="number of updates to send")
+    parser.add_argument("--rate", type=float, default=200, help="updates offered per second")
+    parser.add_argument("--chats", type=int, default=50, help="number of distinct group chats")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--upstream-latency-ms", type=float, default=50, help="latency of the stub APIs")
+    parser.add_argument("--bot-latency-ms", type=float, default=10, help="latency of the fake Bot API")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for a repeatable run")
+    parser.add_argument("--flood-limits", action="store_true",
+                        help="keep the send scheduler's flood limits (off by default, they dominate the latency)")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""In-memory anime and series catalogs, refreshed in the background."""
+import asyncio
+import os
+import random
+from typing import Dict, List, Optional
+
+from http_client import client as http
+
+# AniList GraphQL API URL
+ANILIST_API_URL = os.getenv("ANILIST_API_URL", "https://graphql.anilist.co")
+TVMAZE_API_URL = os.getenv("TVMAZE_API_URL", "https://api.tvmaze.com")
+
+# How much to fetch and how often (override with environment variables)
+ANIME_CATALOG_PAGES = int(os.getenv("ANIME_CATALOG_PAGES", "4"))
+ANIME_CATALOG_PER_PAGE = int(os.getenv("ANIME_CATALOG_PER_PAGE", "50"))
+SERIES_CATALOG_PAGES = int(os.getenv("SERIES_CATALOG_PAGES", "3"))
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "3600"))
+
+TRENDING_ANIME_QUERY = """
+query ($page: Int, $perPage: Int) {
+    Page(page: $page, perPage: $perPage) {
+        media(type: ANIME, sort: TRENDING_DESC) {
+            title {
+                romaji
+                english
+            }
+            description
+            siteUrl
+            coverImage {
+                large
+            }
+        }
+    }
+}
+"""
+
+
+def slim_anime(media: dict) -> Optional[dict]:
+    """Keep only what recommend_anime renders."""
+    if not media.get("description"):
+        return None
+    return {
+        "title": media["title"]["english"] or media["title"]["romaji"],
+        "description": media["description"],
+        "url": media["siteUrl"],
+        "image": (media.get("coverImage") or {}).get("large"),
+    }
+
+
+def slim_series(show: dict) -> Optional[dict]:
+    """Keep only what recommend_series renders."""
+    if not show.get("summary"):
+        return None
+    return {
+        "title": show["name"],
+        "description": show["summary"],
+        "url": show.get("officialSite") or show["url"],  # Use the official site if available
+        "image": (show.get("image") or {}).get("medium"),
+    }
+
+
+class CatalogStore:
+    """Holds the slimmed anime and series lists and keeps them fresh.
+
+    Recommendations are picked from memory; only the background refresh talks
+    to AniList and TVMaze, using conditional requests where the API supports them.
+    """
+
+    def __init__(self, refresh_interval: float = CATALOG_REFRESH_INTERVAL) -> None:
+        self.refresh_interval = refresh_interval
+        self.anime: List[dict] = []
+        self.series: List[dict] = []
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # request -> (validators, parsed items) from the last successful response
+        self._pages: Dict[str, tuple] = {}
+
+    def random_anime(self) -> Optional[dict]:
+        return random.choice(self.anime) if self.anime else None
+
+    def random_series(self) -> Optional[dict]:
+        return random.choice(self.series) if self.series else None
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait for the first refresh, used only right after startup."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _fetch(self, method: str, url: str, extract, slim, **kwargs) -> List[dict]:
+        """Fetch one page, reusing the previous result when the server answers 304 Not Modified."""
+        cache_key = url + repr(kwargs.get("params")) + repr(kwargs.get("json"))
+        validators, previous = self._pages.get(cache_key, ({}, None))
+        headers = {}
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+
+        response = await http.request(method, url, headers=headers, **kwargs)
+        if response.status == 304 and previous is not None:
+            return previous
+        response.raise_for_status()
+        items = [item for item in map(slim, extract(response.json())) if item is not None]
+        validators = {name: response.headers[name] for name in ("ETag", "Last-Modified") if name in response.headers}
+        self._pages[cache_key] = (validators, items)
+        return items
+
+    async def refresh_anime(self) -> None:
+        anime = []
+        for page in range(1, ANIME_CATALOG_PAGES + 1):
+            variables = {"page": page, "perPage": ANIME_CATALOG_PER_PAGE}
+            anime += await self._fetch("POST", ANILIST_API_URL, lambda data: data["data"]["Page"]["media"],
+                                       slim_anime, json={"query": TRENDING_ANIME_QUERY, "variables": variables})
+        if anime:
+            self.anime = anime
+
+    async def refresh_series(self) -> None:
+        series = []
+        for page in range(SERIES_CATALOG_PAGES):
+            series += await self._fetch("GET", f"{TVMAZE_API_URL}/shows", lambda data: data, slim_series,
+                                        params={"page": page})
+        if series:
+            self.series = series
+
+    async def refresh(self) -> None:
+        for name, refresh in (("anime", self.refresh_anime), ("series", self.refresh_series)):
+            try:
+                await refresh()
+            except Exception as e:
+                # Keep serving the previous catalog
+                print(f"Error refreshing {name} catalog: {e}")
+        if self.anime or self.series:
+            self._ready.set()
+
+    async def _refresh_forever(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# The one catalog shared by the whole bot
+catalog = CatalogStore()
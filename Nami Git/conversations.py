@@ -0,0 +1,93 @@
+"""Small talk with the bot: which messages are meant for it, and where each conversation stands."""
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from telegram import Message
+from telegram.ext import filters
+
+from state_backend import StateBackend
+
+# How long a conversation is remembered and how many are kept (override with environment variables)
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", str(24 * 3600)))
+CONVERSATION_STORE_SIZE = int(os.getenv("CONVERSATION_STORE_SIZE", "10000"))
+
+
+class ReplyToBot(filters.MessageFilter):
+    """Messages replying to one of the bot's own messages.
+
+    Combined after filters.REPLY, ordinary group chatter is turned away by the
+    filter before its handler ever runs.
+    """
+
+    def filter(self, message: Message) -> bool:
+        replied = message.reply_to_message
+        return replied is not None and replied.from_user is not None and replied.from_user.id == message.get_bot().id
+
+
+REPLY_TO_BOT = ReplyToBot(name="ReplyToBot")
+
+
+class ConversationStore:
+    """The state of each conversation, by (chat, user).
+
+    Entries expire after ``ttl`` and the least recently used go once there are
+    ``size`` of them. With a shared state backend they are kept there instead,
+    expiring after ``ttl``, so every worker continues the same conversation.
+    """
+
+    def __init__(self, backend: StateBackend, size: int = CONVERSATION_STORE_SIZE,
+                 ttl: float = CONVERSATION_TTL) -> None:
+        self.backend = backend
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # (chat, user) -> (expires, state), least recently used first
+        self._states: "OrderedDict[Tuple[int, int], Tuple[float, str]]" = OrderedDict()
+
+    @staticmethod
+    def _key(chat_id: int, user_id: int) -> str:
+        return f"conversation:{chat_id}:{user_id}"
+
+    async def get(self, chat_id: int, user_id: int) -> Optional[str]:
+        if self.backend.shared:
+            value = await self.backend.get(self._key(chat_id, user_id))
+        else:
+            entry = self._states.get((chat_id, user_id))
+            value = None
+            if entry is not None and entry[0] > time.time():
+                self._states.move_to_end((chat_id, user_id))
+                value = entry[1]
+            elif entry is not None:
+                del self._states[(chat_id, user_id)]
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, chat_id: int, user_id: int, value: str) -> None:
+        if self.backend.shared:
+            await self.backend.set(self._key(chat_id, user_id), value, ttl=self.ttl)
+            return
+        self._states[(chat_id, user_id)] = (time.time() + self.ttl, value)
+        self._states.move_to_end((chat_id, user_id))
+        while len(self._states) > self.size:
+            self._states.popitem(last=False)
+
+    async def delete(self, chat_id: int, user_id: int) -> None:
+        if self.backend.shared:
+            await self.backend.delete(self._key(chat_id, user_id))
+        else:
+            self._states.pop((chat_id, user_id), None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._states),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,161 @@
+"""Dictionary lookups with an in-process LRU in front of a local SQLite store.
+
+Preload a word list ahead of time with:
+
+    python dictionary.py words.txt
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from file_id_cache import CACHE_DB_PATH
+from http_client import client as http
+
+DICTIONARY_API_URL = os.getenv("DICTIONARY_API_URL", "https://api.dictionaryapi.dev/api/v2/entries/en")
+
+# Cache sizes and lifetimes (override with environment variables)
+DICTIONARY_LRU_SIZE = int(os.getenv("DICTIONARY_LRU_SIZE", "2048"))
+DICTIONARY_TTL = float(os.getenv("DICTIONARY_TTL", str(30 * 24 * 3600)))
+DICTIONARY_NEGATIVE_TTL = float(os.getenv("DICTIONARY_NEGATIVE_TTL", str(24 * 3600)))
+
+# A list of (part of speech, [definitions]), or None for a word the API does not know
+Meanings = Optional[List[Tuple[str, List[str]]]]
+
+
+class DictionaryError(Exception):
+    """The dictionary API could not be reached or answered with an error."""
+
+
+def parse_meanings(data: list) -> List[Tuple[str, List[str]]]:
+    """Keep only the parts of the API response define_word renders."""
+    return [
+        (meaning.get("partOfSpeech", "N/A"), [definition.get("definition") for definition in meaning.get("definitions", [])])
+        for meaning in data[0].get("meanings", [])
+    ]
+
+
+class Dictionary:
+    """Looks words up in the LRU, then SQLite, then the API.
+
+    Words the API does not know are cached too, for the shorter negative TTL.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, lru_size: int = DICTIONARY_LRU_SIZE,
+                 ttl: float = DICTIONARY_TTL, negative_ttl: float = DICTIONARY_NEGATIVE_TTL) -> None:
+        self.lru_size = lru_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, Tuple[float, Meanings]]" = OrderedDict()
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS definitions ("
+            " word TEXT PRIMARY KEY, meanings TEXT, expires REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def normalize(word: str) -> str:
+        return " ".join(word.lower().split())
+
+    def _remember(self, word: str, meanings: Meanings, expires: float) -> None:
+        self._lru[word] = (expires, meanings)
+        self._lru.move_to_end(word)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def cached(self, word: str) -> Tuple[bool, Meanings]:
+        """Return (found, meanings) from the LRU or SQLite without going to the network."""
+        now = time.time()
+        entry = self._lru.get(word)
+        if entry is not None and entry[0] > now:
+            self._lru.move_to_end(word)
+            return True, entry[1]
+
+        row = self._db.execute("SELECT meanings, expires FROM definitions WHERE word = ?", (word,)).fetchone()
+        if row is not None and row[1] > now:
+            meanings = None if row[0] is None else [tuple(meaning) for meaning in json.loads(row[0])]
+            self._remember(word, meanings, row[1])
+            return True, meanings
+        return False, None
+
+    def store(self, word: str, meanings: Meanings) -> None:
+        expires = time.time() + (self.ttl if meanings is not None else self.negative_ttl)
+        self._db.execute(
+            "INSERT OR REPLACE INTO definitions (word, meanings, expires) VALUES (?, ?, ?)",
+            (word, None if meanings is None else json.dumps(meanings), expires),
+        )
+        self._remember(word, meanings, expires)
+
+    async def fetch(self, word: str) -> Meanings:
+        """Ask the API. Raises DictionaryError for failures that should not be cached."""
+        try:
+            response = await http.get(f"{DICTIONARY_API_URL}/{word}")
+        except Exception as e:
+            raise DictionaryError(str(e)) from e
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise DictionaryError(f"HTTP {response.status}")
+        return parse_meanings(response.json())
+
+    async def lookup(self, word: str) -> Meanings:
+        word = self.normalize(word)
+        found, meanings = self.cached(word)
+        if found:
+            self.hits += 1
+            return meanings
+        self.misses += 1
+        meanings = await self.fetch(word)
+        self.store(word, meanings)
+        return meanings
+
+    async def preload(self, words: Iterable[str], concurrency: int = 4) -> int:
+        """Fetch every word that is not cached yet. Returns how many were fetched."""
+        semaphore = asyncio.Semaphore(concurrency)
+        todo = {self.normalize(word) for word in words if word.strip()}
+        todo = [word for word in todo if not self.cached(word)[0]]
+
+        async def load(word: str) -> None:
+            async with semaphore:
+                try:
+                    self.store(word, await self.fetch(word))
+                except DictionaryError as e:
+                    print(f"Could not preload '{word}': {e}")
+
+        await asyncio.gather(*(load(word) for word in todo))
+        return len(todo)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        self._db.close()
+
+
+# The one dictionary shared by the whole bot
+dictionary = Dictionary()
+
+
+async def _preload_main(path: str) -> None:
+    with open(path, encoding="utf-8") as word_list:
+        fetched = await dictionary.preload(word_list)
+    await http.close()
+    print(f"Preloaded {fetched} new words into {CACHE_DB_PATH}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python dictionary.py <word list file>")
+    asyncio.run(_preload_main(sys.argv[1]))
@@ -0,0 +1,482 @@
+"""Download job queue: yt-dlp runs in a pool of worker processes, off the event loop."""
+import asyncio
+import itertools
+import multiprocessing
+import os
+import queue
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Pool and queue limits (override with environment variables)
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "2"))
+# Processes for probes and searches, kept apart so they never wait behind a download
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", "2"))
+MAX_JOBS_PER_USER = int(os.getenv("MAX_DOWNLOAD_JOBS_PER_USER", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_DOWNLOAD_JOBS", "20"))
+# Seconds between two progress reports from a worker
+PROGRESS_INTERVAL = float(os.getenv("DOWNLOAD_PROGRESS_INTERVAL", "2"))
+# Largest file the bot may send (50 MB on the public Bot API, 2000 MB on a local Bot API server)
+UPLOAD_LIMIT_MB = float(os.getenv("TELEGRAM_UPLOAD_LIMIT_MB", "50"))
+UPLOAD_LIMIT = UPLOAD_LIMIT_MB * 1024 * 1024
+
+
+class DownloadError(Exception):
+    """The download failed inside the worker process."""
+
+
+class DownloadCancelled(DownloadError):
+    """The job was cancelled by its owner."""
+
+
+class QueueFull(DownloadError):
+    """The user or the whole bot has too many downloads queued."""
+
+
+class TooLarge(DownloadError):
+    """No version of the media fits under the upload limit."""
+
+
+def _run_download(job_id: int, url: str, ydl_opts: dict, events, cancelled, info: Optional[dict] = None) -> dict:
+    """Run one yt-dlp download. Executes in a worker process.
+
+    ``info`` is the result of an earlier extraction of the URL (see _run_probe), so only
+    the format selection and the download itself are left to do.
+    """
+    import yt_dlp
+
+    last_report = [0.0]
+    # When the download started and when post-processing (transcoding, merging) started
+    timings = {"start": time.monotonic(), "postprocess": None}
+
+    def check_cancelled() -> None:
+        if job_id in cancelled:
+            raise yt_dlp.utils.DownloadCancelled()
+
+    def progress_hook(d: dict) -> None:
+        now = time.monotonic()
+        if d["status"] not in ("downloading", "finished"):
+            return
+        if d["status"] == "downloading" and now - last_report[0] < PROGRESS_INTERVAL:
+            return
+        last_report[0] = now
+        check_cancelled()
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        events.put((job_id, d["status"], {"downloaded": d.get("downloaded_bytes"), "total": total}))
+
+    def postprocessor_hook(d: dict) -> None:
+        check_cancelled()
+        if d["status"] == "started":
+            if timings["postprocess"] is None:
+                timings["postprocess"] = time.monotonic()
+            events.put((job_id, "processing", {"postprocessor": d.get("postprocessor")}))
+
+    opts = dict(ydl_opts, progress_hooks=[progress_hook], postprocessor_hooks=[postprocessor_hook],
+                noprogress=True, quiet=True)
+    # Results travel back as plain dicts, yt-dlp exceptions do not always survive pickling
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            if info is not None:
+                info = ydl.process_ie_result(info, download=True)
+            else:
+                info = ydl.extract_info(url, download=True)
+            if info.get("entries") is not None:  # ytsearch: returns a playlist
+                info = next(iter(info["entries"]), None)
+                if info is None:
+                    return {"error": "No results found."}
+            downloads = info.get("requested_downloads") or [{}]
+            filepath = downloads[-1].get("filepath") or ydl.prepare_filename(info)
+    except yt_dlp.utils.DownloadCancelled:
+        return {"cancelled": True}
+    except Exception as e:
+        if job_id in cancelled:
+            return {"cancelled": True}
+        return {"error": str(e)}
+    end = time.monotonic()
+    postprocess_start = timings["postprocess"] or end
+    return {
+        "id": info.get("id"),
+        "title": info.get("title"),
+        "ext": os.path.splitext(filepath)[1].lstrip("."),
+        "filepath": filepath,
+        "download_seconds": postprocess_start - timings["start"],
+        "postprocess_seconds": end - postprocess_start,
+    }
+
+
+def _warm_worker() -> None:
+    """Import yt-dlp in a worker process ahead of its first download."""
+    import yt_dlp  # noqa: F401
+
+
+def _run_metadata(fn: Callable, *args):
+    """Run a probe or search in a probe process.
+
+    yt-dlp's own exceptions do not all survive being pickled back to the bot,
+    so they come back as DownloadError with the same message.
+    """
+    try:
+        return fn(*args)
+    except DownloadError:
+        raise
+    except Exception as e:
+        raise DownloadError(str(e)) from None
+
+
+def _video_info(info: dict, url: Optional[str] = None) -> dict:
+    extractor = info.get("ie_key") or info.get("extractor_key") or "generic"
+    return {
+        "id": info["id"],
+        "title": info.get("title"),
+        "key": f"{extractor}:{info['id']}".lower(),
+        "url": info.get("webpage_url") or info.get("url") or url,
+        "duration": info.get("duration"),
+    }
+
+
+def _format_listing(info: dict) -> dict:
+    keys = ("format_id", "ext", "vcodec", "acodec", "height", "tbr", "abr", "filesize", "filesize_approx")
+    return {
+        "duration": info.get("duration"),
+        "formats": [{key: f.get(key) for key in keys} for f in info.get("formats") or [info]],
+    }
+
+
+def _extraction(ydl, info: dict) -> dict:
+    """The extraction result to hand to the download worker, without what the download does not use."""
+    info = ydl.sanitize_info(info)
+    for key in ("automatic_captions", "subtitles", "thumbnails", "heatmap"):
+        info.pop(key, None)
+    return info
+
+
+def _run_probe(url: str) -> dict:
+    """Resolve a URL or ytsearch: query to a single video without downloading anything.
+
+    A single video URL is fully extracted (extract_flat only applies to playlists), so its
+    format listing and extraction come along for pick_format and the download worker.
+    """
+    import yt_dlp
+
+    opts = {"quiet": True, "noprogress": True, "skip_download": True, "extract_flat": "in_playlist"}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        if info.get("entries") is not None:
+            info = next(iter(info["entries"]), None)
+            if info is None:
+                raise DownloadError("No results found.")
+            return _video_info(info, url)
+        video = _video_info(info, url)
+        if info.get("formats"):
+            video.update(_format_listing(info), info=_extraction(ydl, info))
+        return video
+
+
+def _run_search(query: str, count: int) -> list:
+    """The top ``count`` YouTube results for a query, from the result page alone (flat extraction)."""
+    import yt_dlp
+
+    opts = {"quiet": True, "noprogress": True, "skip_download": True, "extract_flat": True}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(f"ytsearch{count}:{query}", download=False)
+    return [_video_info(entry) for entry in info.get("entries") or [] if entry and entry.get("id")]
+
+
+def _run_format_probe(url: str) -> dict:
+    """List the formats of a single video without downloading it, along with its extraction for the download."""
+    import yt_dlp
+
+    opts = {"quiet": True, "noprogress": True, "skip_download": True, "noplaylist": True}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        return dict(_format_listing(info), info=_extraction(ydl, info))
+
+
+def _estimated_size(fmt: dict, duration: Optional[float]) -> Optional[float]:
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if not size and fmt.get("tbr") and duration:
+        # tbr is in kbit/s
+        size = fmt["tbr"] * 1000 / 8 * duration
+    return size
+
+
+def _has(fmt: dict, codec: str) -> bool:
+    return fmt.get(codec) not in (None, "none")
+
+
+def choose_format(info: dict, max_bytes: float = UPLOAD_LIMIT, merge: bool = False) -> Optional[dict]:
+    """Pick the best format whose (estimated) size fits under max_bytes.
+
+    With ``merge`` a video-only format may be paired with the best audio-only one.
+    Returns None when no format reports a size, and raises TooLarge when none fits.
+    """
+    duration = info.get("duration")
+    candidates: List[dict] = []
+    audios = []
+    for fmt in info["formats"]:
+        size = _estimated_size(fmt, duration)
+        if size is None:
+            continue
+        if _has(fmt, "vcodec") and _has(fmt, "acodec"):
+            candidates.append(dict(fmt, format=fmt["format_id"], size=size))
+        elif _has(fmt, "acodec"):
+            audios.append(dict(fmt, size=size))
+    if merge and audios:
+        # M4A audio merges into MP4 without re-encoding
+        audio = max(audios, key=lambda fmt: (fmt.get("ext") == "m4a", fmt.get("abr") or fmt.get("tbr") or 0))
+        for fmt in info["formats"]:
+            size = _estimated_size(fmt, duration)
+            if size is not None and _has(fmt, "vcodec") and not _has(fmt, "acodec"):
+                candidates.append(dict(fmt, format=f"{fmt['format_id']}+{audio['format_id']}", size=size + audio["size"]))
+    if not candidates:
+        return None
+    candidates.sort(key=lambda fmt: (fmt.get("height") or 0, fmt.get("tbr") or 0), reverse=True)
+    for fmt in candidates:
+        if fmt["size"] <= max_bytes:
+            return fmt
+    smallest = min(fmt["size"] for fmt in candidates)
+    raise TooLarge(f"This video is too big to send on Telegram: even the smallest version is about "
+                   f"{smallest / 2**20:.0f} MB and the limit is {max_bytes / 2**20:.0f} MB.")
+
+
+class DownloadJob:
+    """A queued or running download and its latest progress."""
+
+    def __init__(self, job_id: int, user_id: int, url: str, ydl_opts: dict,
+                 on_update: Optional[Callable[["DownloadJob"], Awaitable[None]]], info: Optional[dict] = None) -> None:
+        self.id = job_id
+        self.user_id = user_id
+        self.url = url
+        self.ydl_opts = ydl_opts
+        self.info = info
+        self.on_update = on_update
+        self.state = "queued"
+        self.position = 0
+        self.progress: dict = {}
+        self.queued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def describe(self) -> str:
+        """Human readable status for the queue/progress reply."""
+        if self.state == "queued":
+            return f"⏳ Queued, position {self.position} in line."
+        if self.state == "starting":
+            return "🚀 Starting download..."
+        if self.state == "cancelling":
+            return "🛑 Cancelling..."
+        if self.state == "downloading":
+            downloaded, total = self.progress.get("downloaded"), self.progress.get("total")
+            if downloaded and total:
+                return (f"⬇️ Downloading: {downloaded * 100 // total}% "
+                        f"({downloaded / 1e6:.1f} MB of {total / 1e6:.1f} MB)")
+            return "⬇️ Downloading..."
+        if self.state == "finished":
+            return "✅ Download finished, preparing file..."
+        if self.state == "processing":
+            return f"⚙️ Converting ({self.progress.get('postprocessor') or 'ffmpeg'})..."
+        return self.state
+
+    async def result(self) -> dict:
+        """Wait for the job and return its result, raising DownloadError on failure."""
+        return await asyncio.shield(self.future)
+
+
+class DownloadManager:
+    """Bounded process pool with a FIFO queue and per-user and global caps."""
+
+    def __init__(self, workers: int = DOWNLOAD_WORKERS, per_user: int = MAX_JOBS_PER_USER,
+                 max_queued: int = MAX_QUEUED_JOBS, probe_workers: int = PROBE_WORKERS) -> None:
+        self.workers = workers
+        self.probe_workers = probe_workers
+        self.per_user = per_user
+        self.max_queued = max_queued
+        self._ids = itertools.count(1)
+        self._pending: deque = deque()
+        self._running: Dict[int, DownloadJob] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._probe_pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._events = None
+        self._cancelled = None
+        self._relay_task: Optional[asyncio.Task] = None
+
+    def _start(self) -> None:
+        # Worker processes are only created once the first download is requested
+        if self._pool is not None:
+            return
+        context = multiprocessing.get_context("spawn")
+        self._manager = context.Manager()
+        self._events = self._manager.Queue()
+        self._cancelled = self._manager.dict()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self._relay_task = asyncio.get_running_loop().create_task(self._relay_progress())
+
+    def _start_probes(self) -> ProcessPoolExecutor:
+        # Extraction is pure Python and holds the GIL, so it stays out of the bot's process too
+        if self._probe_pool is None:
+            context = multiprocessing.get_context("spawn")
+            self._probe_pool = ProcessPoolExecutor(max_workers=self.probe_workers, mp_context=context)
+        return self._probe_pool
+
+    async def _run_probe_pool(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._start_probes(), _run_metadata, fn, *args)
+
+    async def warm(self) -> None:
+        """Start the worker and probe processes, with yt-dlp imported, before the first search or download needs them."""
+        loop = asyncio.get_running_loop()
+        self._start()
+        probes = self._start_probes()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _warm_worker) for _ in range(self.workers)),
+                             *(loop.run_in_executor(probes, _warm_worker) for _ in range(self.probe_workers)))
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def active(self) -> int:
+        return len(self._running)
+
+    def jobs_of(self, user_id: int) -> list:
+        return [job for job in itertools.chain(self._running.values(), self._pending) if job.user_id == user_id]
+
+    async def probe(self, url: str) -> dict:
+        """Find out which video a URL or search query points to.
+
+        Only metadata is fetched, so this runs in a probe process instead of taking a download worker.
+        """
+        return await self._run_probe_pool(_run_probe, url)
+
+    async def search(self, query: str, count: int) -> list:
+        """Search YouTube in a probe process; only the result list is fetched, no video pages."""
+        return await self._run_probe_pool(_run_search, query, count)
+
+    async def probe_formats(self, url: str) -> dict:
+        """The duration and available formats of a video, fetched in a probe process like probe()."""
+        return await self._run_probe_pool(_run_format_probe, url)
+
+    def submit(self, user_id: int, url: str, ydl_opts: dict,
+               on_update: Optional[Callable[[DownloadJob], Awaitable[None]]] = None,
+               info: Optional[dict] = None) -> DownloadJob:
+        """Queue a download, of an already extracted ``info`` if given. Raises QueueFull when a cap is reached."""
+        if len(self.jobs_of(user_id)) >= self.per_user:
+            raise QueueFull(f"You already have {self.per_user} downloads in progress. Please wait for them to finish.")
+        if len(self._pending) >= self.max_queued:
+            raise QueueFull("The download queue is full right now. Please try again in a few minutes.")
+        self._start()
+        job = DownloadJob(next(self._ids), user_id, url, ydl_opts, on_update, info)
+        self._pending.append(job)
+        job.position = len(self._pending)
+        self._notify(job)
+        self._dispatch()
+        return job
+
+    def cancel(self, job_id: int, user_id: Optional[int] = None) -> bool:
+        """Cancel a queued or running job. Only its owner may cancel when user_id is given."""
+        for job in list(self._pending):
+            if job.id == job_id and (user_id is None or job.user_id == user_id):
+                self._pending.remove(job)
+                self._finish(job, "cancelled", exception=DownloadCancelled("Download cancelled."))
+                self._update_positions()
+                return True
+        job = self._running.get(job_id)
+        if job is not None and (user_id is None or job.user_id == user_id):
+            # The worker notices the flag in its next progress hook
+            self._cancelled[job_id] = True
+            job.state = "cancelling"
+            return True
+        return False
+
+    def _dispatch(self) -> None:
+        while self._pending and len(self._running) < self.workers:
+            job = self._pending.popleft()
+            job.state = "starting"
+            job.started_at = time.monotonic()
+            self._running[job.id] = job
+            self._notify(job)
+            future = asyncio.get_running_loop().run_in_executor(
+                self._pool, _run_download, job.id, job.url, job.ydl_opts, self._events, self._cancelled, job.info
+            )
+            future.add_done_callback(lambda done, job=job: self._on_done(job, done))
+        self._update_positions()
+
+    def _update_positions(self) -> None:
+        for position, job in enumerate(self._pending, start=1):
+            if job.position != position:
+                job.position = position
+                self._notify(job)
+
+    def _on_done(self, job: DownloadJob, done: asyncio.Future) -> None:
+        self._running.pop(job.id, None)
+        self._cancelled.pop(job.id, None)
+        if done.cancelled():
+            self._finish(job, "cancelled", exception=DownloadCancelled("Download cancelled."))
+        elif done.exception() is not None:
+            self._finish(job, "failed", exception=DownloadError(str(done.exception())))
+        else:
+            result = done.result()
+            if result.get("cancelled"):
+                self._finish(job, "cancelled", exception=DownloadCancelled("Download cancelled."))
+            elif result.get("error"):
+                self._finish(job, "failed", exception=DownloadError(result["error"]))
+            else:
+                self._finish(job, "done", result=result)
+        self._dispatch()
+
+    @staticmethod
+    def _finish(job: DownloadJob, state: str, result: Optional[dict] = None,
+                exception: Optional[Exception] = None) -> None:
+        job.state = state
+        if job.future.done():
+            return
+        if exception is not None:
+            job.future.set_exception(exception)
+            # Mark the exception as retrieved in case nobody awaits the job anymore
+            job.future.exception()
+        else:
+            job.future.set_result(result)
+
+    def _notify(self, job: DownloadJob) -> None:
+        if job.on_update is not None:
+            asyncio.get_running_loop().create_task(self._safe_update(job))
+
+    @staticmethod
+    async def _safe_update(job: DownloadJob) -> None:
+        try:
+            await job.on_update(job)
+        except Exception as e:
+            print(f"Error reporting download progress: {e}")
+
+    async def _relay_progress(self) -> None:
+        """Forward progress events from the worker processes to the jobs."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                job_id, state, progress = await loop.run_in_executor(None, self._events.get, True, 0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            job = self._running.get(job_id)
+            if job is None or job.state == "cancelling":
+                continue
+            job.state = state
+            job.progress.update(progress)
+            self._notify(job)
+
+    async def close(self) -> None:
+        if self._relay_task is not None:
+            self._relay_task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._probe_pool is not None:
+            self._probe_pool.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+        self._pool = self._probe_pool = self._manager = self._relay_task = None
+
+
+# The one download queue shared by the whole bot
+manager = DownloadManager()
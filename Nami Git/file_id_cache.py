@@ -0,0 +1,84 @@
+"""Persistent cache of Telegram file_ids for media the bot has already uploaded."""
+import os
+import sqlite3
+import time
+from typing import Optional
+
+# Where the cache lives and how much it keeps (override with environment variables)
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "nami_cache.sqlite3")
+FILE_ID_CACHE_MAX_ENTRIES = int(os.getenv("FILE_ID_CACHE_MAX_ENTRIES", "50000"))
+FILE_ID_CACHE_TTL = float(os.getenv("FILE_ID_CACHE_TTL", str(30 * 24 * 3600)))
+
+
+class FileIdCache:
+    """Maps (media key, format) to the file_id Telegram returned for the upload.
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    evicted once there are more than ``max_entries``.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, max_entries: int = FILE_ID_CACHE_MAX_ENTRIES,
+                 ttl: float = FILE_ID_CACHE_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            " key TEXT NOT NULL, format TEXT NOT NULL, file_id TEXT NOT NULL, file_size INTEGER,"
+            " created REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (key, format))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS file_ids_last_used ON file_ids (last_used)")
+
+    def get(self, key: str, fmt: str) -> Optional[str]:
+        """Return the cached file_id, or None on a miss."""
+        now = time.time()
+        row = self._db.execute(
+            "SELECT file_id, created FROM file_ids WHERE key = ? AND format = ?", (key, fmt)
+        ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        self._db.execute("UPDATE file_ids SET last_used = ? WHERE key = ? AND format = ?", (now, key, fmt))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, fmt: str, file_id: str, file_size: Optional[int] = None) -> None:
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO file_ids (key, format, file_id, file_size, created, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, fmt, file_id, file_size, now, now),
+        )
+        self.evict()
+
+    def delete(self, key: str, fmt: str) -> None:
+        """Forget an entry, e.g. when Telegram no longer accepts its file_id."""
+        self._db.execute("DELETE FROM file_ids WHERE key = ? AND format = ?", (key, fmt))
+
+    def evict(self) -> int:
+        """Drop expired entries and the least recently used ones over the size cap."""
+        removed = self._db.execute("DELETE FROM file_ids WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        removed += self._db.execute(
+            "DELETE FROM file_ids WHERE rowid IN ("
+            " SELECT rowid FROM file_ids ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        return removed
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,138 @@
+"""Shared non-blocking HTTP client used by every handler that calls an external API."""
+import asyncio
+import json
+import os
+import random
+import time
+from typing import TYPE_CHECKING, Any, Optional
+from urllib.parse import urlsplit
+
+import metrics
+
+if TYPE_CHECKING:
+    import aiohttp
+
+# Connection pool and retry settings (override with environment variables)
+HTTP_TOTAL_CONNECTIONS = int(os.getenv("HTTP_TOTAL_CONNECTIONS", "100"))
+HTTP_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_CONNECTIONS_PER_HOST", "10"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "15"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_USER_AGENT = os.getenv("HTTP_USER_AGENT", "Nami/1.0 (glitchyboiiuwu@gmail.com)")
+
+# Status codes that are worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HTTPError(Exception):
+    """Raised by HTTPResponse.raise_for_status() for 4xx/5xx responses."""
+
+    def __init__(self, status: int, url: str) -> None:
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.url = url
+
+
+class HTTPResponse:
+    """A fully read response, so the connection goes straight back to the pool."""
+
+    def __init__(self, url: str, status: int, headers: dict, body: bytes) -> None:
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 400
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise HTTPError(self.status, self.url)
+
+
+class HTTPClient:
+    """Pooled aiohttp session with keep-alive, per-host limits, timeouts and retries.
+
+    aiohttp is only imported when the first request is made (or by warm()), to keep startup fast.
+    """
+
+    def __init__(self) -> None:
+        self._session: Optional["aiohttp.ClientSession"] = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        import aiohttp
+
+        # The session has to be created inside the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_TOTAL_CONNECTIONS,
+                limit_per_host=HTTP_CONNECTIONS_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers={"User-Agent": HTTP_USER_AGENT},
+            )
+        return self._session
+
+    async def request(self, method: str, url: str, *, retries: int = HTTP_RETRIES, **kwargs) -> HTTPResponse:
+        """Send a request, retrying network errors and 429/5xx responses with exponential backoff."""
+        import aiohttp
+
+        session = self._get_session()
+        host = urlsplit(url).hostname or "unknown"
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    body = await response.read()
+                    result = HTTPResponse(str(response.url), response.status, dict(response.headers), body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.external_latency.observe(time.perf_counter() - start, host=host, status=type(e).__name__)
+                metrics.external_errors.inc(host=host)
+                if attempt >= retries:
+                    raise
+                result = None
+            else:
+                metrics.external_latency.observe(time.perf_counter() - start, host=host, status=result.status)
+                if result.status >= 400:
+                    metrics.external_errors.inc(host=host)
+
+            if result is not None and (result.status not in RETRY_STATUSES or attempt >= retries):
+                return result
+
+            # Back off before the next attempt, honouring Retry-After when the server sends one
+            delay = HTTP_BACKOFF * (2 ** attempt) + random.uniform(0, HTTP_BACKOFF)
+            if result is not None and result.headers.get("Retry-After", "").isdigit():
+                delay = max(delay, float(result.headers["Retry-After"]))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> HTTPResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HTTPResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def warm(self) -> None:
+        """Import aiohttp and open the session ahead of the first request."""
+        self._get_session()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# The one client shared by the whole bot
+client = HTTPClient()
@@ -0,0 +1,193 @@
+"""Downloaded media on disk, keyed by video and format and kept under a disk quota."""
+import glob
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Where downloads are kept and how much disk they may use (override with environment variables)
+MEDIA_STORE_DIR = os.getenv("MEDIA_STORE_DIR", "downloads")
+MEDIA_STORE_MAX_MB = float(os.getenv("MEDIA_STORE_MAX_MB", "1024"))
+
+# Finished files are named <sha1 of key and format>.<extension>
+STORE_NAME = re.compile(r"^[0-9a-f]{40}\.\w+$")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MediaStore:
+    """Content-addressed store of downloaded files with LRU eviction under a size quota.
+
+    Every job downloads into its own temporary directory, which is always removed
+    afterwards; the finished file is moved into the store with an atomic rename,
+    so nobody ever sees a half-written file and jobs never overwrite each other.
+    """
+
+    def __init__(self, root: str = MEDIA_STORE_DIR, max_bytes: float = MEDIA_STORE_MAX_MB * 1024 * 1024) -> None:
+        self.root = root
+        self.temp_root = os.path.join(root, "tmp")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # path -> size, least recently used first
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        # sha1 of key and format -> path, whatever extension the file has
+        self._paths: Dict[str, str] = {}
+        self._pinned: Dict[str, int] = {}
+        # The directory is only scanned on first use (or when the bot warms up), not at import
+        self.swept = False
+
+    @property
+    def size(self) -> int:
+        return sum(self._files.values())
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @staticmethod
+    def _digest(key: str, fmt: str) -> str:
+        return hashlib.sha1(f"{key}\0{fmt}".encode()).hexdigest()
+
+    def _add(self, path: str) -> None:
+        self._files[path] = os.path.getsize(path)
+        self._paths[os.path.basename(path).split(".", 1)[0]] = path
+
+    def sweep(self) -> None:
+        """Index the finished files and delete whatever crashed or older versions left behind."""
+        self.swept = True
+        os.makedirs(self.temp_root, exist_ok=True)
+        for name in os.listdir(self.temp_root):
+            # Temporary directories are named <pid>-..., keep those of processes still downloading
+            pid = name.split("-", 1)[0]
+            if pid.isdigit() and _pid_alive(int(pid)):
+                continue
+            shutil.rmtree(os.path.join(self.temp_root, name), ignore_errors=True)
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.path == self.temp_root:
+                continue
+            if not entry.is_file() or not STORE_NAME.match(entry.name):
+                # Partial downloads and files named after the video title by older versions
+                self._delete(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.path, stat.st_size))
+        # The modification time doubles as the last use, so the LRU order survives restarts
+        self._files.clear()
+        self._paths.clear()
+        for _, path, size in sorted(files):
+            self._files[path] = size
+            self._paths[os.path.basename(path).split(".", 1)[0]] = path
+        self.evict()
+
+    async def warm(self) -> None:
+        if not self.swept:
+            self.sweep()
+
+    def get(self, key: str, fmt: str) -> Optional[str]:
+        """Path of the stored file, or None if it has to be downloaded."""
+        if not self.swept:
+            self.sweep()
+        digest = self._digest(key, fmt)
+        path = self._paths.get(digest)
+        if path is None:
+            # Another worker may have stored it in the meantime
+            found = glob.glob(os.path.join(self.root, f"{digest}.*"))
+            if not found:
+                self.misses += 1
+                return None
+            path = found[0]
+            self._add(path)
+        self._touch(path)
+        self.hits += 1
+        return path
+
+    @contextmanager
+    def temp_dir(self):
+        """A private directory for one download, removed again whatever happens."""
+        if not self.swept:
+            self.sweep()
+        path = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=self.temp_root)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def put(self, key: str, fmt: str, filepath: str) -> str:
+        """Move a finished download into the store, keeping its extension, and return its new path."""
+        digest = self._digest(key, fmt)
+        path = os.path.join(self.root, digest + os.path.splitext(filepath)[1])
+        previous = self._paths.get(digest)
+        if previous is not None and previous != path and previous not in self._pinned:
+            self._delete(previous)
+        os.replace(filepath, path)
+        self._add(path)
+        self._touch(path)
+        self.evict(keep=path)
+        return path
+
+    @contextmanager
+    def open(self, path: str):
+        """Open a stored file for uploading; it is not evicted while open."""
+        self._pinned[path] = self._pinned.get(path, 0) + 1
+        try:
+            with open(path, "rb") as media:
+                yield media
+        finally:
+            self._pinned[path] -= 1
+            if not self._pinned[path]:
+                del self._pinned[path]
+            self.evict()
+
+    def _touch(self, path: str) -> None:
+        self._files.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _delete(self, path: str) -> None:
+        self._files.pop(path, None)
+        digest = os.path.basename(path).split(".", 1)[0]
+        if self._paths.get(digest) == path:
+            del self._paths[digest]
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Delete the least recently used files until the store fits in its quota."""
+        removed = 0
+        size = self.size
+        for path in list(self._files):
+            if size <= self.max_bytes:
+                break
+            if path == keep or path in self._pinned:
+                continue
+            size -= self._files[path]
+            self._delete(path)
+            removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,237 @@
+"""Prometheus metrics: handler latencies, errors, external calls, queues, caches and event-loop lag.
+
+Served in the Prometheus text format on METRICS_PORT in polling mode and on
+/metrics of the webhook app.
+"""
+import asyncio
+import bisect
+import functools
+import math
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_PORT = os.getenv("METRICS_PORT")
+# How often the event loop is checked for lag, in seconds
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        """Read the value from ``function`` every time the metrics are scraped."""
+        self._functions[self._key(labels)] = function
+
+    def samples(self) -> List[str]:
+        values = dict(self._values)
+        for key, function in self._functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [count per bucket, sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+REGISTRY: List[Metric] = []
+
+handler_latency = Histogram("nami_handler_seconds", "Time spent in each update handler.", ["handler"])
+handler_errors = Counter("nami_handler_errors_total", "Exceptions raised by update handlers.", ["handler"])
+stage_latency = Histogram("nami_stage_seconds", "Time spent in each stage of a handler.", ["handler", "stage"])
+external_latency = Histogram("nami_external_request_seconds", "External HTTP call latency by host.",
+                             ["host", "status"])
+external_errors = Counter("nami_external_request_errors_total",
+                          "External HTTP calls that failed or returned 4xx/5xx, by host.", ["host"])
+audio_delivery = Counter("nami_audio_delivery_total",
+                         "How downloaded audio was sent: as downloaded (native) or transcoded to MP3.", ["path"])
+download_queue_depth = Gauge("nami_download_queue_depth", "Download jobs waiting for a worker.")
+downloads_active = Gauge("nami_downloads_active", "Download jobs running in the worker pool.")
+send_queue_depth = Gauge("nami_send_queue_depth", "Outgoing requests waiting for the flood limits.")
+send_queue_latency = Histogram("nami_send_queue_seconds", "Time outgoing requests waited for the flood limits.",
+                               ["lane"])
+send_retry_after = Counter("nami_send_retry_after_total", "RetryAfter errors from Telegram, by lane.", ["lane"])
+startup_seconds = Gauge("nami_startup_seconds", "Time spent in each phase of the last startup.", ["phase"])
+cache_hit_ratio = Gauge("nami_cache_hit_ratio", "Hit ratio of each cache since startup.", ["cache"])
+cache_entries = Gauge("nami_cache_entries", "Number of entries in each cache.", ["cache"])
+event_loop_lag = Histogram("nami_event_loop_lag_seconds", "How late the event loop ran a timer.",
+                           buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def stage(handler: str, name: str):
+    """Time one stage of a handler: ``with metrics.stage("search_and_download_music", "upload"):``."""
+    return stage_latency.time(handler=handler, stage=name)
+
+
+def instrument(callback: Callable, name: Optional[str] = None) -> Callable:
+    """Wrap a handler callback to record its latency and errors."""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - start, handler=name)
+
+    return wrapper
+
+
+async def _measure_loop_lag() -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        event_loop_lag.observe(max(0.0, time.perf_counter() - start - LOOP_LAG_INTERVAL))
+
+
+class MetricsServer:
+    """The event-loop lag probe plus, when METRICS_PORT is set, a small /metrics HTTP server."""
+
+    def __init__(self, port: Optional[str] = METRICS_PORT) -> None:
+        self.port = int(port) if port else None
+        self._lag_task: Optional[asyncio.Task] = None
+        self._runner = None
+
+    async def start(self) -> None:
+        if self._lag_task is None:
+            self._lag_task = asyncio.get_running_loop().create_task(_measure_loop_lag())
+        if self.port is None or self._runner is not None:
+            return
+        from aiohttp import web
+
+        async def serve_metrics(request: web.Request) -> web.Response:
+            return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+        app = web.Application()
+        app.router.add_get("/metrics", serve_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "0.0.0.0", self.port).start()
+
+    async def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# The one metrics server shared by the whole bot
+server = MetricsServer()
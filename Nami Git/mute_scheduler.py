@@ -0,0 +1,299 @@
+"""One timer heap for all pending unmutes, persisted so they survive restarts."""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from file_id_cache import CACHE_DB_PATH
+from state_backend import StateBackend
+
+# Unmutes run at the same time when many are due at once, e.g. right after a restart
+MAX_CONCURRENT_UNMUTES = int(os.getenv("MAX_CONCURRENT_UNMUTES", "10"))
+# How often workers sharing a state backend pick up mutes scheduled or cancelled by the others
+MUTE_SYNC_INTERVAL = float(os.getenv("MUTE_SYNC_INTERVAL", "10"))
+# A failed unmute is tried again after this many seconds, doubling each time, up to UNMUTE_ATTEMPTS tries
+UNMUTE_RETRY_DELAY = float(os.getenv("UNMUTE_RETRY_DELAY", "60"))
+UNMUTE_ATTEMPTS = int(os.getenv("UNMUTE_ATTEMPTS", "5"))
+# Seconds the scheduler waits after an error from the store, e.g. while the state backend is unreachable
+MUTE_STORE_RETRY_DELAY = float(os.getenv("MUTE_STORE_RETRY_DELAY", "5"))
+
+
+class Mute(NamedTuple):
+    until: float
+    chat_id: int
+    user_id: int
+    username: Optional[str]
+    message_id: Optional[int]  # the /tmute message, so the unmute notice can reply to it
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        return self.chat_id, self.user_id
+
+
+class SQLiteMutes:
+    """Pending mutes in the local cache database, for a single worker (or several on one host)."""
+
+    sync_interval = None
+
+    def __init__(self, path: str = CACHE_DB_PATH) -> None:
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS mutes ("
+            " chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL, until REAL NOT NULL,"
+            " username TEXT, message_id INTEGER, PRIMARY KEY (chat_id, user_id))"
+        )
+
+    async def load(self) -> List[Mute]:
+        return [Mute(*row) for row in self._db.execute("SELECT until, chat_id, user_id, username, message_id FROM mutes")]
+
+    async def save(self, mute: Mute) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO mutes (chat_id, user_id, until, username, message_id) VALUES (?, ?, ?, ?, ?)",
+            (mute.chat_id, mute.user_id, mute.until, mute.username, mute.message_id),
+        )
+
+    async def delete(self, chat_id: int, user_id: int) -> bool:
+        return bool(self._db.execute(
+            "DELETE FROM mutes WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+        ).rowcount)
+
+    async def claim(self, mute: Mute) -> bool:
+        # With several webhook workers sharing the database, only the one whose delete
+        # claims the row runs the unmute; a missing row was cancelled or rescheduled elsewhere
+        return bool(self._db.execute(
+            "DELETE FROM mutes WHERE chat_id = ? AND user_id = ? AND until = ?",
+            (mute.chat_id, mute.user_id, mute.until),
+        ).rowcount)
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class SharedMutes:
+    """Pending mutes in the shared state backend, a sorted set scored by unmute time, seen by every worker."""
+
+    sync_interval = MUTE_SYNC_INTERVAL
+    KEY = "mutes"
+
+    def __init__(self, backend: StateBackend) -> None:
+        self.backend = backend
+
+    @staticmethod
+    def _member(mute: Mute) -> str:
+        return json.dumps(list(mute))
+
+    async def load(self) -> List[Mute]:
+        return [Mute(*json.loads(member)) for member, _ in await self.backend.zrange_by_score(self.KEY)]
+
+    async def save(self, mute: Mute) -> None:
+        await self.delete(mute.chat_id, mute.user_id)
+        member = self._member(mute)
+        await self.backend.zadd(self.KEY, member, mute.until)
+        # (chat, user) -> member, to find the entry again when it is cancelled
+        await self.backend.set(f"mute:{mute.chat_id}:{mute.user_id}", member)
+
+    async def delete(self, chat_id: int, user_id: int) -> bool:
+        member = await self.backend.get(f"mute:{chat_id}:{user_id}")
+        if member is None:
+            return False
+        removed = await self.backend.zrem(self.KEY, member)
+        await self.backend.delete(f"mute:{chat_id}:{user_id}")
+        return removed
+
+    async def claim(self, mute: Mute) -> bool:
+        # Only one of the workers racing for a due unmute removes it from the set
+        if not await self.backend.zrem(self.KEY, self._member(mute)):
+            return False
+        key = f"mute:{mute.chat_id}:{mute.user_id}"
+        if await self.backend.get(key) == self._member(mute):
+            await self.backend.delete(key)
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class MuteScheduler:
+    """Indexed min-heap of mutes keyed by (chat, user), with one task sleeping until the next one is due.
+
+    Scheduling and cancelling are O(log n); every change is written to the store
+    (SQLiteMutes or SharedMutes) so pending unmutes are restored, and overdue
+    ones run in bulk, on startup.
+    """
+
+    def __init__(self, store) -> None:
+        self.store = store
+        self._heap: List[Mute] = []
+        self._index: Dict[Tuple[int, int], int] = {}  # (chat, user) -> position in the heap
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._failures: Dict[Tuple[int, int], int] = {}  # (chat, user) -> failed unmute attempts
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        return key in self._index
+
+    def get(self, chat_id: int, user_id: int) -> Optional[Mute]:
+        position = self._index.get((chat_id, user_id))
+        return None if position is None else self._heap[position]
+
+    # Heap operations, keeping self._index in sync
+
+    def _swap(self, i: int, j: int) -> None:
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._index[heap[i].key] = i
+        self._index[heap[j].key] = j
+
+    def _sift_up(self, i: int) -> None:
+        while i > 0:
+            parent = (i - 1) // 2
+            if self._heap[parent].until <= self._heap[i].until:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i: int) -> None:
+        size = len(self._heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and self._heap[child].until < self._heap[smallest].until:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+    def _push(self, mute: Mute) -> None:
+        self._remove(mute.key)
+        self._heap.append(mute)
+        self._index[mute.key] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def _remove(self, key: Tuple[int, int]) -> Optional[Mute]:
+        position = self._index.pop(key, None)
+        if position is None:
+            return None
+        mute = self._heap[position]
+        last = self._heap.pop()
+        if position < len(self._heap):
+            self._heap[position] = last
+            self._index[last.key] = position
+            self._sift_up(position)
+            self._sift_down(self._index[last.key])
+        return mute
+
+    # Public API
+
+    async def schedule(self, chat_id: int, user_id: int, until: float, username: Optional[str] = None,
+                       message_id: Optional[int] = None) -> None:
+        """Schedule (or reschedule) the unmute of a user in a chat."""
+        mute = Mute(until, chat_id, user_id, username, message_id)
+        await self.store.save(mute)
+        self._push(mute)
+        if self._heap[0] is mute:
+            self._wakeup.set()
+
+    async def cancel(self, chat_id: int, user_id: int) -> bool:
+        """Drop a pending unmute. Returns False if there was none."""
+        in_heap = self._remove((chat_id, user_id)) is not None
+        self._failures.pop((chat_id, user_id), None)
+        # Always delete it from the store: another worker sharing it may have scheduled the mute,
+        # and it claims the stored row when the unmute is due
+        return await self.store.delete(chat_id, user_id) or in_heap
+
+    async def _load(self) -> None:
+        mutes = await self.store.load()
+        self._heap.clear()
+        self._index.clear()
+        for mute in mutes:
+            self._push(mute)
+
+    async def _pop_due(self, now: float) -> List[Mute]:
+        due = []
+        while self._heap and self._heap[0].until <= now:
+            mute = self._remove(self._heap[0].key)
+            try:
+                claimed = await self.store.claim(mute)
+            except Exception:
+                # Still pending, it is claimed on the next try
+                self._push(mute)
+                raise
+            if claimed:
+                due.append(mute)
+        return due
+
+    async def _retry(self, mute: Mute) -> None:
+        """Schedule a failed unmute again, so the user is not left muted, unless it failed too often."""
+        failures = self._failures.get(mute.key, 0) + 1
+        if failures >= UNMUTE_ATTEMPTS:
+            self._failures.pop(mute.key, None)
+            print(f"Giving up unmuting user {mute.user_id} in chat {mute.chat_id} after {failures} attempts")
+            return
+        self._failures[mute.key] = failures
+        until = time.time() + UNMUTE_RETRY_DELAY * 2 ** (failures - 1)
+        try:
+            await self.schedule(mute.chat_id, mute.user_id, until, mute.username, mute.message_id)
+        except Exception as e:
+            print(f"Error rescheduling the unmute of user {mute.user_id} in chat {mute.chat_id}: {e}")
+
+    async def _run(self, on_due: Callable[[Mute], Awaitable[None]]) -> None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_UNMUTES)
+
+        async def unmute(mute: Mute) -> None:
+            async with semaphore:
+                try:
+                    await on_due(mute)
+                except Exception as e:
+                    print(f"Error unmuting user {mute.user_id} in chat {mute.chat_id}: {e}")
+                    await self._retry(mute)
+                else:
+                    self._failures.pop(mute.key, None)
+
+        loaded = False
+        synced = time.monotonic()
+        while True:
+            try:
+                if not loaded:
+                    await self._load()
+                    loaded = True
+                    synced = time.monotonic()
+                due = await self._pop_due(time.time())
+                if due:
+                    await asyncio.gather(*(unmute(mute) for mute in due))
+                    continue
+                self._wakeup.clear()
+                timeout = self._heap[0].until - time.time() if self._heap else None
+                if self.store.sync_interval is not None:
+                    # Pick up the mutes other workers scheduled or cancelled
+                    if time.monotonic() - synced >= self.store.sync_interval:
+                        await self._load()
+                        synced = time.monotonic()
+                        continue
+                    next_sync = synced + self.store.sync_interval - time.monotonic()
+                    timeout = next_sync if timeout is None else min(timeout, next_sync)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                print(f"Error running scheduled unmutes: {e}")
+                await asyncio.sleep(MUTE_STORE_RETRY_DELAY)
+
+    def start(self, on_due: Callable[[Mute], Awaitable[None]]) -> None:
+        """Start running unmutes as they come due, beginning with any that are overdue."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(on_due))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def close(self) -> None:
+        self.store.close()
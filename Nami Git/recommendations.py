@@ -0,0 +1,153 @@
+"""Warm pool of ready-to-send anime and series recommendations."""
+import asyncio
+import os
+from collections import deque
+from typing import Dict, Optional
+
+from telegram import Bot, Message
+
+from catalog import CatalogStore, catalog
+from file_id_cache import FileIdCache
+
+# Recommendations kept ready per kind (override with environment variables)
+RECOMMENDATION_POOL_SIZE = int(os.getenv("RECOMMENDATION_POOL_SIZE", "5"))
+# Optional private chat the bot can post in, used to pre-upload cover images
+MEDIA_STORAGE_CHAT_ID = os.getenv("MEDIA_STORAGE_CHAT_ID")
+# Format the cover file_ids are stored under in the file_id cache, keyed by cover URL
+COVER_FORMAT = "cover"
+
+
+class Recommendation:
+    """A rendered caption plus its cover, either a Telegram file_id or still a URL."""
+
+    def __init__(self, caption: str, cover_url: Optional[str]) -> None:
+        self.caption = caption
+        self.cover_url = cover_url
+        self.photo = cover_url
+
+    async def send(self, message: Message) -> Message:
+        if self.photo:
+            return await message.reply_photo(photo=self.photo, caption=self.caption, parse_mode="Markdown")
+        return await message.reply_text(self.caption, parse_mode="Markdown")
+
+
+def render_anime(anime: dict) -> Recommendation:
+    description = anime["description"].replace("<br>", "").replace("</br>", "")[:500]  # Clean description
+    return Recommendation(f"**{anime['title']}**\n\n{description}\n\n[More Info]({anime['url']})", anime["image"])
+
+
+def render_series(series: dict) -> Recommendation:
+    summary = series["description"].replace("<p>", "").replace("</p>", "")[:500]  # Clean HTML tags
+    return Recommendation(f"**{series['title']}**\n\n{summary}\n\n[More Info]({series['url']})", series["image"])
+
+
+class RecommendationPool:
+    """Keeps a few rendered recommendations per kind, topped up in the background.
+
+    Covers are uploaded to MEDIA_STORAGE_CHAT_ID ahead of time when it is set.
+    Without it a cover is sent by URL the first time, so Telegram fetches the
+    image then, and its file_id is kept from that send on. The file_ids live in
+    the file_id cache, so they outlast a restart.
+    """
+
+    def __init__(self, catalog: CatalogStore, size: int = RECOMMENDATION_POOL_SIZE,
+                 storage_chat_id: Optional[str] = MEDIA_STORAGE_CHAT_ID) -> None:
+        self.catalog = catalog
+        self.size = size
+        self.storage_chat_id = storage_chat_id
+        self.bot: Optional[Bot] = None
+        self._sources = {
+            "anime": (catalog.random_anime, render_anime),
+            "series": (catalog.random_series, render_series),
+        }
+        self._pools: Dict[str, deque] = {kind: deque() for kind in self._sources}
+        self._wanted: Dict[str, asyncio.Event] = {kind: asyncio.Event() for kind in self._sources}
+        self.covers: Optional[FileIdCache] = None
+        self._tasks: list = []
+
+    def _cover(self, url: Optional[str]) -> Optional[str]:
+        if not url or self.covers is None:
+            return None
+        return self.covers.get(url, COVER_FORMAT)
+
+    def _render(self, kind: str) -> Optional[Recommendation]:
+        pick, render = self._sources[kind]
+        item = pick()
+        if item is None:
+            return None
+        recommendation = render(item)
+        recommendation.photo = self._cover(recommendation.cover_url) or recommendation.cover_url
+        return recommendation
+
+    async def take(self, kind: str) -> Optional[Recommendation]:
+        """Return a ready recommendation, rendering one on the spot if the pool ran dry."""
+        pool = self._pools[kind]
+        self._wanted[kind].set()
+        if not pool:
+            return self._render(kind)
+        recommendation = pool.popleft()
+        # The cover may have been sent, and so uploaded, since this was rendered
+        if recommendation.photo == recommendation.cover_url:
+            recommendation.photo = self._cover(recommendation.cover_url) or recommendation.photo
+        return recommendation
+
+    async def send(self, kind: str, message: Message) -> bool:
+        """Reply to the message with a recommendation. Returns False if there is none."""
+        recommendation = await self.take(kind)
+        if recommendation is None:
+            return False
+        sent = await recommendation.send(message)
+        if sent.photo and recommendation.photo == recommendation.cover_url:
+            self._remember_cover(recommendation.cover_url, sent.photo[-1].file_id)
+        return True
+
+    def _remember_cover(self, url: str, file_id: str) -> None:
+        if self.covers is not None:
+            self.covers.put(url, COVER_FORMAT, file_id)
+
+    async def _upload_cover(self, recommendation: Recommendation) -> None:
+        if recommendation.photo != recommendation.cover_url or not self.storage_chat_id:
+            return
+        message = await self.bot.send_photo(self.storage_chat_id, photo=recommendation.cover_url,
+                                            disable_notification=True)
+        recommendation.photo = message.photo[-1].file_id
+        self._remember_cover(recommendation.cover_url, recommendation.photo)
+        # The file_id stays valid after the message is gone
+        await message.delete()
+
+    async def _top_up_forever(self, kind: str) -> None:
+        pool, wanted = self._pools[kind], self._wanted[kind]
+        await self.catalog.wait_ready(None)
+        while True:
+            try:
+                while len(pool) < self.size:
+                    recommendation = self._render(kind)
+                    if recommendation is None:
+                        break
+                    await self._upload_cover(recommendation)
+                    pool.append(recommendation)
+            except Exception as e:
+                print(f"Error preparing {kind} recommendations: {e}")
+                await asyncio.sleep(30)
+                continue
+            wanted.clear()
+            await wanted.wait()
+
+    def start(self, bot: Bot, covers: FileIdCache) -> None:
+        self.bot = bot
+        self.covers = covers
+        if not self.storage_chat_id:
+            print("MEDIA_STORAGE_CHAT_ID is not set: recommendation covers are not pre-uploaded, "
+                  "each one is fetched from its URL the first time it is sent")
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._top_up_forever(kind)) for kind in self._sources]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+
+# The one recommendation pool shared by the whole bot
+recommendations = RecommendationPool(catalog)
@@ -0,0 +1,87 @@
+"""YouTube search results, cached by normalized query so a search is only run once."""
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from downloads import manager as downloads
+
+# How many results the picker offers, and how long and how many searches are kept (override with environment variables)
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "5"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600)))
+
+
+def normalize_query(query: str) -> str:
+    """Cache key for a query: "Kendrick  Lamar HUMBLE" and "kendrick lamar humble" are the same search."""
+    return " ".join(query.lower().split())
+
+
+class SearchIndex:
+    """Maps normalized queries to the ids of their top results, and ids to the results.
+
+    The results by id let the picker buttons carry just the video id, which
+    is resolved back to its title and URL when a button is pressed.
+    """
+
+    def __init__(self, results: int = SEARCH_RESULTS, size: int = SEARCH_CACHE_SIZE,
+                 ttl: float = SEARCH_CACHE_TTL) -> None:
+        self.results = results
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # normalized query -> (expires, video ids)
+        self._queries: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        # video id -> video info, for every id still referenced by a cached query
+        self._videos: "OrderedDict[str, dict]" = OrderedDict()
+
+    def cached(self, query: str) -> Optional[List[dict]]:
+        key = normalize_query(query)
+        entry = self._queries.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        self._queries.move_to_end(key)
+        return [self._videos[video_id] for video_id in entry[1] if video_id in self._videos]
+
+    def video(self, video_id: str) -> Optional[dict]:
+        """A video from a cached search, or None once it has been evicted."""
+        return self._videos.get(video_id)
+
+    def _store(self, query: str, videos: List[dict]) -> None:
+        key = normalize_query(query)
+        self._queries[key] = (time.time() + self.ttl, [video["id"] for video in videos])
+        self._queries.move_to_end(key)
+        for video in videos:
+            self._videos[video["id"]] = video
+            self._videos.move_to_end(video["id"])
+        while len(self._queries) > self.size:
+            self._queries.popitem(last=False)
+        # Keep about as many videos as the cached queries can point to
+        while len(self._videos) > self.size * self.results:
+            self._videos.popitem(last=False)
+
+    async def search(self, query: str) -> List[dict]:
+        """The top results for a query, from the cache when it was searched recently."""
+        videos = self.cached(query)
+        if videos:
+            self.hits += 1
+            return videos
+        self.misses += 1
+        videos = await downloads.search(query, self.results)
+        if videos:
+            self._store(query, videos)
+        return videos
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._queries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# The one search index shared by the whole bot
+search_index = SearchIndex()
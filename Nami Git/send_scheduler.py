@@ -0,0 +1,218 @@
+"""Outbound send scheduler: Telegram's flood limits, priority lanes and RetryAfter backoff."""
+import asyncio
+import bisect
+import itertools
+import os
+import time
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+# Flood limits (override with environment variables); Telegram allows about 30 messages
+# a second overall, one a second in a private chat and 20 a minute in a group
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+# Messages a quiet chat may send in a row before its rate applies
+SEND_BURST = float(os.getenv("SEND_BURST", "3"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Lanes in priority order; a request waits for every request in a lane before its own
+LANES = ("moderation", "interactive", "media", "progress")
+# Pass as rate_limit_args to put a request in a lane other than its endpoint's default
+MODERATION = {"lane": "moderation"}
+INTERACTIVE = {"lane": "interactive"}
+MEDIA = {"lane": "media"}
+# Download progress edits, which may wait for everything else
+PROGRESS = {"lane": "progress"}
+
+ENDPOINT_LANES = {
+    "restrictChatMember": "moderation",
+    "banChatMember": "moderation",
+    "unbanChatMember": "moderation",
+    "sendVideo": "media",
+    "sendAudio": "media",
+    "sendDocument": "media",
+    "sendPhoto": "media",
+}
+
+
+def counts_against_chat(endpoint: str) -> bool:
+    """Telegram's per-chat limits count new messages; edits, deletes and moderation only count overall."""
+    if endpoint == "sendChatAction":
+        return False
+    return endpoint.startswith("send") or endpoint in ("copyMessage", "forwardMessage")
+
+
+class TokenBucket:
+    """Refills ``rate`` tokens a second up to ``capacity``; a request takes one."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available."""
+        self._refill(now)
+        return max(self.paused_until - now, (1 - self.tokens) / self.rate, 0.0)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+class Waiter:
+    __slots__ = ("priority", "seq", "chat_id", "lane", "future", "queued_at")
+
+    def __init__(self, priority: int, seq: int, chat_id: Any, lane: str, future: asyncio.Future) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.lane = lane
+        self.future = future
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other: "Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler(BaseRateLimiter):
+    """Rate limiter for the bot: every request aimed at a chat waits for a token of the
+    global bucket, in lane order, and is retried after RetryAfter. Requests sending a new
+    message also need a token of that chat's bucket; edits and deletes do not use it up.
+
+    Requests without a chat (getUpdates, answerCallbackQuery, ...) are sent right away.
+    """
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 group_rate: float = SEND_GROUP_RATE, burst: float = SEND_BURST,
+                 max_retries: int = SEND_MAX_RETRIES) -> None:
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._waiting: List[Waiter] = []  # sorted by lane, then arrival
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiting)
+
+    async def initialize(self) -> None:
+        # ExtBot initializes its rate limiter every time the bot is initialized, e.g. again by the Updater
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for waiter in self._waiting:
+            waiter.future.cancel()
+        self._waiting.clear()
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Group and channel ids are negative
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            bucket = self._chats[chat_id] = TokenBucket(self.group_rate if is_group else self.chat_rate, self.burst)
+        return bucket
+
+    async def _acquire(self, chat_id: Optional[Any], lane: str) -> None:
+        # chat_id is None for requests that only take a global token
+        waiter = Waiter(LANES.index(lane), next(self._seq), chat_id, lane,
+                        asyncio.get_running_loop().create_future())
+        bisect.insort(self._waiting, waiter)
+        self._wakeup.set()
+        await waiter.future
+        metrics.send_queue_latency.observe(time.monotonic() - waiter.queued_at, lane=lane)
+
+    def _grant(self, now: float) -> float:
+        """Let the first waiter whose chat has a token go; return how long to sleep if none can."""
+        wait = self._global.delay(now)
+        if wait > 0:
+            return wait
+        wait = float("inf")
+        for index, waiter in enumerate(self._waiting):
+            if waiter.future.done():  # the caller gave up
+                continue
+            if waiter.chat_id is None:
+                self._global.take(now)
+                del self._waiting[index]
+                waiter.future.set_result(None)
+                return 0.0
+            bucket = self._bucket(waiter.chat_id)
+            delay = bucket.delay(now)
+            if delay <= 0:
+                bucket.take(now)
+                self._global.take(now)
+                del self._waiting[index]
+                waiter.future.set_result(None)
+                return 0.0
+            wait = min(wait, delay)
+        self._waiting = [waiter for waiter in self._waiting if not waiter.future.done()]
+        return wait if self._waiting else float("inf")
+
+    async def _dispatch(self) -> None:
+        while True:
+            now = time.monotonic()
+            wait = self._grant(now)
+            if wait <= 0:
+                continue
+            if len(self._chats) > 10000:
+                self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.idle(now)}
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if wait == float("inf") else wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_request(self, callback: Callable[..., Coroutine[Any, Any, Any]], args: Any,
+                              kwargs: Dict[str, Any], endpoint: str, data: Dict[str, Any],
+                              rate_limit_args: Optional[dict]) -> Any:
+        chat_id = data.get("chat_id")
+        if chat_id is None or self._task is None:
+            return await callback(*args, **kwargs)
+        lane = (rate_limit_args or {}).get("lane") or ENDPOINT_LANES.get(endpoint, "interactive")
+        per_chat = counts_against_chat(endpoint)
+        for attempt in itertools.count():
+            await self._acquire(chat_id if per_chat else None, lane)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                metrics.send_retry_after.inc(lane=lane)
+                if attempt >= self.max_retries:
+                    raise
+                print(f"Flood limit hit in chat {chat_id}, retrying {endpoint} in {retry_after}s")
+                # The whole chat waits, queued requests included
+                self._bucket(chat_id).pause(retry_after)
+                if not per_chat:
+                    await asyncio.sleep(retry_after)
@@ -0,0 +1,65 @@
+"""Coalesce identical concurrent calls into one in-flight call."""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, Type, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and fans its result out to everyone waiting.
+
+    ``do`` returns ``(result, shared)``; ``shared`` is True for the callers that
+    waited on somebody else's call instead of running ``fn`` themselves.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]],
+                 retry_on: Tuple[Type[BaseException], ...] = ()) -> Tuple[T, bool]:
+        """Run ``fn`` or wait for the call already running under ``key``.
+
+        A call failing with one of ``retry_on`` (errors that only concern the caller
+        who ran it) is not passed on; the callers waiting on it run it again instead.
+        """
+        while key in self._calls:
+            future = self._calls[key]
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # The caller running the call was cancelled, run it again
+                    continue
+                raise
+            except retry_on:
+                continue
+            self.shared += 1
+            return result, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.calls += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting, don't let asyncio complain about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+
+# The one coalescing layer shared by the whole bot
+flights = SingleFlight()
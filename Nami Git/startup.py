@@ -0,0 +1,71 @@
+"""Cold start: where the startup time goes, and the subsystems warmed up once the bot is polling."""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import metrics
+
+# "background" warms the heavy subsystems right after polling begins, "lazy" leaves each
+# one to its first use (override with environment variables)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+WarmUp = Tuple[str, Callable[[], Awaitable[None]]]
+
+
+class StartupTimer:
+    """Splits the time since this module was imported into named phases.
+
+    Each mark() closes the phase that began at the previous one. The bot imports
+    this module first; for a per-module view of the imports run it with python -X importtime.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: List[Tuple[str, float]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self) -> None:
+        for phase, seconds in self.phases:
+            metrics.startup_seconds.set(seconds, phase=phase)
+        breakdown = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        print(f"Startup took {self._last - self.started:.2f}s: {breakdown}")
+
+    async def _warm_up(self, application, warm_ups: List[WarmUp]) -> None:
+        # Polling (or the webhook) is set up before the application reports running
+        while not application.running:
+            await asyncio.sleep(0.05)
+        self.mark("until polling")
+        if STARTUP_WARMUP == "background":
+            for name, warm_up in warm_ups:
+                try:
+                    await warm_up()
+                except Exception as e:
+                    print(f"Error warming up {name}: {e}")
+                self.mark(f"warm {name}")
+        self.report()
+
+    def start(self, application, warm_ups: List[WarmUp]) -> None:
+        """Run the warm-ups one after the other once the bot is up, then report the breakdown."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._warm_up(application, warm_ups))
+
+    async def wait(self) -> None:
+        """Wait until the warm-ups started by start() are done."""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# The one startup timer shared by the whole bot
+timer = StartupTimer()
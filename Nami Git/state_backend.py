@@ -0,0 +1,528 @@
+"""State shared by all bot workers: conversation state, mutes, caches, leases and the update queues.
+
+STATE_BACKEND_URL picks the backend. Unset (or "memory") keeps everything in
+this process, which is all a single worker needs. redis://[:password@]host:port/db
+shares it through Redis or anything else speaking its protocol, and rediss://
+does the same over TLS (add ?ssl_cert_reqs=none for a self-signed certificate,
+as managed Redis on Heroku uses); for local testing
+``python state_backend.py serve --port 6380`` runs a small stand-in.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import ssl
+import time
+import uuid
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "memory")
+# Seconds a lease is held without being renewed (override with environment variables)
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30"))
+# Names this process in leases and heartbeats
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Compare-and-set on a lease, so only its owner can renew or release it
+RENEW_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+class BackendError(Exception):
+    """The backend answered a command with an error."""
+
+
+class StateBackend:
+    """Strings with expiry, leases, sorted sets and lists; every method is a coroutine.
+
+    ``shared`` tells whether other processes see the same state.
+    """
+
+    shared = False
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def claim(self, key: str, owner: str, ttl: float) -> bool:
+        """Set key to owner for ttl seconds unless somebody else holds it."""
+        raise NotImplementedError
+
+    async def renew(self, key: str, owner: str, ttl: float) -> bool:
+        """Extend a claim, only if owner still holds it."""
+        raise NotImplementedError
+
+    async def release(self, key: str, owner: str) -> bool:
+        """Drop a claim, only if owner still holds it."""
+        raise NotImplementedError
+
+    async def zadd(self, key: str, member: str, score: float) -> None:
+        raise NotImplementedError
+
+    async def zrem(self, key: str, member: str) -> bool:
+        """Remove a member; only one of several workers racing to remove it gets True."""
+        raise NotImplementedError
+
+    async def zrange_by_score(self, key: str, low: float = float("-inf"),
+                              high: float = float("inf")) -> List[Tuple[str, float]]:
+        raise NotImplementedError
+
+    async def zrem_below(self, key: str, score: float) -> int:
+        """Remove every member scored lower than score."""
+        raise NotImplementedError
+
+    async def rpush(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    async def blpop(self, keys: Iterable[str], timeout: float) -> Optional[Tuple[str, str]]:
+        """Pop the first value of the first non-empty list, waiting up to timeout seconds."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Everything in dictionaries of this process."""
+
+    def __init__(self) -> None:
+        # key -> (value, expires or None)
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._zsets: Dict[str, Dict[str, float]] = {}
+        self._lists: Dict[str, deque] = {}
+        self._pushed: Optional[asyncio.Condition] = None
+        self._writes = 0
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._values[key]
+            return None
+        return entry[0]
+
+    def _purge(self) -> None:
+        # Expired keys are dropped when read, and now and then all at once
+        self._writes += 1
+        if self._writes % 1000:
+            return
+        now = time.time()
+        for key in [key for key, (_, expires) in self._values.items() if expires is not None and expires <= now]:
+            del self._values[key]
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._values[key] = (value, time.time() + ttl if ttl is not None else None)
+        self._purge()
+
+    async def delete(self, key: str) -> bool:
+        return self._live(key) is not None and self._values.pop(key, None) is not None
+
+    async def claim(self, key: str, owner: str, ttl: float) -> bool:
+        if self._live(key) is not None:
+            return False
+        await self.set(key, owner, ttl)
+        return True
+
+    async def renew(self, key: str, owner: str, ttl: float) -> bool:
+        if self._live(key) != owner:
+            return False
+        self._values[key] = (owner, time.time() + ttl)
+        return True
+
+    async def release(self, key: str, owner: str) -> bool:
+        if self._live(key) != owner:
+            return False
+        del self._values[key]
+        return True
+
+    async def zadd(self, key: str, member: str, score: float) -> None:
+        self._zsets.setdefault(key, {})[member] = score
+
+    async def zrem(self, key: str, member: str) -> bool:
+        return self._zsets.get(key, {}).pop(member, None) is not None
+
+    async def zrange_by_score(self, key: str, low: float = float("-inf"),
+                              high: float = float("inf")) -> List[Tuple[str, float]]:
+        members = self._zsets.get(key, {})
+        return sorted(((member, score) for member, score in members.items() if low <= score <= high),
+                      key=lambda item: (item[1], item[0]))
+
+    async def zrem_below(self, key: str, score: float) -> int:
+        members = self._zsets.get(key, {})
+        stale = [member for member, member_score in members.items() if member_score < score]
+        for member in stale:
+            del members[member]
+        return len(stale)
+
+    async def rpush(self, key: str, value: str) -> None:
+        self._lists.setdefault(key, deque()).append(value)
+        if self._pushed is not None:
+            async with self._pushed:
+                self._pushed.notify_all()
+
+    def _lpop(self, keys: List[str]) -> Optional[Tuple[str, str]]:
+        for key in keys:
+            values = self._lists.get(key)
+            if values:
+                return key, values.popleft()
+        return None
+
+    async def blpop(self, keys: Iterable[str], timeout: float) -> Optional[Tuple[str, str]]:
+        keys = list(keys)
+        if self._pushed is None:
+            self._pushed = asyncio.Condition()
+        deadline = time.monotonic() + timeout
+        async with self._pushed:
+            while True:
+                popped = self._lpop(keys)
+                remaining = deadline - time.monotonic()
+                if popped is not None or remaining <= 0:
+                    return popped
+                try:
+                    await asyncio.wait_for(self._pushed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return self._lpop(keys)
+
+
+def _encode(*args) -> bytes:
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by the state backend")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        raise BackendError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2].decode()
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    raise BackendError(f"Unexpected reply from the state backend: {line!r}")
+
+
+def _score(value: float) -> str:
+    if value == float("inf"):
+        return "+inf"
+    if value == float("-inf"):
+        return "-inf"
+    return repr(float(value))
+
+
+class RedisBackend(StateBackend):
+    """Talks the Redis protocol over one connection, plus one more for blocking pops."""
+
+    shared = True
+
+    def __init__(self, url: str) -> None:
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ssl: Optional[ssl.SSLContext] = None
+        if parsed.scheme == "rediss":
+            self.ssl = ssl.create_default_context()
+            if parse_qs(parsed.query).get("ssl_cert_reqs", [""])[0].lower() in ("none", "cert_none"):
+                self.ssl.check_hostname = False
+                self.ssl.verify_mode = ssl.CERT_NONE
+        # [reader, writer, lock] for commands and for blocking pops
+        self._connections: Dict[str, list] = {}
+
+    async def _connect(self, connection: list) -> None:
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        if self.password:
+            writer.write(_encode("AUTH", self.password))
+            await _read_reply(reader)
+        if self.db:
+            writer.write(_encode("SELECT", self.db))
+            await _read_reply(reader)
+        connection[0], connection[1] = reader, writer
+
+    async def execute(self, *args, connection: str = "commands"):
+        """Send one command and return its reply, reconnecting once if the connection dropped.
+
+        A command interrupted before its reply was read, e.g. cancelled, leaves that reply
+        on the connection, so the connection is closed rather than handing the reply to the next command.
+        """
+        entry = self._connections.setdefault(connection, [None, None, asyncio.Lock()])
+        async with entry[2]:
+            for attempt in (1, 2):
+                try:
+                    if entry[1] is None:
+                        await self._connect(entry)
+                    entry[1].write(_encode(*args))
+                    await entry[1].drain()
+                    return await _read_reply(entry[0])
+                except BackendError:
+                    raise
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    self._reset(entry)
+                    if attempt == 2:
+                        raise
+                except BaseException:
+                    self._reset(entry)
+                    raise
+
+    @staticmethod
+    def _reset(entry: list) -> None:
+        if entry[1] is not None:
+            entry[1].close()
+        entry[0] = entry[1] = None
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.execute("GET", key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            await self.execute("SET", key, value)
+        else:
+            await self.execute("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    async def delete(self, key: str) -> bool:
+        return bool(await self.execute("DEL", key))
+
+    async def claim(self, key: str, owner: str, ttl: float) -> bool:
+        return await self.execute("SET", key, owner, "NX", "PX", max(1, int(ttl * 1000))) == "OK"
+
+    async def renew(self, key: str, owner: str, ttl: float) -> bool:
+        return bool(await self.execute("EVAL", RENEW_SCRIPT, 1, key, owner, max(1, int(ttl * 1000))))
+
+    async def release(self, key: str, owner: str) -> bool:
+        return bool(await self.execute("EVAL", RELEASE_SCRIPT, 1, key, owner))
+
+    async def zadd(self, key: str, member: str, score: float) -> None:
+        await self.execute("ZADD", key, _score(score), member)
+
+    async def zrem(self, key: str, member: str) -> bool:
+        return bool(await self.execute("ZREM", key, member))
+
+    async def zrange_by_score(self, key: str, low: float = float("-inf"),
+                              high: float = float("inf")) -> List[Tuple[str, float]]:
+        reply = await self.execute("ZRANGEBYSCORE", key, _score(low), _score(high), "WITHSCORES")
+        return [(reply[i], float(reply[i + 1])) for i in range(0, len(reply), 2)]
+
+    async def zrem_below(self, key: str, score: float) -> int:
+        return await self.execute("ZREMRANGEBYSCORE", key, "-inf", f"({_score(score)}")
+
+    async def rpush(self, key: str, value: str) -> None:
+        await self.execute("RPUSH", key, value)
+
+    async def blpop(self, keys: Iterable[str], timeout: float) -> Optional[Tuple[str, str]]:
+        # Blocking pops get their own connection, so they never hold up other commands
+        reply = await self.execute("BLPOP", *keys, max(1, round(timeout)), connection="blocking")
+        return None if reply is None else (reply[0], reply[1])
+
+    async def close(self) -> None:
+        for connection in self._connections.values():
+            if connection[1] is not None:
+                connection[1].close()
+        self._connections.clear()
+
+
+def backend_from_url(url: str = STATE_BACKEND_URL) -> StateBackend:
+    if url in ("", "memory"):
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown STATE_BACKEND_URL: {url}")
+
+
+class Lease:
+    """A key held by one worker at a time, renewed in the background until released.
+
+    ``held`` turns False if a renewal fails, e.g. after the worker stalled for longer than the TTL.
+    """
+
+    def __init__(self, backend: StateBackend, key: str, ttl: float = LEASE_TTL) -> None:
+        self.backend = backend
+        self.key = key
+        self.ttl = ttl
+        # Unique per lease, so two leases of this process on the same key never mix up
+        self.owner = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+        self._renewal: Optional[asyncio.Task] = None
+        self._renewing: Optional[asyncio.Future] = None
+
+    async def acquire(self, wait: bool = True, poll: float = 0.5) -> bool:
+        """Claim the key, waiting for the current holder to let go unless wait is False.
+
+        While waiting, backend errors are logged and the claim retried, so an outage only delays the lease.
+        """
+        while True:
+            try:
+                if await self.backend.claim(self.key, self.owner, self.ttl):
+                    break
+            except Exception as e:
+                if not wait:
+                    raise
+                print(f"Error claiming lease {self.key}: {e}")
+            if not wait:
+                return False
+            await asyncio.sleep(poll)
+        self.held = True
+        self._renewal = asyncio.get_running_loop().create_task(self._renew())
+        return True
+
+    async def _renew(self) -> None:
+        while self.held:
+            await asyncio.sleep(self.ttl / 3)
+            # Shielded, so release() cancelling the renewal never cuts the command short
+            self._renewing = asyncio.ensure_future(self.backend.renew(self.key, self.owner, self.ttl))
+            try:
+                self.held = await asyncio.shield(self._renewing)
+            except Exception as e:
+                print(f"Error renewing lease {self.key}: {e}")
+            finally:
+                self._renewing = None
+
+    async def release(self) -> None:
+        renewing = self._renewing
+        if self._renewal is not None:
+            self._renewal.cancel()
+            self._renewal = None
+        if renewing is not None:
+            # A renewal already sent runs to its reply before the release is sent
+            await asyncio.gather(renewing, return_exceptions=True)
+        if self.held:
+            self.held = False
+            try:
+                await self.backend.release(self.key, self.owner)
+            except Exception as e:
+                # The key expires after its TTL anyway
+                print(f"Error releasing lease {self.key}: {e}")
+
+    async def __aenter__(self) -> "Lease":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.release()
+
+
+# The state shared by the whole bot (and, with Redis, by all its workers)
+state = backend_from_url()
+
+
+class StandInServer:
+    """A Redis-protocol server backed by MemoryBackend, covering the commands RedisBackend sends."""
+
+    def __init__(self) -> None:
+        self.memory = MemoryBackend()
+
+    async def command(self, name: str, args: List[str]):
+        memory = self.memory
+        if name == "PING":
+            return "PONG"
+        if name in ("AUTH", "SELECT"):
+            return "OK"
+        if name == "GET":
+            return await memory.get(args[0])
+        if name == "SET":
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            ttl = None
+            if "PX" in options:
+                ttl = int(args[2 + options.index("PX") + 1]) / 1000
+            elif "EX" in options:
+                ttl = int(args[2 + options.index("EX") + 1])
+            if "NX" in options:
+                return "OK" if await memory.claim(key, value, ttl) else None
+            await memory.set(key, value, ttl)
+            return "OK"
+        if name == "DEL":
+            return sum([await memory.delete(key) for key in args])
+        if name == "EVAL":
+            script, key, owner = args[0], args[2], args[3]
+            if script == RENEW_SCRIPT:
+                return int(await memory.renew(key, owner, int(args[4]) / 1000))
+            if script == RELEASE_SCRIPT:
+                return int(await memory.release(key, owner))
+            raise BackendError("ERR the stand-in only runs the scripts of state_backend.py")
+        if name == "ZADD":
+            await memory.zadd(args[0], args[2], float(args[1]))
+            return 1
+        if name == "ZREM":
+            return int(await memory.zrem(args[0], args[1]))
+        if name == "ZRANGEBYSCORE":
+            members = await memory.zrange_by_score(args[0], float(args[1]), float(args[2]))
+            return [str(item) for member, score in members for item in (member, _score(score))]
+        if name == "ZREMRANGEBYSCORE":
+            return await memory.zrem_below(args[0], float(args[2].lstrip("(")))
+        if name == "RPUSH":
+            for value in args[1:]:
+                await memory.rpush(args[0], value)
+            return len(memory._lists[args[0]])
+        if name == "BLPOP":
+            popped = await memory.blpop(args[:-1], float(args[-1]) or 365 * 24 * 3600)
+            return None if popped is None else list(popped)
+        raise BackendError(f"ERR unknown command '{name}'")
+
+    @staticmethod
+    def _reply(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(StandInServer._reply(item) for item in value)
+        if value in ("OK", "PONG"):
+            return f"+{value}\r\n".encode()
+        data = value.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await _read_reply(reader)
+                except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+                    return
+                try:
+                    reply = self._reply(await self.command(request[0].upper(), request[1:]))
+                except Exception as e:
+                    reply = f"-{e}\r\n".encode() if str(e).startswith("ERR") else f"-ERR {e}\r\n".encode()
+                writer.write(reply)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in Redis server for testing several bot workers locally.")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+    print(f"State backend stand-in listening on redis://{args.host}:{args.port}")
+    asyncio.run(StandInServer().serve(args.host, args.port))
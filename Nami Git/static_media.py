@@ -0,0 +1,97 @@
+"""Upload static media files (like the /start video) once and resend them by file_id."""
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from file_id_cache import CACHE_DB_PATH
+from singleflight import flights
+
+
+def message_file_id(message: Message) -> Optional[str]:
+    """Return the file_id of whatever media the message carries."""
+    if message.photo:
+        return message.photo[-1].file_id
+    for media in (message.video, message.animation, message.audio, message.voice,
+                  message.document, message.sticker, message.video_note):
+        if media is not None:
+            return media.file_id
+    return None
+
+
+class StaticMediaCache:
+    """Remembers the file_id of each static asset together with the hash of its content.
+
+    The file_id is reused across restarts and the asset is only uploaded again
+    when its content changes.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH) -> None:
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS static_media ("
+            " path TEXT PRIMARY KEY, sha256 TEXT NOT NULL, file_id TEXT NOT NULL, uploaded REAL NOT NULL)"
+        )
+        # path -> (mtime, size, sha256), so unchanged files are only hashed once per process
+        self._digests: Dict[str, Tuple[float, int, str]] = {}
+
+    def digest(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as asset:
+            for chunk in iter(lambda: asset.read(1 << 16), b""):
+                sha256.update(chunk)
+        self._digests[path] = (stat.st_mtime, stat.st_size, sha256.hexdigest())
+        return sha256.hexdigest()
+
+    def file_id(self, path: str) -> Optional[str]:
+        """The stored file_id, or None if the asset was never uploaded or has changed since."""
+        row = self._db.execute("SELECT sha256, file_id FROM static_media WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != self.digest(path):
+            return None
+        return row[1]
+
+    def remember(self, path: str, file_id: str) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO static_media (path, sha256, file_id, uploaded) VALUES (?, ?, ?, ?)",
+            (path, self.digest(path), file_id, time.time()),
+        )
+
+    def forget(self, path: str) -> None:
+        self._db.execute("DELETE FROM static_media WHERE path = ?", (path,))
+
+    async def send(self, path: str, send: Callable[[Any], Awaitable[Message]]) -> Message:
+        """Call ``send`` with the cached file_id, or with the opened file if it has to be uploaded."""
+        file_id = self.file_id(path)
+        if file_id is not None:
+            try:
+                return await send(file_id)
+            except BadRequest:
+                # Telegram no longer knows the file, upload it again
+                self.forget(path)
+
+        async def upload() -> Message:
+            with open(path, "rb") as asset:
+                message = await send(asset)
+            file_id = message_file_id(message)
+            if file_id is not None:
+                self.remember(path, file_id)
+            return message
+
+        # Chats asking at the same time wait for one upload and then get its file_id
+        message, shared = await flights.do(("static", path), upload)
+        if shared and self.file_id(path) is not None:
+            return await send(self.file_id(path))
+        if shared:
+            return await upload()
+        return message
+
+    def close(self) -> None:
+        self._db.close()
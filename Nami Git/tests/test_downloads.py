@@ -0,0 +1,45 @@
+import pytest
+
+from downloads import TooLarge, choose_format
+
+MB = 2 ** 20
+
+
+def video(format_id, height, size=None, **fields):
+    return dict(format_id=format_id, height=height, vcodec="avc1", acodec="mp4a", filesize=size, **fields)
+
+
+def test_best_format_under_the_limit():
+    info = {"duration": 60, "formats": [
+        video("small", 360, 10 * MB),
+        video("medium", 720, 40 * MB),
+        video("large", 1080, 90 * MB),
+    ]}
+    assert choose_format(info, 50 * MB)["format"] == "medium"
+    assert choose_format(info, 100 * MB)["format"] == "large"
+
+
+def test_size_estimated_from_bitrate():
+    # 8000 kbit/s for 60 s is 60 MB, 1000 kbit/s 7.5 MB
+    info = {"duration": 60, "formats": [video("high", 1080, tbr=8000), video("low", 480, tbr=1000)]}
+    chosen = choose_format(info, 50 * MB)
+    assert chosen["format"] == "low" and chosen["size"] == 7.5e6
+
+
+def test_unknown_sizes_and_too_large():
+    assert choose_format({"duration": None, "formats": [video("a", 720)]}) is None
+    with pytest.raises(TooLarge, match="about 90 MB"):
+        choose_format({"duration": 60, "formats": [video("large", 1080, 90 * MB)]}, 50 * MB)
+
+
+def test_merge_pairs_video_only_with_the_best_audio():
+    info = {"duration": 60, "formats": [
+        video("muxed", 360, 10 * MB),
+        dict(format_id="v720", height=720, vcodec="avc1", acodec="none", filesize=30 * MB),
+        dict(format_id="opus", vcodec="none", acodec="opus", abr=160, filesize=3 * MB, ext="webm"),
+        dict(format_id="m4a", vcodec="none", acodec="mp4a", abr=128, filesize=2 * MB, ext="m4a"),
+    ]}
+    assert choose_format(info, 50 * MB)["format"] == "muxed"
+    chosen = choose_format(info, 50 * MB, merge=True)
+    # M4A is preferred over a higher bitrate audio, as it merges into MP4 without re-encoding
+    assert chosen["format"] == "v720+m4a" and chosen["size"] == 32 * MB
@@ -0,0 +1,59 @@
+import os
+
+from media_store import MediaStore
+
+
+def download(store, name: str, size: int) -> str:
+    with store.temp_dir() as temp:
+        path = os.path.join(temp, name)
+        with open(path, "wb") as media:
+            media.write(b"x" * size)
+        return store.put(name.split(".")[0], "mp4", path)
+
+
+def test_put_and_get(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=1000)
+    assert store.get("a", "mp4") is None
+    path = download(store, "a.mp4", 100)
+    assert store.get("a", "mp4") == path and path.endswith(".mp4")
+    assert store.get("a", "mp3") is None
+    # Temporary download directories are gone
+    assert os.listdir(store.temp_root) == []
+    assert store.stats()["hits"] == 1 and store.stats()["misses"] == 2
+
+
+def test_least_recently_used_evicted_over_quota(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=250)
+    a = download(store, "a.mp4", 100)
+    download(store, "b.mp4", 100)
+    # a was used last, so b goes when c does not fit
+    assert store.get("a", "mp4") == a
+    download(store, "c.mp4", 100)
+    assert store.get("b", "mp4") is None
+    assert store.get("a", "mp4") and store.get("c", "mp4")
+    assert store.size == 200
+
+
+def test_open_files_are_not_evicted(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=150)
+    a = download(store, "a.mp4", 100)
+    with store.open(a):
+        download(store, "b.mp4", 100)
+        # Over quota while a is being uploaded
+        assert os.path.exists(a) and store.size == 200
+    # Once closed, the least recently used file makes room
+    assert not os.path.exists(a) and store.size == 100
+
+
+def test_sweep_keeps_finished_files_only(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=1000)
+    kept = download(store, "a.mp4", 100)
+    (tmp_path / "Some Video Title.mp4").write_bytes(b"old")
+    (tmp_path / "a.mp4.part").write_bytes(b"partial")
+    os.makedirs(os.path.join(store.temp_root, "999999999-crashed"))
+    # Another process picks up what is on disk
+    restarted = MediaStore(str(tmp_path), max_bytes=1000)
+    restarted.sweep()
+    assert sorted(os.listdir(tmp_path)) == sorted(["tmp", os.path.basename(kept)])
+    assert os.listdir(restarted.temp_root) == []
+    assert restarted.get("a", "mp4") == kept
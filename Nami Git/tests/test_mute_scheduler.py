@@ -0,0 +1,153 @@
+import asyncio
+import random
+import time
+
+import mute_scheduler
+from mute_scheduler import MuteScheduler, SharedMutes, SQLiteMutes
+from state_backend import MemoryBackend
+
+
+class FlakyBackend:
+    """A MemoryBackend whose every call fails while ``down`` is set."""
+
+    def __init__(self):
+        self.memory = MemoryBackend()
+        self.down = False
+
+    def __getattr__(self, name):
+        method = getattr(self.memory, name)
+
+        async def call(*args, **kwargs):
+            if self.down:
+                raise ConnectionError("state backend unreachable")
+            return await method(*args, **kwargs)
+
+        return call
+
+
+def test_heap_keeps_the_earliest_unmute_first():
+    async def scenario():
+        scheduler = MuteScheduler(SharedMutes(MemoryBackend()))
+        rng = random.Random(3)
+        expected = {}
+        for i in range(200):
+            key = (-rng.randrange(5), rng.randrange(20))
+            if key in expected and rng.random() < 0.3:
+                assert await scheduler.cancel(*key)
+                del expected[key]
+            else:
+                until = 1000 + rng.random() * 1000
+                await scheduler.schedule(*key, until)
+                expected[key] = until
+            assert all(scheduler._heap[position].key == key for key, position in scheduler._index.items())
+        order = []
+        for mute in await scheduler._pop_due(float("inf")):
+            order.append((mute.until, mute.key))
+        return order, expected, len(scheduler)
+
+    order, expected, left = asyncio.run(scenario())
+    assert order == sorted((until, key) for key, until in expected.items())
+    assert left == 0
+
+
+def test_sqlite_claim_and_restore(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+
+    async def scenario():
+        scheduler = MuteScheduler(SQLiteMutes(path))
+        await scheduler.schedule(-1, 1, time.time() - 5, username="@late")
+        await scheduler.schedule(-1, 2, time.time() + 3600)
+        await scheduler.schedule(-1, 3, time.time() + 3600)
+        assert await scheduler.cancel(-1, 3)
+        assert not await scheduler.cancel(-1, 3)
+        scheduler.close()
+
+        # After a restart the overdue unmute runs right away and the other one stays pending
+        restarted = MuteScheduler(SQLiteMutes(path))
+        unmuted = []
+
+        async def on_due(mute):
+            unmuted.append(mute.username)
+
+        restarted.start(on_due)
+        await asyncio.sleep(0.1)
+        await restarted.stop()
+        pending = [mute.user_id for mute in await restarted.store.load()]
+        # A rescheduled mute cannot be claimed with its old time
+        stale = restarted.get(-1, 2)
+        await restarted.schedule(-1, 2, time.time() + 7200)
+        claimed = await restarted.store.claim(stale)
+        restarted.close()
+        return unmuted, pending, claimed
+
+    assert asyncio.run(scenario()) == (["@late"], [2], False)
+
+
+def test_shared_unmute_runs_on_one_worker():
+    async def scenario():
+        backend = MemoryBackend()
+        workers = [MuteScheduler(SharedMutes(backend)) for _ in range(3)]
+        await workers[0].schedule(-1, 1, time.time() + 0.05)
+        unmuted = []
+
+        async def on_due(mute):
+            unmuted.append(mute.key)
+
+        for worker in workers:
+            worker.start(on_due)
+        await asyncio.sleep(0.2)
+        for worker in workers:
+            await worker.stop()
+        return unmuted, await backend.zrange_by_score(SharedMutes.KEY)
+
+    assert asyncio.run(scenario()) == ([(-1, 1)], [])
+
+
+def test_scheduler_survives_store_errors(monkeypatch):
+    monkeypatch.setattr(mute_scheduler, "MUTE_STORE_RETRY_DELAY", 0.05)
+
+    async def scenario():
+        backend = FlakyBackend()
+        scheduler = MuteScheduler(SharedMutes(backend))
+        unmuted = []
+
+        async def on_due(mute):
+            unmuted.append(mute.user_id)
+
+        await scheduler.schedule(-1, 1, time.time() + 0.1)
+        # Unreachable while the scheduler loads and when the unmute comes due
+        backend.down = True
+        scheduler.start(on_due)
+        await asyncio.sleep(0.3)
+        assert unmuted == [] and len(scheduler) == 1
+        backend.down = False
+        await asyncio.sleep(0.2)
+        await scheduler.stop()
+        return unmuted, len(scheduler)
+
+    assert asyncio.run(scenario()) == ([1], 0)
+
+
+def test_failed_unmute_is_retried(monkeypatch):
+    monkeypatch.setattr(mute_scheduler, "UNMUTE_RETRY_DELAY", 0.05)
+    monkeypatch.setattr(mute_scheduler, "UNMUTE_ATTEMPTS", 3)
+
+    async def scenario():
+        scheduler = MuteScheduler(SharedMutes(MemoryBackend()))
+        attempts = {1: 0, 2: 0}
+
+        async def on_due(mute):
+            attempts[mute.user_id] += 1
+            # The first user's unmute fails once, the second's every time
+            if mute.user_id == 2 or attempts[1] == 1:
+                raise RuntimeError("Telegram said no")
+
+        await scheduler.schedule(-1, 1, time.time(), username="@one", message_id=5)
+        await scheduler.schedule(-1, 2, time.time())
+        scheduler.start(on_due)
+        await asyncio.sleep(0.5)
+        await scheduler.stop()
+        return attempts, len(scheduler)
+
+    # Retried until it worked, or given up on after UNMUTE_ATTEMPTS tries
+    assert asyncio.run(scenario()) == ({1: 2, 2: 3}, 0)
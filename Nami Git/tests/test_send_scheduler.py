@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import RetryAfter  # noqa: E402
+
+from send_scheduler import MODERATION, PROGRESS, SendScheduler, TokenBucket, counts_against_chat  # noqa: E402
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take(now)
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == pytest.approx(0)
+    # Never refills above its capacity
+    assert bucket.delay(now + 100) == 0
+    assert bucket.tokens == 3
+    assert bucket.idle(now + 100)
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=10, capacity=1)
+    bucket.pause(5)
+    now = time.monotonic()
+    assert bucket.delay(now) == pytest.approx(5, abs=0.1)
+    assert not bucket.idle(now)
+
+
+def test_counts_against_chat():
+    assert counts_against_chat("sendMessage")
+    assert counts_against_chat("sendVideo")
+    assert counts_against_chat("copyMessage")
+    assert not counts_against_chat("sendChatAction")
+    assert not counts_against_chat("editMessageText")
+    assert not counts_against_chat("deleteMessage")
+    assert not counts_against_chat("restrictChatMember")
+
+
+async def send_all(scheduler, requests):
+    """Run (name, endpoint, chat_id, rate_limit_args) requests, return the names in the order they were sent."""
+    sent = []
+
+    async def request(name, endpoint, chat_id, rate_limit_args):
+        async def callback():
+            sent.append(name)
+
+        await scheduler.process_request(callback, (), {}, endpoint, {"chat_id": chat_id}, rate_limit_args)
+
+    await scheduler.initialize()
+    try:
+        await asyncio.wait_for(asyncio.gather(*(request(*args) for args in requests)), 5)
+    finally:
+        await scheduler.shutdown()
+    return sent
+
+
+def test_lanes_in_priority_order():
+    # All requests are queued before the dispatcher runs, so they go out in lane order, then in arrival order
+    scheduler = SendScheduler(global_rate=20, chat_rate=1000, burst=1000)
+    sent = asyncio.run(send_all(scheduler, [
+        ("first", "sendMessage", 1, None),
+        ("progress", "editMessageText", 1, PROGRESS),
+        ("video", "sendVideo", 2, None),
+        ("text", "sendMessage", 3, None),
+        ("mute", "sendMessage", 4, MODERATION),
+    ]))
+    assert sent == ["mute", "first", "text", "video", "progress"]
+
+
+def test_edits_do_not_use_the_chat_budget():
+    scheduler = SendScheduler(global_rate=1000, group_rate=1 / 3, burst=1)
+    start = time.monotonic()
+    sent = asyncio.run(send_all(scheduler, [
+        ("send", "sendMessage", -100, None),
+        *((f"edit{i}", "editMessageText", -100, PROGRESS) for i in range(5)),
+    ]))
+    assert sorted(sent) == ["edit0", "edit1", "edit2", "edit3", "edit4", "send"]
+    assert time.monotonic() - start < 1
+
+
+def test_retry_after_pauses_the_chat():
+    async def scenario():
+        scheduler = SendScheduler(global_rate=1000, chat_rate=1000, burst=1000)
+        await scheduler.initialize()
+        attempts = []
+
+        async def callback():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(1)
+            return "sent"
+
+        try:
+            result = await scheduler.process_request(callback, (), {}, "sendMessage", {"chat_id": 5}, None)
+        finally:
+            await scheduler.shutdown()
+        return result, attempts
+
+    result, attempts = asyncio.run(scenario())
+    assert result == "sent"
+    assert attempts[1] - attempts[0] >= 0.9
+
+
+def test_requests_without_a_chat_skip_the_queue():
+    async def scenario():
+        scheduler = SendScheduler()
+
+        async def callback():
+            return "answered"
+
+        # Not even initialized: nothing waits
+        return await scheduler.process_request(callback, (), {}, "answerCallbackQuery", {}, None)
+
+    assert asyncio.run(scenario()) == "answered"
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class Refused(Exception):
+    """An error that only concerns the caller who ran the call."""
+
+
+def test_identical_calls_share_one():
+    async def scenario():
+        flights = SingleFlight()
+        runs = []
+
+        async def fetch():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            return "value"
+
+        results = await asyncio.gather(*(flights.do("key", fetch) for _ in range(3)))
+        return results, len(runs), flights.calls, flights.shared, flights.in_flight("key")
+
+    results, runs, calls, shared, in_flight = asyncio.run(scenario())
+    assert sorted(results) == [("value", False), ("value", True), ("value", True)]
+    assert (runs, calls, shared, in_flight) == (1, 1, 2, False)
+
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.05)
+            raise ValueError("upstream down")
+
+        return await asyncio.gather(flights.do("key", fail), flights.do("key", fail), return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(scenario())] == ["upstream down"] * 2
+
+
+def test_retry_on_errors_are_not_shared():
+    async def scenario():
+        flights = SingleFlight()
+        runs = []
+
+        async def fetch():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            if len(runs) == 1:
+                raise Refused("the first caller's queue is full")
+            return "value"
+
+        first = asyncio.ensure_future(flights.do("key", fetch, retry_on=(Refused,)))
+        await asyncio.sleep(0.01)
+        second = await flights.do("key", fetch, retry_on=(Refused,))
+        with pytest.raises(Refused):
+            await first
+        return second, len(runs)
+
+    # The waiter ran the call again itself instead of getting the first caller's error
+    assert asyncio.run(scenario()) == (("value", False), 2)
+
+
+def test_waiters_run_the_call_when_its_caller_is_cancelled():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "value"
+
+        first = asyncio.ensure_future(flights.do("key", fetch))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(flights.do("key", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == ("value", False)
@@ -0,0 +1,230 @@
+import asyncio
+import ssl
+
+import pytest
+
+from state_backend import (
+    BackendError, Lease, MemoryBackend, RedisBackend, StandInServer, _encode, _read_reply, backend_from_url,
+)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def parse(data: bytes):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return await _read_reply(reader)
+
+
+def test_encode():
+    assert _encode("SET", "key", 1.5) == b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$3\r\n1.5\r\n"
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"+OK\r\n", "OK"),
+    (b":42\r\n", 42),
+    (b"$5\r\nhello\r\n", "hello"),
+    (b"$0\r\n\r\n", ""),
+    (b"$-1\r\n", None),
+    (b"*-1\r\n", None),
+    (b"*2\r\n$1\r\na\r\n:1\r\n", ["a", 1]),
+    (b"*2\r\n*1\r\n+x\r\n$-1\r\n", [["x"], None]),
+    # Bulk strings may contain the line separator
+    (b"$4\r\na\r\nb\r\n", "a\r\nb"),
+])
+def test_read_reply(data, expected):
+    assert run(parse(data)) == expected
+
+
+def test_read_reply_errors():
+    with pytest.raises(BackendError, match="ERR wrong"):
+        run(parse(b"-ERR wrong\r\n"))
+    with pytest.raises(ConnectionError):
+        run(parse(b""))
+    with pytest.raises(BackendError):
+        run(parse(b"?what\r\n"))
+
+
+def test_stand_in_reply_round_trips():
+    for value in (None, 7, "OK", "text", ["a", None, 3, ["b"]]):
+        assert run(parse(StandInServer._reply(value))) == value
+
+
+def test_backend_from_url():
+    assert isinstance(backend_from_url("memory"), MemoryBackend)
+    assert isinstance(backend_from_url("redis://:secret@example:6390/2"), RedisBackend)
+    with pytest.raises(ValueError):
+        backend_from_url("postgres://example")
+
+
+def test_rediss_uses_tls():
+    assert RedisBackend("redis://example").ssl is None
+    verified = RedisBackend("rediss://:secret@example:6390")
+    assert verified.ssl.verify_mode == ssl.CERT_REQUIRED and verified.ssl.check_hostname
+    self_signed = RedisBackend("rediss://:secret@example:6390?ssl_cert_reqs=none")
+    assert self_signed.ssl.verify_mode == ssl.CERT_NONE
+
+
+async def exercise(backend):
+    """The same checks for every backend."""
+    assert await backend.get("missing") is None
+    await backend.set("key", "value")
+    assert await backend.get("key") == "value"
+    assert await backend.delete("key")
+    assert not await backend.delete("key")
+
+    await backend.set("short", "lived", ttl=0.05)
+    await asyncio.sleep(0.1)
+    assert await backend.get("short") is None
+
+    assert await backend.claim("lock", "a", 10)
+    assert not await backend.claim("lock", "b", 10)
+    assert not await backend.renew("lock", "b", 10)
+    assert not await backend.release("lock", "b")
+    assert await backend.renew("lock", "a", 10)
+    assert await backend.release("lock", "a")
+    assert await backend.claim("lock", "b", 10)
+
+    await backend.zadd("zset", "late", 3)
+    await backend.zadd("zset", "early", 1)
+    await backend.zadd("zset", "middle", 2)
+    assert await backend.zrange_by_score("zset", high=2) == [("early", 1.0), ("middle", 2.0)]
+    assert await backend.zrem_below("zset", 2) == 1
+    assert await backend.zrem("zset", "middle")
+    assert not await backend.zrem("zset", "middle")
+    assert await backend.zrange_by_score("zset") == [("late", 3.0)]
+
+    await backend.rpush("list", "1")
+    await backend.rpush("list", "2")
+    assert await backend.blpop(["empty", "list"], 1) == ("list", "1")
+    assert await backend.blpop(["list"], 1) == ("list", "2")
+    assert await backend.blpop(["list"], 1) is None
+
+
+def test_memory_backend():
+    run(exercise(MemoryBackend()))
+
+
+def test_memory_blpop_wakes_up_on_push():
+    async def scenario():
+        backend = MemoryBackend()
+        pop = asyncio.ensure_future(backend.blpop(["list"], 5))
+        await asyncio.sleep(0.05)
+        await backend.rpush("list", "x")
+        return await asyncio.wait_for(pop, 1)
+
+    assert run(scenario()) == ("list", "x")
+
+
+async def with_stand_in(check):
+    stand_in = StandInServer()
+    server = await asyncio.start_server(stand_in.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    backend = RedisBackend(f"redis://127.0.0.1:{port}/1")
+    try:
+        await check(backend)
+    finally:
+        await backend.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_redis_backend_against_stand_in():
+    run(with_stand_in(exercise))
+
+
+def test_stand_in_errors_and_reconnect():
+    async def check(backend):
+        with pytest.raises(BackendError, match="unknown command"):
+            await backend.execute("FLUSHALL")
+        # A dropped connection is reopened once
+        backend._connections["commands"][1].close()
+        await asyncio.sleep(0.05)
+        assert await backend.execute("PING") == "PONG"
+
+    run(with_stand_in(check))
+
+
+def test_lease():
+    async def scenario():
+        backend = MemoryBackend()
+        first = Lease(backend, "job", ttl=0.3)
+        second = Lease(backend, "job", ttl=0.3)
+        assert await first.acquire(wait=False)
+        assert not await second.acquire(wait=False)
+        # Renewed in the background, so it outlives its TTL
+        await asyncio.sleep(0.5)
+        assert first.held and not await second.acquire(wait=False)
+        waiting = asyncio.ensure_future(second.acquire(poll=0.01))
+        await first.release()
+        assert await asyncio.wait_for(waiting, 1)
+        assert not first.held and second.held
+        await second.release()
+        async with Lease(backend, "job") as lease:
+            assert lease.held
+        assert await backend.get("job") is None
+
+    run(scenario())
+
+
+def test_lease_lost_when_not_renewed():
+    async def scenario():
+        backend = MemoryBackend()
+        lease = Lease(backend, "job", ttl=0.2)
+        await lease.acquire()
+        # Somebody else took over after the lease expired
+        await backend.release("job", lease.owner)
+        await backend.claim("job", "other", 10)
+        await asyncio.sleep(0.15)
+        assert not lease.held
+        await lease.release()
+        assert await backend.get("job") == "other"
+
+    run(scenario())
+
+
+def test_cancelled_command_does_not_shift_replies():
+    async def check(backend):
+        await backend.set("a", "A")
+        # Cancelled while the stand-in still holds its reply back
+        pop = asyncio.ensure_future(backend.execute("BLPOP", "empty", 1))
+        await asyncio.sleep(0.05)
+        pop.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await pop
+        assert await backend.get("a") == "A"
+
+    run(with_stand_in(check))
+
+
+def test_release_waits_for_a_renewal_in_flight():
+    async def scenario():
+        backend = MemoryBackend()
+        renewing = asyncio.Event()
+        finish = asyncio.Event()
+        renew = backend.renew
+        renewed = []
+
+        async def slow_renew(key, owner, ttl):
+            renewing.set()
+            await finish.wait()
+            renewed.append(await renew(key, owner, ttl))
+            return renewed[-1]
+
+        backend.renew = slow_renew
+        lease = Lease(backend, "job", ttl=0.15)
+        await lease.acquire()
+        await renewing.wait()
+        release = asyncio.ensure_future(lease.release())
+        await asyncio.sleep(0.01)
+        # The renewal was not cancelled mid-command and runs to its end
+        finish.set()
+        await release
+        await asyncio.sleep(0.01)
+        assert renewed == [True]
+        assert await backend.get("job") is None
+
+    run(scenario())
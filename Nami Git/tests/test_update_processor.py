@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram import CallbackQuery, Chat, Message, Update, User  # noqa: E402
+
+from update_processor import ChatOrderedUpdateProcessor  # noqa: E402
+
+
+def message_update(update_id: int, chat_id: int, text: str = "hi") -> Update:
+    message = Message(update_id, datetime.datetime.now(), Chat(chat_id, "group"), from_user=User(7, "a", False),
+                      text=text)
+    return Update(update_id, message=message)
+
+
+def test_busy_chat_does_not_hold_the_other_chats():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(2)
+        finished = {}
+        started = time.monotonic()
+
+        async def handle(name, seconds):
+            await asyncio.sleep(seconds)
+            finished[name] = time.monotonic() - started
+
+        busy = [processor.process_update(message_update(i, -1), handle(f"busy {i}", 0.1)) for i in range(6)]
+        await asyncio.sleep(0.01)
+        await asyncio.gather(*busy, processor.process_update(message_update(10, -2), handle("other", 0)))
+        return finished
+
+    finished = asyncio.run(scenario())
+    # The busy chat's queue waits on its chat lock, not on the processor's two slots
+    assert finished["other"] < 0.05
+    assert sorted(finished, key=finished.get)[1:] == [f"busy {i}" for i in range(6)]
+
+
+@pytest.mark.parametrize("text", ["/", "/   ", "/ cancel"])
+def test_bare_slash_is_processed_in_order(text):
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(4)
+        processor.add_unordered_commands(["cancel"])
+        handled = []
+
+        async def handle():
+            handled.append(text)
+
+        await processor.process_update(message_update(1, -1, text), handle())
+        return handled
+
+    assert asyncio.run(scenario()) == [text]
+
+
+def test_one_chat_in_order_chats_in_parallel():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(4)
+        events = []
+
+        async def handle(name, seconds):
+            events.append(f"start {name}")
+            await asyncio.sleep(seconds)
+            events.append(f"end {name}")
+
+        await asyncio.gather(
+            processor.process_update(message_update(1, -1), handle("a1", 0.05)),
+            processor.process_update(message_update(2, -1), handle("a2", 0)),
+            processor.process_update(message_update(3, -2), handle("b1", 0)),
+        )
+        return events, processor._chat_locks
+
+    events, locks = asyncio.run(scenario())
+    assert events.index("end a1") < events.index("start a2")
+    # The other chat did not wait for the first one
+    assert events.index("end b1") < events.index("end a1")
+    assert locks == {}
+
+
+def callback_update(update_id: int, chat_id: int, data: str) -> Update:
+    message = Message(update_id, datetime.datetime.now(), Chat(chat_id, "group"), text="status")
+    return Update(update_id, callback_query=CallbackQuery(str(update_id), User(7, "a", False), "chat", message=message,
+                                                          data=data))
+
+
+@pytest.mark.parametrize("update, skips", [
+    (message_update(2, -1, "/cancel"), True),
+    (message_update(2, -1, "/Cancel@nami_bot now"), True),
+    (message_update(2, -1, "/quote"), False),
+    (message_update(2, -1, "cancel"), False),
+    (callback_update(2, -1, "cancel_download:7"), True),
+    (callback_update(2, -1, "anime_recommendations"), False),
+])
+def test_unordered_updates_skip_the_chat_lock(update, skips):
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(4)
+        processor.add_unordered_commands(["cancel"])
+        processor.add_unordered_callbacks([r"^cancel_download:"])
+        busy = asyncio.Event()
+        handled = []
+
+        async def hold_chat():
+            await busy.wait()
+
+        async def handle():
+            handled.append(update.update_id)
+
+        holder = asyncio.ensure_future(processor.process_update(message_update(1, -1), hold_chat()))
+        await asyncio.sleep(0.01)
+        waiting = asyncio.ensure_future(processor.process_update(update, handle()))
+        await asyncio.sleep(0.01)
+        handled_while_busy = bool(handled)
+        busy.set()
+        await asyncio.gather(holder, waiting)
+        return handled_while_busy
+
+    assert asyncio.run(scenario()) == skips
@@ -0,0 +1,145 @@
+import asyncio
+import datetime
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+
+from state_backend import MemoryBackend  # noqa: E402
+from work_split import WorkSplit, partition_of  # noqa: E402
+
+
+class FakeApplication:
+    def __init__(self):
+        self.bot = None
+        self.update_queue = asyncio.Queue()
+
+
+def message_update(update_id: int, chat_id: int) -> Update:
+    message = Message(update_id, datetime.datetime.now(), Chat(chat_id, "group"), from_user=User(7, "a", False),
+                      text="hi")
+    return Update(update_id, message=message)
+
+
+def test_partition_by_chat():
+    assert partition_of(message_update(1, -105), 16) == partition_of(message_update(2, -105), 16)
+    assert partition_of(message_update(3, 33), 16) == 33 % 16
+    assert partition_of(Update(21), 16) == 21 % 16
+
+
+def test_workers_split_the_partitions():
+    async def scenario():
+        backend = MemoryBackend()
+        first = WorkSplit(backend, FakeApplication(), partitions=8, worker_id="first")
+        second = WorkSplit(backend, FakeApplication(), partitions=8, worker_id="second")
+        await first.rebalance()
+        assert first.partitions_held == list(range(8))
+
+        # A second worker joins: the first lets half go on its next round, the second takes them
+        await second.rebalance()
+        await first.rebalance()
+        await second.rebalance()
+        assert len(first.partitions_held) == len(second.partitions_held) == 4
+        assert not set(first.partitions_held) & set(second.partitions_held)
+
+        # The second one leaves: the first takes everything back
+        await second.stop()
+        await first.rebalance()
+        assert first.partitions_held == list(range(8))
+        await first.stop()
+
+    asyncio.run(scenario())
+
+
+def test_publish_drops_redeliveries_and_keeps_chat_order():
+    async def scenario():
+        backend = MemoryBackend()
+        split = WorkSplit(backend, FakeApplication(), partitions=4, worker_id="only")
+        assert await split.publish(message_update(1, -9))
+        assert await split.publish(message_update(2, -9))
+        assert not await split.publish(message_update(1, -9))
+        key = f"updates:{-9 % 4}"
+        first = await backend.blpop([key], 1)
+        second = await backend.blpop([key], 1)
+        assert await backend.blpop([key], 0.1) is None
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert '"update_id": 1' in first[1] and '"update_id": 2' in second[1]
+
+
+def test_consume_feeds_the_application():
+    async def scenario():
+        backend = MemoryBackend()
+        application = FakeApplication()
+        split = WorkSplit(backend, application, partitions=2, worker_id="only")
+        await split.publish(message_update(5, -3))
+        split.start(poll=False)
+        try:
+            update = await asyncio.wait_for(application.update_queue.get(), 3)
+        finally:
+            await split.stop()
+        return update
+
+    assert asyncio.run(scenario()).update_id == 5
+
+
+class FlakyBackend:
+    """A MemoryBackend whose every call fails while ``down`` is set."""
+
+    def __init__(self):
+        self.memory = MemoryBackend()
+        self.down = False
+
+    def __getattr__(self, name):
+        method = getattr(self.memory, name)
+
+        async def call(*args, **kwargs):
+            if self.down:
+                raise ConnectionError("state backend unreachable")
+            return await method(*args, **kwargs)
+
+        return call
+
+
+class FakeBot:
+    def __init__(self):
+        self.pending = []
+
+    async def delete_webhook(self):
+        return True
+
+    async def get_updates(self, offset=None, timeout=None, allowed_updates=None):
+        await asyncio.sleep(0.02)
+        updates = [update for update in self.pending if offset is None or update.update_id >= offset]
+        self.pending = []
+        return updates
+
+
+def test_polling_survives_a_backend_outage():
+    async def scenario():
+        backend = FlakyBackend()
+        first, second = FakeApplication(), FakeApplication()
+        first.bot = second.bot = FakeBot()
+        workers = [WorkSplit(backend, first, partitions=2, worker_id="first"),
+                   WorkSplit(backend, second, partitions=2, worker_id="second")]
+        for worker in workers:
+            worker.start(poll=True)
+        try:
+            while not workers[0].partitions_held:
+                await asyncio.sleep(0.01)
+            # The poller and the worker waiting for its lease both run into the outage
+            backend.down = True
+            await asyncio.sleep(0.3)
+            backend.down = False
+            assert not any(task.done() for worker in workers for task in worker._tasks)
+            first.bot.pending = [message_update(9, -4)]
+            update = await asyncio.wait_for(first.update_queue.get(), 3)
+        finally:
+            for worker in workers:
+                await worker.stop()
+        return update
+
+    assert asyncio.run(scenario()).update_id == 9
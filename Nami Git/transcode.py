@@ -0,0 +1,69 @@
+"""Audio transcoding with ffmpeg, for the downloads Telegram cannot play as they are."""
+import asyncio
+import os
+
+# How many ffmpeg processes may run at once and how many threads each uses (override with environment variables)
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "1"))
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", "2"))
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+MP3_BITRATE = os.getenv("MP3_BITRATE", "192k")
+
+# Telegram only shows MP3 and M4A (AAC) files in its audio player, anything else needs transcoding
+NATIVE_AUDIO_EXTS = ("mp3", "m4a")
+# Tried first, so the fast path applies to most downloads
+NATIVE_AUDIO_FORMAT = "bestaudio[ext=m4a]/bestaudio[ext=mp3]/bestaudio/best"
+
+
+class TranscodeError(Exception):
+    """ffmpeg failed to convert the file."""
+
+
+def needs_transcode(path: str) -> bool:
+    return os.path.splitext(path)[1].lstrip(".").lower() not in NATIVE_AUDIO_EXTS
+
+
+class Transcoder:
+    """Runs at most ``workers`` ffmpeg processes; further requests wait their turn."""
+
+    def __init__(self, workers: int = TRANSCODE_WORKERS, threads: int = FFMPEG_THREADS) -> None:
+        self.workers = workers
+        self.threads = threads
+        self.waiting = 0
+        self.active = 0
+        self._semaphore = None
+
+    async def to_mp3(self, source: str) -> str:
+        """Convert an audio file to MP3 next to it and return the new path."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        target = os.path.splitext(source)[0] + ".mp3"
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_PATH, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+                "-i", source, "-vn", "-threads", str(self.threads),
+                "-codec:a", "libmp3lame", "-b:a", MP3_BITRATE, target,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                _, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+        if process.returncode != 0:
+            raise TranscodeError(stderr.decode(errors="replace").strip() or f"ffmpeg exited with {process.returncode}")
+        os.remove(source)
+        return target
+
+
+# The one transcode pool shared by the whole bot
+transcoder = Transcoder()
@@ -0,0 +1,143 @@
+"""Concurrent update processing that keeps updates from the same chat in order."""
+import asyncio
+import functools
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Pattern, Union
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# How many long-running handlers may run at once (override with environment variables)
+MAX_LONG_RUNNING_UPDATES = int(os.getenv("MAX_LONG_RUNNING_UPDATES", "4"))
+# How many updates may wait for their chat at once, across all chats
+MAX_WAITING_UPDATES = int(os.getenv("MAX_WAITING_UPDATES", "10000"))
+
+
+def long_running(callback: Callable) -> Callable:
+    """Tag a handler callback as long-running (yt-dlp downloads and the like)."""
+    callback.long_running = True
+    return callback
+
+
+def is_long_running(callback: Callable) -> bool:
+    return getattr(callback, "long_running", False)
+
+
+def unordered(callback: Callable) -> Callable:
+    """Tag a handler callback that need not wait for the earlier updates of its chat (cancelling and the like)."""
+    callback.unordered = True
+    return callback
+
+
+def is_unordered(callback: Callable) -> bool:
+    return getattr(callback, "unordered", False)
+
+
+class BackgroundJobs:
+    """Runs long-running handlers as background tasks, at most ``limit`` at once.
+
+    The handler returns as soon as its job is started, so the update gives back its
+    chat lock and slot right away and the chat's next updates (a Cancel button,
+    /quote) do not wait minutes for a download to finish.
+    """
+
+    def __init__(self, limit: int = MAX_LONG_RUNNING_UPDATES) -> None:
+        self.limit = limit
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def wrap(self, callback: Callable[[Any, Any], Awaitable[Any]]) -> Callable[[Any, Any], Awaitable[None]]:
+        @functools.wraps(callback)
+        async def start_job(update: Any, context: Any) -> None:
+            # Errors of the job still reach the application's error handlers
+            context.application.create_task(self._run(callback, update, context), update=update)
+
+        return start_job
+
+    async def _run(self, callback: Callable[[Any, Any], Awaitable[Any]], update: Any, context: Any) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit)
+        async with self._slots:
+            await callback(update, context)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates in parallel across chats, one at a time within a chat.
+
+    PTB's process_update (final, so not overridden here) holds a slot of its own
+    around do_process_update. Those are sized for MAX_WAITING_UPDATES, and the
+    ``max_concurrent_updates`` slots are taken here once the chat lock is held,
+    so updates queued behind one busy chat never keep the other chats waiting.
+
+    Commands and buttons tagged as unordered skip the chat lock altogether, so
+    /cancel is not stuck behind the chat's queued updates.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_waiting_updates: int = MAX_WAITING_UPDATES) -> None:
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(max(max_waiting_updates, max_concurrent_updates))
+        self.limit = max_concurrent_updates
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.unordered_commands = set()
+        # Callback data patterns of unordered buttons
+        self.unordered_callbacks: List[Pattern] = []
+        # chat id -> [lock, number of updates waiting on or holding it]
+        self._chat_locks: Dict[Any, list] = {}
+
+    def add_unordered_commands(self, commands: Iterable[str]) -> None:
+        self.unordered_commands.update(command.lower() for command in commands)
+
+    def add_unordered_callbacks(self, patterns: Iterable[Union[str, Pattern]]) -> None:
+        self.unordered_callbacks.extend(re.compile(pattern) for pattern in patterns)
+
+    def _is_unordered(self, update: Update) -> bool:
+        if update.callback_query is not None:
+            data = update.callback_query.data
+            return isinstance(data, str) and any(pattern.match(data) for pattern in self.unordered_callbacks)
+        message = update.effective_message
+        if message is None or not message.text or not message.text.startswith("/"):
+            return False
+        parts = message.text[1:].split(maxsplit=1)
+        # A bare "/" names no command
+        if not parts:
+            return False
+        return parts[0].split("@", 1)[0].lower() in self.unordered_commands
+
+    @staticmethod
+    def _chat_key(update: object) -> Optional[Any]:
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return ("user", update.effective_user.id)
+        return None
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit)
+        async with self._slots:
+            await coroutine
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._chat_key(update)
+        if key is None or self._is_unordered(update):
+            await self._run(coroutine)
+            return
+
+        entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
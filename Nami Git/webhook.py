@@ -0,0 +1,101 @@
+"""Webhook mode: Telegram posts updates to this FastAPI app instead of the bot long polling.
+
+Run it with ``BOT_MODE=webhook python3 "Nami Git.py"`` or directly with
+``uvicorn webhook:app``; more than one worker (``--workers N``) needs a shared
+STATE_BACKEND_URL, otherwise each worker keeps its own conversations and
+per-chat order. Needs WEBHOOK_URL (the public base URL)
+and WEBHOOK_SECRET (any random string, Telegram sends it back with every update).
+"""
+import importlib.util
+import os
+import secrets
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from telegram import Update
+
+import metrics
+from state_backend import state
+from work_split import WorkSplit
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Without a URL set_webhook fails at startup, and without a secret anybody could post forged updates
+if not WEBHOOK_URL.startswith(("https://", "http://")):
+    raise RuntimeError("Webhook mode needs WEBHOOK_URL, the bot's public base URL (e.g. https://nami.example.com)")
+if not WEBHOOK_SECRET:
+    raise RuntimeError("Webhook mode needs WEBHOOK_SECRET, a random string Telegram sends back with every update")
+
+
+def load_bot_module():
+    """Import "Nami Git.py", which cannot be imported by name because of the space."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Nami Git.py")
+    spec = importlib.util.spec_from_file_location("nami_git", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bot_module = load_bot_module()
+application = bot_module.build_application()
+# With a shared state backend, updates go through its queues so workers on other hosts share them
+work_split = WorkSplit(state, application) if state.shared else None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # run_polling() calls post_init/post_shutdown itself, here it is up to us
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    # Every worker registers the same webhook, which Telegram treats as a no-op
+    await application.bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    await application.start()
+    if work_split is not None:
+        work_split.start(poll=False)
+    yield
+    if work_split is not None:
+        await work_split.stop()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request,
+                           x_telegram_bot_api_secret_token: Optional[str] = Header(None)) -> Response:
+    """Check the secret token, queue the update and acknowledge right away."""
+    if not secrets.compare_digest(x_telegram_bot_api_secret_token or "", WEBHOOK_SECRET):
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    update = Update.de_json(await request.json(), application.bot)
+    if work_split is not None:
+        # Redeliveries of an update another worker already took are dropped
+        await work_split.publish(update)
+    else:
+        await application.update_queue.put(update)
+    return Response(status_code=200)
+
+
+@app.get("/metrics")
+async def serve_metrics() -> Response:
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/healthz")
+async def healthz() -> dict:
+    return {"status": "ok", "running": application.running}
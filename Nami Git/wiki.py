@@ -0,0 +1,120 @@
+"""Async Wikipedia summaries with a TTL cache and a title alias index."""
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+from urllib.parse import quote
+
+from http_client import client as http
+
+WIKI_API_URL = os.getenv("WIKI_API_URL", "https://en.wikipedia.org/api/rest_v1")
+
+# Cache size and lifetimes (override with environment variables)
+WIKI_CACHE_SIZE = int(os.getenv("WIKI_CACHE_SIZE", "5000"))
+WIKI_CACHE_TTL = float(os.getenv("WIKI_CACHE_TTL", str(6 * 3600)))
+WIKI_NEGATIVE_TTL = float(os.getenv("WIKI_NEGATIVE_TTL", str(15 * 60)))
+
+
+class WikiSummary(NamedTuple):
+    title: str
+    extract: str
+    url: str
+
+
+def normalize_title(title: str) -> str:
+    """Cache key for a title: "One_Piece", "One  Piece" and "one piece" all become "one piece"."""
+    return " ".join(title.replace("_", " ").split()).lower()
+
+
+class Wikipedia:
+    """Fetches page summaries from the REST API in a single request per lookup.
+
+    Summaries are cached by the normalized canonical title, and an alias
+    index maps every normalized query that led to a page (redirects, case
+    variants) to that title, so all of them share one entry.
+    """
+
+    def __init__(self, size: int = WIKI_CACHE_SIZE, ttl: float = WIKI_CACHE_TTL,
+                 negative_ttl: float = WIKI_NEGATIVE_TTL) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        # normalized canonical title -> (expires, summary or None when there is no such page)
+        self._summaries: "OrderedDict[str, Tuple[float, Optional[WikiSummary]]]" = OrderedDict()
+        # normalized query -> normalized canonical title
+        self._aliases: Dict[str, str] = {}
+        # normalized canonical title -> its aliases, so they are dropped together with the entry
+        self._aliases_of: Dict[str, Set[str]] = {}
+
+    def _cached(self, key: str) -> Tuple[bool, Optional[WikiSummary]]:
+        title = self._aliases.get(key, key)
+        entry = self._summaries.get(title)
+        if entry is None or entry[0] < time.time():
+            return False, None
+        self._summaries.move_to_end(title)
+        return True, entry[1]
+
+    def _store(self, key: str, summary: Optional[WikiSummary]) -> None:
+        title = normalize_title(summary.title) if summary is not None else key
+        ttl = self.ttl if summary is not None else self.negative_ttl
+        self._summaries[title] = (time.time() + ttl, summary)
+        self._summaries.move_to_end(title)
+        if key != title:
+            self._aliases[key] = title
+            self._aliases_of.setdefault(title, set()).add(key)
+        while len(self._summaries) > self.size:
+            evicted, _ = self._summaries.popitem(last=False)
+            for alias in self._aliases_of.pop(evicted, ()):
+                if self._aliases.get(alias) == evicted:
+                    del self._aliases[alias]
+
+    async def fetch(self, query: str) -> Optional[WikiSummary]:
+        """Fetch the summary, retrying in title case when the query as typed has no page."""
+        query = " ".join(query.split())
+        summary = await self._fetch_summary(query)
+        if summary is None and query.title() != query:
+            summary = await self._fetch_summary(query.title())
+        return summary
+
+    async def _fetch_summary(self, title: str) -> Optional[WikiSummary]:
+        """One request to the summary endpoint, which follows redirects itself."""
+        response = await http.get(f"{WIKI_API_URL}/page/summary/{quote(title.replace(' ', '_'), safe='')}")
+        if response.status == 404:
+            return None
+        response.raise_for_status()
+        data = response.json()
+        if not data.get("extract"):
+            return None
+        return WikiSummary(
+            title=data["title"],
+            extract=data["extract"],
+            url=data.get("content_urls", {}).get("desktop", {}).get("page", ""),
+        )
+
+    async def summary(self, query: str) -> Optional[WikiSummary]:
+        """The summary of the page the query leads to, or None if there is none."""
+        key = normalize_title(query)
+        found, summary = self._cached(key)
+        if found:
+            self.hits += 1
+            return summary
+        self.misses += 1
+        summary = await self.fetch(query)
+        self._store(key, summary)
+        return summary
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._summaries),
+            "aliases": len(self._aliases),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# The one Wikipedia client shared by the whole bot
+wikipedia = Wikipedia()
@@ -0,0 +1,153 @@
+"""Several bot workers sharing the updates through the state backend, each update handled once."""
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Dict, List
+
+from telegram import Update
+from telegram.ext import Application
+
+from state_backend import LEASE_TTL, WORKER_ID, Lease, StateBackend
+
+# Updates are spread over this many queues by chat (override with environment variables)
+UPDATE_PARTITIONS = int(os.getenv("UPDATE_PARTITIONS", "16"))
+# How long the poller waits for new updates in one getUpdates call, in seconds
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "25"))
+# How long an update id is remembered to drop redeliveries
+UPDATE_DEDUP_TTL = float(os.getenv("UPDATE_DEDUP_TTL", "3600"))
+
+
+def partition_of(update: Update, partitions: int) -> int:
+    """Updates of one chat always go to the same partition, so they stay in order."""
+    if update.effective_chat is not None:
+        return update.effective_chat.id % partitions
+    if update.effective_user is not None:
+        return update.effective_user.id % partitions
+    return update.update_id % partitions
+
+
+class WorkSplit:
+    """Routes every update to one of ``partitions`` queues in the state backend and has
+    each worker lease its fair share of the partitions and process their updates.
+
+    Workers announce themselves with a heartbeat; a worker holding more than
+    partitions / live workers lets the extra ones go, so a new worker picks them
+    up, and partitions of a dead worker are taken over once its leases expire.
+    With long polling only one worker at a time, the holder of the "poller" lease,
+    calls getUpdates, since Telegram allows a single consumer per bot.
+    """
+
+    def __init__(self, backend: StateBackend, application: Application,
+                 partitions: int = UPDATE_PARTITIONS, worker_id: str = WORKER_ID) -> None:
+        self.backend = backend
+        self.application = application
+        self.partitions = partitions
+        self.worker_id = worker_id
+        self._leases: Dict[int, Lease] = {}
+        self._tasks = []
+
+    async def publish(self, update: Update) -> bool:
+        """Queue an update for whichever worker holds its partition. Returns False for redeliveries."""
+        if not await self.backend.claim(f"update:{update.update_id}", self.worker_id, UPDATE_DEDUP_TTL):
+            return False
+        partition = partition_of(update, self.partitions)
+        await self.backend.rpush(f"updates:{partition}", update.to_json())
+        return True
+
+    @property
+    def partitions_held(self) -> List[int]:
+        return sorted(self._leases)
+
+    async def rebalance(self) -> None:
+        """Send a heartbeat, then take or let go of partitions until this worker holds its share."""
+        now = time.time()
+        await self.backend.zadd("workers", self.worker_id, now)
+        await self.backend.zrem_below("workers", now - LEASE_TTL)
+        live = len(await self.backend.zrange_by_score("workers", now - LEASE_TTL))
+        share = math.ceil(self.partitions / max(live, 1))
+        for partition, lease in list(self._leases.items()):
+            if not lease.held:
+                del self._leases[partition]
+        for partition in list(self._leases)[share:]:
+            await self._leases.pop(partition).release()
+        for partition in range(self.partitions):
+            if len(self._leases) >= share:
+                break
+            if partition in self._leases:
+                continue
+            lease = Lease(self.backend, f"partition:{partition}")
+            if await lease.acquire(wait=False):
+                self._leases[partition] = lease
+
+    async def _balance(self) -> None:
+        while True:
+            try:
+                await self.rebalance()
+            except Exception as e:
+                print(f"Error balancing update partitions: {e}")
+            await asyncio.sleep(LEASE_TTL / 3)
+
+    async def _consume(self) -> None:
+        while True:
+            keys = [f"updates:{partition}" for partition in self._leases]
+            if not keys:
+                await asyncio.sleep(1)
+                continue
+            try:
+                popped = await self.backend.blpop(keys, 1)
+            except Exception as e:
+                print(f"Error reading updates from the state backend: {e}")
+                await asyncio.sleep(1)
+                continue
+            if popped is not None:
+                update = Update.de_json(json.loads(popped[1]), self.application.bot)
+                await self.application.update_queue.put(update)
+
+    async def poll_once(self) -> None:
+        """Fetch one batch of updates and queue them."""
+        # The offset lives in the backend, so the next poller carries on where this one stopped
+        offset = int(await self.backend.get("poller:offset") or 0)
+        updates = await self.application.bot.get_updates(offset=offset or None, timeout=POLL_TIMEOUT,
+                                                         allowed_updates=Update.ALL_TYPES)
+        # Updates published before a failure are dropped as redeliveries on the next try
+        for update in updates:
+            await self.publish(update)
+        if updates:
+            await self.backend.set("poller:offset", str(updates[-1].update_id + 1))
+
+    async def _poll(self) -> None:
+        while True:
+            lease = Lease(self.backend, "poller")
+            await lease.acquire(poll=1)
+            print(f"Worker {self.worker_id} is polling for updates")
+            try:
+                await self.application.bot.delete_webhook()
+                while lease.held:
+                    try:
+                        await self.poll_once()
+                    except Exception as e:
+                        print(f"Error polling for updates: {e}")
+                        await asyncio.sleep(1)
+            except Exception as e:
+                print(f"Error taking over update polling: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await lease.release()
+
+    def start(self, poll: bool) -> None:
+        """Start taking partitions, and with ``poll`` compete for the poller lease."""
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._balance()), loop.create_task(self._consume())]
+        if poll:
+            self._tasks.append(loop.create_task(self._poll()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for lease in self._leases.values():
+            await lease.release()
+        self._leases.clear()
+        await self.backend.zrem("workers", self.worker_id)